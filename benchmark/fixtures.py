@@ -0,0 +1,316 @@
+from common import constants
+
+import datetime
+import zipfile
+import random
+import csv
+import io
+import os
+
+# Synthetic inputs shaped like each upstream source. Sizes grow linearly with scale and the same
+# seed always produces the same files, so runs are comparable.
+DEFAULT_SEED = 1
+START_DATE = datetime.date(2020, 3, 1)
+STATES = [state for state in constants.state_list if state in constants.state_abbrev_map]
+STATE_NAMES = dict([(constants.state_abbrev_map[state], state) for state in STATES])
+COUNTY_SUFFIXES = ['County', 'Parish', 'Borough']
+RACE_VALUES = ['0.{:03d}'.format(value) for value in range(1, 1000, 37)] + ['<.01', 'NR', '']
+
+
+def get_random(seed=DEFAULT_SEED):
+    return random.Random(seed)
+
+
+def dates(count, start=START_DATE):
+    return [start + datetime.timedelta(days=offset) for offset in range(count)]
+
+
+def write_csv(path, header, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+    return path
+
+
+def make_counties(scale, seed=DEFAULT_SEED):
+    # (county, state abbreviation, geo_id, latitude, longitude)
+    generator = get_random(seed)
+    counties = []
+    for state_index, state in enumerate(STATES):
+        state_abbrev = constants.state_abbrev_map[state]
+        for county_index in range(max(int(60 * scale), 1)):
+            county = 'Synthetic {} {}'.format(county_index, generator.choice(COUNTY_SUFFIXES))
+            geo_id = '{:02d}{:03d}'.format(state_index + 1, county_index + 1)
+            latitude = round(25 + state_index * 0.4 + generator.random() * 0.3, 3)
+            longitude = round(-120 + county_index * 0.05 + generator.random() * 0.03, 3)
+            counties.append((county, state_abbrev, geo_id, latitude, longitude))
+
+    return counties
+
+
+def census_adjacency_text(scale, seed=DEFAULT_SEED):
+    generator = get_random(seed)
+    counties = make_counties(scale, seed)
+    lines = []
+    for county, state_abbrev, geo_id, _, _ in counties:
+        name = '"{}, {}"'.format(county, state_abbrev)
+        lines.append('\t'.join([name, geo_id, name, geo_id]))
+        for neighbour in generator.sample(counties, min(6, len(counties))):
+            neighbour_name = '"{}, {}"'.format(neighbour[0], neighbour[1])
+            lines.append('\t'.join(['', '', neighbour_name, neighbour[2]]))
+
+    return '\n'.join(lines) + '\n'
+
+
+def cdc_state_trends(scale, seed=DEFAULT_SEED):
+    generator = get_random(seed)
+    records = []
+    for state in STATES:
+        total_cases = 0
+        total_deaths = 0
+        for date in dates(int(365 * scale)):
+            new_cases = generator.randint(0, 5000)
+            new_deaths = generator.randint(0, 80)
+            total_cases += new_cases
+            total_deaths += new_deaths
+            records.append({
+                'geography': state,
+                'state': state,
+                'date': date.strftime('%b %d %Y'),
+                'tot_cases': total_cases,
+                'tot_deaths': total_deaths,
+                'New_case': new_cases,
+                'new_death': new_deaths,
+                'new_test_results_reported': generator.choice([None, generator.randint(0, 50000)]),
+                'percent_positive_7_day': generator.random()
+            })
+
+    return records
+
+
+def cdc_vaccines(records):
+    vaccines = {}
+    for record in records[::3]:
+        iso_date = datetime.datetime.strptime(record['date'], '%b %d %Y').isoformat()
+        state_abbrev = constants.state_abbrev_map[record['state']]
+        vaccines.setdefault(iso_date, {})[state_abbrev] = {
+            'Administered': record['tot_cases'] * 2,
+            'Distributed': record['tot_cases'] * 3,
+            'Administered_Dose1': record['tot_cases'],
+            'Administered_Dose2': record['tot_deaths']
+        }
+
+    return vaccines
+
+
+CDC_HOSPITALIZATION_CATEGORIES = [
+    (age, 'Overall', 'Overall') for age in ['Overall', '0-4 yr', '5-17 yr', '18-49 yr', '50-64 yr', '65+ yr']
+] + [('Overall', sex, 'Overall') for sex in ['Male', 'Female']] + \
+    [('Overall', 'Overall', race) for race in ['White', 'Black', 'Hispanic', 'Asian/Pacific Islander']]
+
+
+def cdc_hospitalizations(scale, seed=DEFAULT_SEED):
+    # Shaped like the 'datadownload' list of the COVID-NET response: one row per site, week and category
+    generator = get_random(seed)
+    records = []
+    for catchment in STATES[:14] + ['Entire Network']:
+        cumulative_rate = 0.0
+        for week in range(max(int(104 * scale), 1)):
+            for age, sex, race in CDC_HOSPITALIZATION_CATEGORIES:
+                weekly_rate = round(generator.random() * 15, 1)
+                cumulative_rate += weekly_rate
+                records.append({
+                    'catchment': catchment,
+                    'network': 'COVID-NET',
+                    'mmwr-year': str(2020 + week // 52),
+                    'mmwr-week': str(week % 52 + 1),
+                    'age_category': age,
+                    'sex_category': sex,
+                    'race_category': race,
+                    'cumulative-rate': generator.choice([None, '{:.1f}'.format(cumulative_rate)]),
+                    'weekly-rate': generator.choice([None, '{:.1f}'.format(weekly_rate)])
+                })
+
+    return records
+
+
+def population_estimates(seed=DEFAULT_SEED):
+    generator = get_random(seed)
+    estimates = {2019: {}, 2020: {}, 2021: {}}
+    for state in STATES:
+        population = generator.randint(500000, 40000000)
+        for year in sorted(estimates.keys()):
+            estimates[year][state] = population
+            population += generator.randint(-50000, 150000)
+
+    return estimates
+
+
+def race_header(race_fields):
+    header = []
+    for field in race_fields:
+        key = field.get('field')
+        if isinstance(key, str) and key != 'date' and key not in header:
+            header.append(key)
+
+    return header
+
+
+def kff_race_files(directory, race_fields, suffix, scale, seed=DEFAULT_SEED):
+    # One file per week, one row per state plus a couple of rows that are not states
+    generator = get_random(seed)
+    header = race_header(race_fields)
+    paths = []
+    for week in range(max(int(52 * scale), 1)):
+        date = START_DATE + datetime.timedelta(weeks=week)
+        rows = []
+        for location in STATES + ['United States', 'Notes']:
+            row = []
+            for column in header:
+                if column == 'Location':
+                    row.append(location)
+                elif column == 'Race Categories Include Hispanic Individuals':
+                    row.append(generator.choice(['Yes', 'No']))
+                else:
+                    row.append(generator.choice(RACE_VALUES))
+            rows.append(row)
+
+        filename = '{} {}.csv'.format(date.strftime('%Y%m%d'), suffix)
+        paths.append(write_csv('/'.join([directory, filename]), header, rows))
+
+    return paths
+
+
+GOOGLE_HEADER = [
+    'country_region_code', 'country_region', 'sub_region_1', 'sub_region_2', 'metro_area', 'iso_3166_2_code',
+    'census_fips_code', 'place_id', 'date', 'retail_and_recreation_percent_change_from_baseline',
+    'grocery_and_pharmacy_percent_change_from_baseline', 'parks_percent_change_from_baseline',
+    'transit_stations_percent_change_from_baseline', 'workplaces_percent_change_from_baseline',
+    'residential_percent_change_from_baseline'
+]
+
+
+def google_mobility_zip(directory, members, scale, seed=DEFAULT_SEED):
+    generator = get_random(seed)
+    counties = make_counties(scale / 12, seed)
+    path = '/'.join([directory, 'Region_Mobility_Report_CSVs.zip'])
+    with zipfile.ZipFile(path, mode='w', compression=zipfile.ZIP_DEFLATED) as zipfile_object:
+        for member_index, member in enumerate(sorted(members)):
+            member_file = io.StringIO()
+            writer = csv.writer(member_file)
+            writer.writerow(GOOGLE_HEADER)
+            start = datetime.date(2020 + member_index, 1, 1)
+            for date in dates(int(90 * scale) or 1, start):
+                # State level rows have no county and are filtered out by the loader
+                for state in STATES[:5]:
+                    writer.writerow(['US', 'United States', state, '', '', '', '', '', date.isoformat()] + [0] * 6)
+
+                for county, state_abbrev, geo_id, _, _ in counties:
+                    changes = [generator.choice(['', generator.randint(-90, 90)]) for _ in range(6)]
+                    writer.writerow(['US', 'United States', STATE_NAMES[state_abbrev], county, '', '',
+                                     geo_id, '', date.isoformat()] + changes)
+
+            zipfile_object.writestr(member, member_file.getvalue())
+
+    return path
+
+
+WAPO_HEADER = [
+    'id', 'name', 'date', 'manner_of_death', 'armed', 'age', 'gender', 'race', 'city', 'state',
+    'signs_of_mental_illness', 'threat_level', 'flee', 'body_camera', 'longitude', 'latitude', 'is_geocoding_exact'
+]
+
+
+def known_locations(scale, seed=DEFAULT_SEED):
+    # Shaped like census.GeoLocations.get_data()
+    return [
+        {'longitude': longitude, 'latitude': latitude, 'geo_id': geo_id, 'county': county,
+         'city': 'City {}'.format(geo_id), 'state': STATE_NAMES[state_abbrev]}
+        for county, state_abbrev, geo_id, latitude, longitude in make_counties(scale / 4, seed)
+    ]
+
+
+def wapo_police_shootings(directory, locations, scale, seed=DEFAULT_SEED):
+    # Every record resolves from known locations, either exactly or through the nearest neighbour index
+    generator = get_random(seed)
+    rows = []
+    for index in range(int(8000 * scale)):
+        location = generator.choice(locations)
+        latitude, longitude = location['latitude'], location['longitude']
+        if index % 5 == 0:
+            latitude, longitude = round(latitude + 0.0005, 4), round(longitude - 0.0005, 4)
+
+        date = START_DATE + datetime.timedelta(days=index % 1500)
+        rows.append([
+            index, 'Person {}'.format(index), date.isoformat(), 'shot', 'gun', generator.choice(['', 25, 40]),
+            generator.choice(['M', 'F']), generator.choice(['W', 'B', 'H', '']), location['city'],
+            constants.state_abbrev_map[location['state']], generator.choice(['True', 'False']), 'attack', 'Not fleeing',
+            generator.choice(['True', 'False']), longitude, latitude, 'True'
+        ])
+
+    return write_csv('/'.join([directory, 'fatal-police-shootings-data.csv']), WAPO_HEADER, rows)
+
+
+def apha_declarations(fieldnames, locations, scale, seed=DEFAULT_SEED):
+    # Rows as csv.DictReader reads the published sheet: a title row, then the header row, then declarations
+    generator = get_random(seed)
+    records = [dict([(field_name, '') for field_name in fieldnames]), dict(zip(fieldnames, fieldnames))]
+    records[0][fieldnames[0]] = 'Analysis: Declarations of Racism as a Public Health Crisis'
+    for index in range(int(2000 * scale)):
+        location = generator.choice(locations)
+        date = START_DATE + datetime.timedelta(days=index % 700)
+        declaration = {
+            'State': location['state'],
+            'Region': generator.choice(['Northeast', 'Midwest', 'South', 'West']),
+            'Address': '{} {}'.format(location['city'], location['state']),
+            'Latitude': str(round(location['latitude'] + 0.0005 * (index % 3), 4)),
+            'Longitude': str(round(location['longitude'] - 0.0005 * (index % 3), 4)),
+            'Type': generator.choice(['City', 'County', 'State']),
+            'Sub-Type': generator.choice(['Council', 'Board of Health', 'Commission']),
+            'Entity': 'Entity {}'.format(index),
+            'Political Affiliation': generator.choice(['D', 'R', '']),
+            'Declaration': generator.choice(['Resolution', 'Proclamation', 'Ordinance']),
+            'Date of Declaration': '{}/{}/{}'.format(date.month, date.day, date.year),
+            'Link': 'https://example.org/declarations/{}'.format(index),
+            'Notes': ''
+        }
+        records.append(dict([(field_name, declaration[field_name]) for field_name in fieldnames]))
+
+    return records
+
+
+ELAB_HEADER = ['type', 'GEOID', 'racial_majority', 'week_date', 'week', 'filings_2020', 'filings_avg', 'city',
+               'last_updated']
+
+
+def elab_weekly_evictions(directory, scale, seed=DEFAULT_SEED):
+    generator = get_random(seed)
+    counties = make_counties(scale / 10, seed)
+    rows = []
+    for week in range(max(int(100 * scale), 1)):
+        date = START_DATE + datetime.timedelta(weeks=week)
+        for county, state_abbrev, geo_id, _, _ in counties:
+            rows.append([
+                'Census Tract', '{}{:06d}'.format(geo_id, generator.randint(0, 999999)),
+                generator.choice(['White', 'Black', 'Latinx', 'NA']), date.isoformat(), week,
+                generator.randint(0, 40), '{:.2f}'.format(generator.random() * 20),
+                '{}, {}'.format('City {}'.format(geo_id), state_abbrev), '2021-12-31'
+            ])
+
+    return write_csv('/'.join([directory, 'all_sites_weekly_2020_2021.csv']), ELAB_HEADER, rows)
+
+
+def generic_records(scale, seed=DEFAULT_SEED):
+    generator = get_random(seed)
+    return [
+        {'state': generator.choice(STATES), 'date': date_value.isoformat(), 'value': str(generator.randint(0, 1000)),
+         'rate': '{:.3f}'.format(generator.random()), 'flag': generator.choice(['yes', 'no', ''])}
+        for date_value in [START_DATE + datetime.timedelta(days=index % 1000) for index in range(int(50000 * scale))]
+    ]
+
+
+def make_directory(path):
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,279 @@
+from benchmark import fixtures, sqlite
+from common import http, instrumentation, mirror, stream, utils
+from data import database
+from resource import abstract, apha, cdc, census, elab, google, kff, wapo
+
+import tracemalloc
+import tempfile
+import shutil
+import json
+import time
+import sys
+import os
+import re
+
+# Runs each module's transform and save over synthetic fixtures against a SQLite stand-in and reports
+# throughput and peak Python memory. Nothing touches the network or MySQL.
+#   python -m benchmark.run [--scale=1] [--modules=id,id] [--output=results.json] [--no-memory]
+
+
+def local_download(path):
+    # Nothing is recorded for a url outside the download cache, so acknowledging is a no-op
+    return http.Download('file://{}'.format(path), path, True)
+
+
+def population_model():
+    model = census.PopulationModel()
+    model.estimates = fixtures.population_estimates()
+    model.last_year = max(model.estimates.keys())
+    return model
+
+
+def setup_census_county_geo_codes(directory, scale):
+    module = census.CountyGeoCodes()
+    module.raw_data = fixtures.census_adjacency_text(scale)
+    module.download = local_download(directory)
+    return module.save
+
+
+def setup_census_population(directory, scale):
+    module = census.Population()
+    module.raw_data = population_model()
+    return module.save
+
+
+def setup_cdc_state_trends(directory, scale):
+    module = cdc.StateTrends()
+    records = fixtures.cdc_state_trends(scale)
+    module.vaccines_state_trend = fixtures.cdc_vaccines(records)
+    module.population_model = population_model()
+
+    def run():
+        module.raw_data = records
+        module.trend_metrics = cdc.compute_trend_metrics(records)
+        module.save()
+
+    return run
+
+
+def setup_cdc_hospitalizations(directory, scale):
+    module = cdc.Hospitalizations()
+    module.raw_data = fixtures.cdc_hospitalizations(scale)
+    return module.save
+
+
+def setup_kff_race(module_class, suffix):
+    def setup(directory, scale):
+        module = module_class()
+        kff.repository_mirror = mirror.RepositoryMirror(kff.GIT_REPO_URL, 'COVID-19-Data', parent_dir=directory)
+        module.raw_data = fixtures.kff_race_files(directory, module.fields, suffix, scale)
+        return module.save
+
+    return setup
+
+
+def setup_google_mobility(directory, scale):
+    module = google.MobilityReport()
+    module.zip_path = fixtures.google_mobility_zip(directory, google.FILENAME_SET, scale)
+    module.raw_data = sorted(google.FILENAME_SET)
+    module.download = local_download(module.zip_path)
+    return module.save
+
+
+def setup_wapo_police_shootings(directory, scale):
+    module = wapo.PoliceShootings()
+    module.geo_locations = fixtures.known_locations(scale)
+    path = fixtures.wapo_police_shootings(directory, module.geo_locations, scale)
+    module.raw_data = stream.file_csv_stream(path)
+    module.download = local_download(path)
+    return module.save
+
+
+def setup_apha_racism_declarations(directory, scale):
+    # The saved counties are part of the setup; the geocoder is never reached since every
+    # declaration sits on or next to a known location
+    counties = census.CountyGeoCodes()
+    counties.raw_data = fixtures.census_adjacency_text(scale / 4)
+    counties.download = local_download(directory)
+    counties.save()
+
+    module = apha.RacismDeclarations()
+    module.geo_locations = fixtures.known_locations(scale)
+    module.raw_data = fixtures.apha_declarations(apha.FIELDNAMES, module.geo_locations, scale)
+    return module.save
+
+
+def setup_elab_weekly_evictions(directory, scale):
+    module = elab.WeeklyEvictions()
+    for location in fixtures.known_locations(scale):
+        module.geo_locations[location['geo_id']] = location
+
+    path = fixtures.elab_weekly_evictions(directory, scale)
+    module.raw_data = stream.file_csv_stream(path)
+    module.download = local_download(path)
+    return module.save
+
+
+class GenericResource(abstract.Resource):
+
+    def __init__(self):
+        super(GenericResource, self).__init__()
+        self.table_name = 'benchmark_resource'
+        self.natural_key = ('state', 'date')
+        self.fields = [
+            {'field': 'state'},
+            {'field': 'date', 'data': lambda record, key, cache: utils.ensure_iso_date(record[key])},
+            {'field': 'value', 'data': lambda record, key, cache: utils.ensure_int(record[key])},
+            {'field': 'rate', 'data': lambda record, key, cache: utils.ensure_float(record[key])},
+            {'field': 'flag', 'data': lambda record, key, cache: utils.bool_to_int(record[key])},
+            {'column': 'source', 'data': 'benchmark'}
+        ]
+
+
+def setup_resource_save(directory, scale):
+    module = GenericResource()
+    module.raw_data = fixtures.generic_records(scale)
+    return module.save
+
+
+def setup_database_insert_many(directory, scale):
+    rows = [(record['state'], record['date'], record['value'], record['rate'], record['flag'])
+            for record in fixtures.generic_records(scale)]
+
+    def run():
+        mysql_database = database.Database()
+        mysql_database.connect()
+        mysql_database.start_transaction()
+        for batch in utils.batched(rows, 1000):
+            mysql_database.insert_many('benchmark_insert', ('state', 'date', 'value', 'rate', 'flag'), batch)
+
+        mysql_database.commit()
+        mysql_database.close()
+
+    return run
+
+
+BENCHMARKS = [
+    {'id': 'census_county_geo_codes', 'setup': setup_census_county_geo_codes, 'table': 'county_location_data'},
+    {'id': 'census_population', 'setup': setup_census_population, 'table': 'population'},
+    {'id': 'cdc_state_trends', 'setup': setup_cdc_state_trends, 'table': 'state_trend_data'},
+    {'id': 'cdc_hospitalizations', 'setup': setup_cdc_hospitalizations, 'table': 'cdc_hospitalizations'},
+    {
+        'id': 'kff_cases_by_race',
+        'setup': setup_kff_race(kff.CasesByRace, 'Cases by RE'),
+        'table': 'cases_by_race_ethnicity'
+    },
+    {
+        'id': 'kff_deaths_by_race',
+        'setup': setup_kff_race(kff.DeathsByRace, 'Deaths by RE'),
+        'table': 'deaths_by_race_ethnicity'
+    },
+    {
+        'id': 'kff_vaccinations_by_race',
+        'setup': setup_kff_race(kff.VaccinationsByRace, 'Vaccinations by RE'),
+        'table': 'vaccinations_by_race_ethnicity'
+    },
+    {'id': 'google_mobility_report', 'setup': setup_google_mobility, 'table': 'google_mobility'},
+    {'id': 'wapo_police_shootings', 'setup': setup_wapo_police_shootings, 'table': 'police_shooting_data'},
+    {
+        'id': 'apha_racism_declarations',
+        'setup': setup_apha_racism_declarations,
+        'table': 'apha_map'
+    },
+    {'id': 'elab_weekly_evictions', 'setup': setup_elab_weekly_evictions, 'table': 'weekly_evictions'},
+    {'id': 'resource_save', 'setup': setup_resource_save, 'table': 'benchmark_resource'},
+    {'id': 'database_insert_many', 'setup': setup_database_insert_many, 'table': 'benchmark_insert'}
+]
+
+
+def run_once(benchmark, scale, trace_memory):
+    # Every run starts from fresh fixtures and an empty database
+    directory = tempfile.mkdtemp(prefix='refocus-benchmark-')
+    database_path = '/'.join([directory, 'benchmark.sqlite3'])
+    try:
+        sqlite.install(database_path)
+        # An empty boundary index keeps county lookups on the fixture locations instead of downloading shapes
+        census.county_boundaries = census.CountyBoundaries()
+        run = benchmark['setup'](directory, scale)
+
+        instrumentation.start_module(benchmark['id'])
+        if trace_memory:
+            tracemalloc.start()
+
+        start_time = time.perf_counter()
+        try:
+            run()
+        finally:
+            elapsed = time.perf_counter() - start_time
+            peak_memory = tracemalloc.get_traced_memory()[1] if trace_memory else None
+            if trace_memory:
+                tracemalloc.stop()
+            metrics = instrumentation.finish_module()
+
+        return {
+            'seconds': elapsed,
+            'peak_memory': peak_memory,
+            'rows_written': metrics.counters.get('rows_written', 0),
+            'rows_stored': sqlite.count_rows(database_path, benchmark['table']),
+            'phases': metrics.to_dict()['phases']
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def run_benchmark(benchmark, scale, trace_memory=True):
+    # Timing and memory are measured in separate runs since tracing allocations slows everything down
+    result = run_once(benchmark, scale, False)
+    if trace_memory:
+        result['peak_memory'] = run_once(benchmark, scale, True)['peak_memory']
+
+    result['id'] = benchmark['id']
+    result['scale'] = scale
+    result['rows_per_second'] = result['rows_written'] / result['seconds'] if result['seconds'] > 0 else 0.0
+    return result
+
+
+def format_result(result):
+    peak_memory = '{:.1f} MB'.format(result['peak_memory'] / (1024 * 1024)) \
+        if result['peak_memory'] is not None else 'n/a'
+    return '{:<28} {:>9} rows {:>9.3f}s {:>11.0f} rows/s  peak {:>10}  {}'.format(
+        result['id'], result['rows_written'], result['seconds'], result['rows_per_second'], peak_memory,
+        ', '.join(['{} {:.3f}s'.format(name, seconds) for name, seconds in sorted(result['phases'].items())])
+    )
+
+
+if __name__ == '__main__':
+    scale_arg_pattern = re.compile('^--scale=(\\d+(\\.\\d+)?)$')
+    modules_arg_pattern = re.compile('^--modules=(.*)$')
+    output_arg_pattern = re.compile('^--output=(.*)$')
+
+    scale = 1.0
+    selected_ids = None
+    output_path = None
+    trace_memory = True
+    for arg in sys.argv[1:]:
+        if scale_arg_pattern.match(arg):
+            scale = float(scale_arg_pattern.match(arg).group(1))
+        elif modules_arg_pattern.match(arg):
+            selected_ids = set(modules_arg_pattern.match(arg).group(1).split(','))
+        elif output_arg_pattern.match(arg):
+            output_path = output_arg_pattern.match(arg).group(1)
+        elif arg == '--no-memory':
+            trace_memory = False
+        else:
+            print('Unknown argument {}'.format(arg))
+            sys.exit(1)
+
+    # Watermarks would read from the database; benchmarks always load everything
+    os.environ.pop('INCREMENTAL', None)
+
+    results = []
+    for benchmark in BENCHMARKS:
+        if selected_ids is None or benchmark['id'] in selected_ids:
+            result = run_benchmark(benchmark, scale, trace_memory)
+            utils.log(format_result(result))
+            results.append(result)
+
+    if output_path is not None:
+        with open(output_path, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
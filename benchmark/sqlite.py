@@ -0,0 +1,95 @@
+from data import database
+
+import threading
+import sqlite3
+
+# Stands in for MySQL while benchmarking: the real Database batching and transaction handling run unchanged,
+# only the bulk engine and the connection are swapped for SQLite.
+
+
+def quote(identifier):
+    return '"{}"'.format(identifier.replace('"', '""'))
+
+
+# Creates tables and columns on first use since the benchmarks start from an empty database. Like the MySQL
+# tables, each one gets an auto-increment id that other tables refer to.
+class SqliteEngine:
+
+    name = 'sqlite'
+    connection_options = {}
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.table_columns = {}
+
+    def ensure_table(self, cursor, table_name, columns, natural_key):
+        with self.lock:
+            if table_name not in self.table_columns:
+                cursor.execute('CREATE TABLE IF NOT EXISTS {} ({})'.format(
+                    quote(table_name), ', '.join(['"id" INTEGER PRIMARY KEY'] + [quote(column) for column in columns])
+                ))
+                self.table_columns[table_name] = set([row[1] for row in cursor.execute(
+                    'PRAGMA table_info({})'.format(quote(table_name))
+                ).fetchall()])
+
+            known_columns = self.table_columns[table_name]
+            for column in columns:
+                if column not in known_columns:
+                    cursor.execute('ALTER TABLE {} ADD COLUMN {}'.format(quote(table_name), quote(column)))
+                    known_columns.add(column)
+
+            if natural_key is not None:
+                cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS {} ON {} ({})'.format(
+                    quote('{}_natural_key'.format(table_name)), quote(table_name),
+                    ', '.join([quote(column) for column in natural_key])
+                ))
+
+    def write(self, cursor, table_name, columns, rows, natural_key=None):
+        self.ensure_table(cursor, table_name, columns, natural_key)
+        statement = '{} INTO {} ({}) VALUES ({})'.format(
+            'INSERT OR REPLACE' if natural_key is not None else 'INSERT',
+            quote(table_name),
+            ', '.join([quote(column) for column in columns]),
+            ', '.join(['?'] * len(columns))
+        )
+        cursor.executemany(statement, rows)
+
+
+class SqliteDatabase(database.Database):
+
+    path = None
+    engine = None
+
+    def __init__(self, debug=False, enable_cache=False, bulk_engine=None):
+        super(SqliteDatabase, self).__init__(debug, enable_cache, bulk_engine)
+        self.bulk_engine = SqliteDatabase.engine
+
+    def connect(self):
+        if self.is_connected():
+            return
+
+        self.connection = sqlite3.connect(SqliteDatabase.path, check_same_thread=False)
+
+    # SqliteEngine creates columns and the natural key index along with the table
+    def ensure_unique_index(self, table_name, natural_key):
+        return True
+
+    def ensure_column(self, table_name, column, definition):
+        return True
+
+
+def install(path):
+    # Every database.Database() created from here on writes to the SQLite file at path
+    SqliteDatabase.path = path
+    SqliteDatabase.engine = SqliteEngine()
+    database.Database = SqliteDatabase
+
+
+def count_rows(path, table_name):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute('SELECT COUNT(*) FROM {}'.format(quote(table_name))).fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+    finally:
+        connection.close()
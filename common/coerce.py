@@ -0,0 +1,114 @@
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Column types for the 'type' key of a field spec. Values that are missing or do not parse become the type's
+# default: 0 or 0.0 for the plain types, None for the nullable ones.
+INT = 'int'
+NULLABLE_INT = 'nullable_int'
+FLOAT = 'float'
+NULLABLE_FLOAT = 'nullable_float'
+# Floats that may be reported as an upper bound, such as KFF's '<.01'; the bound is taken as the value
+BOUNDED_FLOAT = 'bounded_float'
+
+# Markers sources use for "no value"; anything else that does not parse is treated the same way
+NULL_STRINGS = frozenset(['', 'NA', 'N/A', 'NR', 'null', 'NULL', 'None'])
+# Whole columns only go through NumPy when there are enough values to make up for the conversion
+NUMPY_MIN_VALUES = 256
+
+
+def parse_int(value):
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, float):
+        return int(value) if math.isfinite(value) else None
+
+    value = str(value).strip()
+    if value in NULL_STRINGS:
+        return None
+
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def parse_float(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        value = float(value)
+        return value if math.isfinite(value) else None
+
+    value = str(value).strip()
+    if value in NULL_STRINGS:
+        return None
+
+    try:
+        value = float(value)
+    except ValueError:
+        return None
+
+    # 'Inf' and 'NaN' parse but no column can store them
+    return value if math.isfinite(value) else None
+
+
+def parse_bounded_float(value):
+    if isinstance(value, str) and value.strip().startswith('<'):
+        value = value.strip()[1:]
+
+    return parse_float(value)
+
+
+# type: (parse, default, NumPy dtype for the whole column fast path)
+COLUMN_TYPES = {
+    INT: (parse_int, 0, 'int64'),
+    NULLABLE_INT: (parse_int, None, 'int64'),
+    FLOAT: (parse_float, 0.0, 'float64'),
+    NULLABLE_FLOAT: (parse_float, None, 'float64'),
+    BOUNDED_FLOAT: (parse_bounded_float, 0.0, 'float64')
+}
+
+
+def get_column_type(column_type):
+    assert column_type in COLUMN_TYPES, 'unknown column type {}'.format(column_type)
+    return COLUMN_TYPES[column_type]
+
+
+def coerce_value(value, column_type):
+    parse, default, _ = get_column_type(column_type)
+    parsed_value = parse(value)
+    return parsed_value if parsed_value is not None else default
+
+
+def coerce_numpy(values, dtype):
+    # Only a column that is clean throughout takes the fast path; None means it has to go value by value
+    try:
+        array = numpy.array(values).astype(dtype)
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+    if dtype == 'float64' and not numpy.isfinite(array).all():
+        return None
+
+    return array.tolist()
+
+
+def coerce_column(values, column_type):
+    parse, default, dtype = get_column_type(column_type)
+    if numpy is not None and len(values) >= NUMPY_MIN_VALUES:
+        coerced_values = coerce_numpy(values, dtype)
+        if coerced_values is not None:
+            return coerced_values
+
+    coerced_values = []
+    for value in values:
+        parsed_value = parse(value)
+        coerced_values.append(parsed_value if parsed_value is not None else default)
+
+    return coerced_values
@@ -0,0 +1,200 @@
+from array import array
+
+# Row tuples held column by column. Integer and float columns are packed into typed arrays with a null bitmap,
+# anything else is dictionary encoded, so repeated strings such as states, counties and dates are stored once.
+# A column takes the type of its first value that is not None and falls back to dictionary encoding as soon as
+# a value of another type shows up, so rows always read back exactly as they were appended.
+NUMERIC_TYPECODES = {int: 'q', float: 'd'}
+# Past this share of distinct values a dictionary costs more than it saves
+DICTIONARY_MAX_DISTINCT_RATIO = 0.5
+DICTIONARY_MIN_ROWS = 1024
+
+
+class NumericColumn:
+
+    def __init__(self, value_type, length=0):
+        self.value_type = value_type
+        self.values = array(NUMERIC_TYPECODES[value_type])
+        self.nulls = bytearray()
+        self.length = 0
+        for _ in range(length):
+            self.append(None)
+
+    def accepts(self, value):
+        return value is None or type(value) is self.value_type
+
+    def append(self, value):
+        if self.length % 8 == 0:
+            self.nulls.append(0)
+
+        if value is None:
+            self.values.append(0)
+            self.nulls[self.length // 8] |= 1 << (self.length % 8)
+        else:
+            # Integers beyond 64 bits raise OverflowError before anything is stored
+            self.values.append(value)
+
+        self.length += 1
+
+    def get(self, position):
+        if self.nulls[position // 8] & (1 << (position % 8)):
+            return None
+
+        return self.values[position]
+
+    def slice(self, start, stop):
+        values = self.values[start:stop].tolist()
+        if not any(self.nulls[start // 8:(stop + 7) // 8]):
+            return values
+
+        for position in range(start, stop):
+            if self.nulls[position // 8] & (1 << (position % 8)):
+                values[position - start] = None
+
+        return values
+
+    def nbytes(self):
+        return self.values.itemsize * len(self.values) + len(self.nulls)
+
+
+class DictionaryColumn:
+
+    def __init__(self, values=()):
+        self.codes = array('I')
+        self.dictionary = []
+        self.index = {}
+        self.plain = None
+        for value in values:
+            self.append(value)
+
+    def accepts(self, value):
+        return True
+
+    def append(self, value):
+        if self.plain is not None:
+            self.plain.append(value)
+            return
+
+        # Keyed by type as well so 1, 1.0 and True keep their own entries
+        try:
+            code = self.index.get((value.__class__, value))
+        except TypeError:
+            # Unhashable values cannot be dictionary encoded
+            self.decode()
+            self.plain.append(value)
+            return
+
+        if code is None:
+            code = len(self.dictionary)
+            self.index[(value.__class__, value)] = code
+            self.dictionary.append(value)
+
+        self.codes.append(code)
+        if len(self.codes) >= DICTIONARY_MIN_ROWS and \
+                len(self.dictionary) > DICTIONARY_MAX_DISTINCT_RATIO * len(self.codes):
+            self.decode()
+
+    def decode(self):
+        self.plain = [self.dictionary[code] for code in self.codes]
+        self.codes = array('I')
+        self.dictionary = []
+        self.index = {}
+
+    def get(self, position):
+        return self.plain[position] if self.plain is not None else self.dictionary[self.codes[position]]
+
+    def slice(self, start, stop):
+        if self.plain is not None:
+            return self.plain[start:stop]
+
+        dictionary = self.dictionary
+        return [dictionary[code] for code in self.codes[start:stop]]
+
+    def nbytes(self):
+        if self.plain is not None:
+            return 8 * len(self.plain)
+
+        return self.codes.itemsize * len(self.codes) + 8 * len(self.dictionary)
+
+    # The lookup index is rebuilt after unpickling rather than shipped between processes
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['index'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.index = dict([((value.__class__, value), code) for code, value in enumerate(self.dictionary)])
+
+
+def create_column(value, length):
+    if type(value) in NUMERIC_TYPECODES:
+        return NumericColumn(type(value), length)
+
+    return DictionaryColumn([None] * length)
+
+
+class RecordStore:
+
+    def __init__(self, columns, rows=None):
+        self.columns = list(columns)
+        self.positions = dict([(column, position) for position, column in enumerate(self.columns)])
+        self.data = [None] * len(self.columns)
+        self.length = 0
+        if rows is not None:
+            self.extend(rows)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return self.rows()
+
+    def append(self, row):
+        for position, value in enumerate(row):
+            column = self.data[position]
+            if column is None:
+                # Leading Nones are held back until a value decides the column type
+                if value is None:
+                    continue
+
+                column = self.data[position] = create_column(value, self.length)
+
+            if not column.accepts(value):
+                column = self.data[position] = DictionaryColumn(column.slice(0, self.length))
+
+            try:
+                column.append(value)
+            except OverflowError:
+                column = self.data[position] = DictionaryColumn(column.slice(0, self.length))
+                column.append(value)
+
+        self.length += 1
+        return self.length - 1
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def column_slice(self, position, start, stop):
+        column = self.data[position]
+        return column.slice(start, stop) if column is not None else [None] * (stop - start)
+
+    def column(self, name):
+        return self.column_slice(self.positions[name], 0, self.length)
+
+    def get(self, position, name):
+        column = self.data[self.positions[name]]
+        return column.get(position) if column is not None else None
+
+    def rows(self, start=0, stop=None):
+        stop = self.length if stop is None else min(stop, self.length)
+        return zip(*[self.column_slice(position, start, stop) for position in range(len(self.columns))])
+
+    def batches(self, size):
+        # Lists of row tuples, ready for insert_many
+        for start in range(0, self.length, size):
+            yield list(self.rows(start, start + size))
+
+    def nbytes(self):
+        return sum([column.nbytes() for column in self.data if column is not None])
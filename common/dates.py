@@ -0,0 +1,67 @@
+import dateparser
+import datetime
+import functools
+import re
+
+CACHE_SIZE = 8192
+DATEPARSER_SETTINGS = {'TIMEZONE': 'EST'}
+
+ISO_DATE_REGEX = re.compile('^(\\d{4})-(\\d{2})-(\\d{2})(?:[T ](\\d{2}):(\\d{2})(?::(\\d{2})(?:\\.(\\d{1,6}))?)?)?$')
+US_DATE_REGEX = re.compile('^(\\d{1,2})/(\\d{1,2})/(\\d{4})$')
+MONTH_DAY_YEAR_REGEX = re.compile('^([A-Za-z]{3})[a-z]*\\.? (\\d{1,2}),? (\\d{4})$')
+
+MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12
+}
+
+
+def parse_iso(match):
+    year, month, day, hour, minute, second, fraction = match.groups()
+    return datetime.datetime(
+        int(year), int(month), int(day),
+        int(hour or 0), int(minute or 0), int(second or 0),
+        int(fraction.ljust(6, '0')) if fraction is not None else 0
+    )
+
+
+def parse_us(match):
+    month, day, year = match.groups()
+    return datetime.datetime(int(year), int(month), int(day))
+
+
+def parse_month_day_year(match):
+    month_name, day, year = match.groups()
+    month = MONTHS.get(month_name.lower())
+    return datetime.datetime(int(year), month, int(day)) if month is not None else None
+
+
+FAST_PATHS = [
+    (ISO_DATE_REGEX, parse_iso),
+    (US_DATE_REGEX, parse_us),
+    (MONTH_DAY_YEAR_REGEX, parse_month_day_year)
+]
+
+
+def parse_fast(value):
+    for pattern, parse in FAST_PATHS:
+        match = pattern.match(value)
+        if match is not None:
+            try:
+                return parse(match)
+            except ValueError:
+                # Out of range values, e.g. a 13th month, are left for dateparser to judge
+                return None
+
+    return None
+
+
+def parse(value):
+    parsed_date = parse_fast(value.strip()) if isinstance(value, str) else None
+    return parsed_date if parsed_date is not None else dateparser.parse(value, settings=DATEPARSER_SETTINGS)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def to_iso_date(value):
+    parsed_date = parse(value)
+    return parsed_date.isoformat() if parsed_date is not None else None
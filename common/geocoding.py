@@ -0,0 +1,245 @@
+from common import constants, http, instrumentation, utils
+
+from concurrent import futures
+
+import threading
+import requests
+import asyncio
+import sqlite3
+import json
+import math
+import time
+import os
+
+CACHE_PATH = '/'.join([constants.temp_dir, 'geocoding_cache.sqlite3'])
+# Four decimal places is roughly 11 meters, well inside any county
+COORDINATE_PRECISION = 4
+GRID_CELL_SIZE = 0.05
+# Points closer than this (in degrees, roughly 1km) to a known location are resolved to that location
+NEAREST_MAX_DISTANCE = 0.01
+
+
+def round_coordinates(latitude, longitude, precision=COORDINATE_PRECISION):
+    return round(float(latitude), precision), round(float(longitude), precision)
+
+
+def valid_coordinates(latitude, longitude):
+    try:
+        float(latitude)
+        float(longitude)
+    except (ValueError, TypeError):
+        return False
+
+    return True
+
+
+# Remote geocoding responses persisted across runs, keyed by rounded coordinates
+class GeocodeCache:
+
+    def __init__(self, namespace, path=CACHE_PATH):
+        self.namespace = namespace
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def connect(self):
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS geocode_cache ('
+                'namespace TEXT NOT NULL, latitude REAL NOT NULL, longitude REAL NOT NULL, response TEXT NOT NULL, '
+                'PRIMARY KEY (namespace, latitude, longitude))'
+            )
+            self.connection.commit()
+
+        return self.connection
+
+    def get(self, latitude, longitude):
+        if not valid_coordinates(latitude, longitude):
+            return None
+
+        rounded_latitude, rounded_longitude = round_coordinates(latitude, longitude)
+        with self.lock:
+            row = self.connect().execute(
+                'SELECT response FROM geocode_cache WHERE namespace = ? AND latitude = ? AND longitude = ?',
+                (self.namespace, rounded_latitude, rounded_longitude)
+            ).fetchone()
+
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, latitude, longitude, response):
+        if not valid_coordinates(latitude, longitude):
+            return
+
+        rounded_latitude, rounded_longitude = round_coordinates(latitude, longitude)
+        with self.lock:
+            connection = self.connect()
+            connection.execute(
+                'INSERT OR REPLACE INTO geocode_cache (namespace, latitude, longitude, response) VALUES (?, ?, ?, ?)',
+                (self.namespace, rounded_latitude, rounded_longitude, json.dumps(response))
+            )
+            connection.commit()
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+# Uniform grid over known locations for nearest-neighbour lookups within a small radius
+class GridIndex:
+
+    def __init__(self, cell_size=GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.size = 0
+
+    def get_cell(self, latitude, longitude):
+        return math.floor(latitude / self.cell_size), math.floor(longitude / self.cell_size)
+
+    def add(self, latitude, longitude, value):
+        if not valid_coordinates(latitude, longitude):
+            return
+
+        latitude, longitude = float(latitude), float(longitude)
+        cell = self.get_cell(latitude, longitude)
+        if cell not in self.cells:
+            self.cells[cell] = []
+
+        self.cells[cell].append((latitude, longitude, value))
+        self.size += 1
+
+    def nearest(self, latitude, longitude, max_distance=NEAREST_MAX_DISTANCE):
+        if not valid_coordinates(latitude, longitude):
+            return None
+
+        latitude, longitude = float(latitude), float(longitude)
+        # Degrees of longitude shrink towards the poles
+        longitude_scale = math.cos(math.radians(latitude))
+        cell_latitude, cell_longitude = self.get_cell(latitude, longitude)
+        reach = int(math.ceil(max_distance / self.cell_size))
+
+        nearest_value = None
+        nearest_distance = max_distance
+        for latitude_offset in range(-reach, reach + 1):
+            for longitude_offset in range(-reach, reach + 1):
+                for point_latitude, point_longitude, value in \
+                        self.cells.get((cell_latitude + latitude_offset, cell_longitude + longitude_offset), []):
+                    distance = math.hypot(point_latitude - latitude, (point_longitude - longitude) * longitude_scale)
+                    if distance <= nearest_distance:
+                        nearest_value = value
+                        nearest_distance = distance
+
+        return nearest_value
+
+
+def build_location_index(locations):
+    index = GridIndex()
+    for location in locations:
+        index.add(location['latitude'], location['longitude'], location)
+
+    utils.log('Indexed {} known locations for geocoding'.format(index.size))
+    return index
+
+
+# Requests are spent from a bucket that refills at rate tokens per second and holds at most capacity of them.
+# Taking a token never blocks the caller's thread; it returns how long to wait before the request may go out.
+class TokenBucket:
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # A negative balance is the queue of callers already waiting for tokens
+            self.tokens -= 1
+            return max(-self.tokens / self.rate, 0.0)
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+DEFAULT_GEOCODER_RATE = 1.0
+DEFAULT_GEOCODER_WORKERS = 4
+
+
+# Resolves coordinates against a reverse geocoding API without exceeding its rate limit. Responses are cached
+# by rounded coordinates and concurrent lookups of the same coordinates share one request.
+class ReverseGeocoder:
+
+    def __init__(self, namespace, url_template, parse_response, rate=DEFAULT_GEOCODER_RATE,
+                 workers=DEFAULT_GEOCODER_WORKERS, retries=http.DEFAULT_RETRIES, backoff=http.DEFAULT_BACKOFF,
+                 headers=None):
+        self.url_template = url_template
+        self.parse_response = parse_response
+        self.cache = GeocodeCache(namespace)
+        self.bucket = TokenBucket(rate)
+        self.workers = max(workers, 1)
+        self.retries = retries
+        self.backoff = backoff
+        self.headers = headers or {}
+        self.in_flight = {}
+        self.errors = 0
+
+    def get(self, latitude, longitude):
+        return http.get_session().request('GET', self.url_template.format(latitude, longitude), headers=self.headers)
+
+    async def fetch(self, executor, latitude, longitude):
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries + 1):
+            await self.bucket.acquire()
+            try:
+                response = await loop.run_in_executor(executor, instrumentation.bind(self.get), latitude, longitude)
+                instrumentation.count('http_requests')
+            except (requests.ConnectionError, requests.Timeout):
+                response = None
+
+            if response is not None and response.status_code == 200:
+                parsed_response = self.parse_response(json.loads(response.content.decode('utf-8')))
+                self.cache.put(latitude, longitude, parsed_response)
+                return parsed_response
+            if response is not None and response.status_code not in http.TRANSIENT_STATUS_CODES:
+                break
+            if attempt < self.retries:
+                await asyncio.sleep(http.backoff_delay(self.backoff, attempt))
+
+        # Failures are not cached so the next run asks again
+        self.errors += 1
+        return None
+
+    async def resolve(self, executor, latitude, longitude):
+        key = round_coordinates(latitude, longitude)
+        cached_response = self.cache.get(latitude, longitude)
+        if cached_response is not None:
+            return key, cached_response
+
+        if key not in self.in_flight:
+            task = asyncio.ensure_future(self.fetch(executor, latitude, longitude))
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+            self.in_flight[key] = task
+
+        return key, await self.in_flight[key]
+
+    async def resolve_coordinates(self, coordinates):
+        with futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = await asyncio.gather(*[
+                self.resolve(executor, latitude, longitude) for latitude, longitude in coordinates
+                if valid_coordinates(latitude, longitude)
+            ])
+
+        return dict(results)
+
+    def resolve_all(self, coordinates):
+        # Maps rounded (latitude, longitude) to the parsed response, or None when the lookup failed
+        return asyncio.run(self.resolve_coordinates(coordinates))
@@ -0,0 +1,181 @@
+from common import constants, instrumentation
+
+from concurrent import futures
+
+import threading
+import requests
+import hashlib
+import random
+import json
+import time
+import os
+
+DEFAULT_WORKERS = 8
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+NOT_MODIFIED = 304
+CHUNK_SIZE = 1024 * 1024
+# Point HTTP_CACHE_DIR at a directory of previously downloaded payloads and set HTTP_OFFLINE to run without network
+DOWNLOAD_DIR = os.getenv('HTTP_CACHE_DIR') or '/'.join([constants.temp_dir, 'downloads'])
+
+# One keep-alive session per worker thread, reused for every request that thread makes
+session_local = threading.local()
+
+
+def get_session():
+    if getattr(session_local, 'session', None) is None:
+        session_local.session = requests.Session()
+
+    return session_local.session
+
+
+def backoff_delay(backoff, attempt):
+    return backoff * (2 ** attempt) * (1 + random.random())
+
+
+def request(method, url, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, **kwargs):
+    attempt = 0
+    while True:
+        try:
+            response = get_session().request(method, url, **kwargs)
+            instrumentation.count('http_requests')
+            if response.status_code not in TRANSIENT_STATUS_CODES or attempt >= retries:
+                # Streamed bodies are counted as they are read
+                if not kwargs.get('stream', False):
+                    instrumentation.count('bytes_downloaded', len(response.content))
+                return response
+
+            # Returns the connection to the pool; streamed bodies would otherwise hold it
+            response.close()
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt >= retries:
+                raise
+
+        time.sleep(backoff_delay(backoff, attempt))
+        attempt += 1
+
+
+class ConcurrentFetcher:
+
+    def __init__(self, workers=DEFAULT_WORKERS, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+        self.workers = max(workers, 1)
+        self.retries = retries
+        self.backoff = backoff
+
+    def fetch(self, method, url, **kwargs):
+        return request(method, url, retries=self.retries, backoff=self.backoff, **kwargs)
+
+    def fetch_all(self, urls, method='GET', **kwargs):
+        # Responses are returned in the same order as the urls, regardless of completion order
+        with futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            fetch = instrumentation.bind(lambda url: self.fetch(method, url, **kwargs))
+            return list(executor.map(fetch, urls))
+
+    def download_all(self, urls, method='GET', **kwargs):
+        # Same as fetch_all, but each response is revalidated through the download cache
+        with futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            fetch = instrumentation.bind(lambda url: cached_download(url, method, **kwargs))
+            return list(executor.map(fetch, urls))
+
+
+def get_download_path(url):
+    return '/'.join([DOWNLOAD_DIR, hashlib.sha1(url.encode('utf-8')).hexdigest()])
+
+
+def offline_enabled():
+    return os.getenv('HTTP_OFFLINE') is not None
+
+
+def revalidation_enabled():
+    # HTTP_NO_CACHE forces a full download that every module treats as new
+    return os.getenv('HTTP_NO_CACHE') is None
+
+
+def get_metadata_path(url):
+    return '{}.json'.format(get_download_path(url))
+
+
+def load_metadata(url):
+    metadata_path = get_metadata_path(url)
+    if not revalidation_enabled() or not os.path.exists(metadata_path) or not os.path.exists(get_download_path(url)):
+        return {}
+
+    with open(metadata_path) as metadata_file:
+        return json.load(metadata_file)
+
+
+def store_metadata(url, metadata):
+    metadata_path = get_metadata_path(url)
+    partial_path = '{}.{}.part'.format(metadata_path, threading.get_ident())
+    with open(partial_path, 'w') as metadata_file:
+        json.dump(metadata, metadata_file)
+
+    os.replace(partial_path, metadata_path)
+
+
+# A payload in the download cache. changed is False when it is the same content the consuming module
+# already loaded, in which case the module can skip parsing and saving altogether.
+class Download:
+
+    def __init__(self, url, path, changed):
+        self.url = url
+        self.path = path
+        self.changed = changed
+
+    def acknowledge(self):
+        # Called once the payload has been loaded successfully
+        metadata = load_metadata(self.url)
+        if len(metadata) > 0:
+            metadata['loaded'] = True
+            store_metadata(self.url, metadata)
+
+
+def cached_download(url, method='GET', **kwargs):
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    path = get_download_path(url)
+    metadata = load_metadata(url)
+
+    if offline_enabled():
+        if not os.path.exists(path):
+            raise IOError('No cached payload for {} in {}'.format(url, DOWNLOAD_DIR))
+
+        return Download(url, path, not metadata.get('loaded', False))
+
+    headers = dict(kwargs.pop('headers', None) or {})
+    if 'etag' in metadata:
+        headers['If-None-Match'] = metadata['etag']
+    if 'last_modified' in metadata:
+        headers['If-Modified-Since'] = metadata['last_modified']
+
+    # Spools the response body to disk in fixed-size chunks so it is never held in memory whole
+    partial_path = '{}.{}.part'.format(path, threading.get_ident())
+    content_hash = hashlib.sha1()
+    response = request(method, url, stream=True, headers=headers, **kwargs)
+    with response:
+        if response.status_code == NOT_MODIFIED and len(metadata) > 0:
+            return Download(url, path, not metadata.get('loaded', False))
+
+        response.raise_for_status()
+        with open(partial_path, 'wb') as download_file:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                content_hash.update(chunk)
+                download_file.write(chunk)
+                instrumentation.count('bytes_downloaded', len(chunk))
+
+    os.replace(partial_path, path)
+
+    # Servers without validators still resend identical content; the hash catches that
+    unchanged = metadata.get('sha1') == content_hash.hexdigest()
+    new_metadata = {'url': url, 'sha1': content_hash.hexdigest(), 'loaded': unchanged and metadata.get('loaded', False)}
+    if response.headers.get('ETag') is not None:
+        new_metadata['etag'] = response.headers['ETag']
+    if response.headers.get('Last-Modified') is not None:
+        new_metadata['last_modified'] = response.headers['Last-Modified']
+
+    store_metadata(url, new_metadata)
+    return Download(url, path, not new_metadata['loaded'])
+
+
+def download(url, method='GET', **kwargs):
+    return cached_download(url, method, **kwargs).path
@@ -0,0 +1,253 @@
+from common import constants, utils
+
+from collections import Counter
+
+import threading
+import cProfile
+import pstats
+import json
+import time
+import sys
+import os
+import io
+
+# METRICS_FILE enables the report; METRICS_FORMAT is jsonl (default) or prometheus.
+# PROFILE_MODULES is a comma separated list of module ids (or 'all'); PROFILER is cprofile (default) or sampling.
+JSONL_FORMAT = 'jsonl'
+PROMETHEUS_FORMAT = 'prometheus'
+CPROFILE_PROFILER = 'cprofile'
+SAMPLING_PROFILER = 'sampling'
+PROFILE_DIR = '/'.join([constants.temp_dir, 'profiles'])
+SAMPLING_INTERVAL = 0.005
+PROFILE_SUMMARY_LINES = 25
+
+metrics_local = threading.local()
+completed_lock = threading.Lock()
+completed_metrics = []
+
+
+class ModuleMetrics:
+
+    def __init__(self, module_id):
+        self.module_id = module_id
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.counters = {}
+        self.started = time.perf_counter()
+        self.total = None
+        self.status = 'running'
+
+    def add_time(self, phase_name, seconds):
+        with self.lock:
+            self.phases[phase_name] = self.phases.get(phase_name, 0.0) + seconds
+
+    def count(self, name, amount):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def finish(self, status):
+        self.total = time.perf_counter() - self.started
+        self.status = status
+        # Parsing is interleaved with the other save phases for streamed sources, so it is what save leaves over
+        if 'save' in self.phases:
+            measured = sum([self.phases.get(phase_name, 0.0) for phase_name in ('transform', 'write', 'commit')])
+            self.phases['parse'] = self.phases.get('parse', 0.0) + max(self.phases.pop('save') - measured, 0.0)
+
+    def to_dict(self):
+        rows_written = self.counters.get('rows_written', 0)
+        return {
+            'module': self.module_id,
+            'status': self.status,
+            'seconds': round(self.total, 6) if self.total is not None else None,
+            'phases': dict([(phase_name, round(seconds, 6)) for phase_name, seconds in self.phases.items()]),
+            'counters': dict(self.counters),
+            'rows_per_second': round(rows_written / self.total, 3) if self.total else 0.0
+        }
+
+
+def current():
+    return getattr(metrics_local, 'metrics', None)
+
+
+def start_module(module_id):
+    metrics_local.metrics = ModuleMetrics(module_id)
+    return metrics_local.metrics
+
+
+def finish_module(status='ok'):
+    metrics = current()
+    metrics_local.metrics = None
+    if metrics is None:
+        return None
+
+    metrics.finish(status)
+    with completed_lock:
+        completed_metrics.append(metrics)
+
+    return metrics
+
+
+def bind(function):
+    # Carries the caller's module metrics into worker threads
+    metrics = current()
+
+    def bound(*args, **kwargs):
+        metrics_local.metrics = metrics
+        try:
+            return function(*args, **kwargs)
+        finally:
+            metrics_local.metrics = None
+
+    return bound
+
+
+class Phase:
+
+    def __init__(self, phase_name):
+        self.phase_name = phase_name
+        self.metrics = None
+        self.started = None
+
+    def __enter__(self):
+        self.metrics = current()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        if self.metrics is not None:
+            self.metrics.add_time(self.phase_name, time.perf_counter() - self.started)
+
+
+def phase(phase_name):
+    return Phase(phase_name)
+
+
+def count(name, amount=1):
+    metrics = current()
+    if metrics is not None:
+        metrics.count(name, amount)
+
+
+def profiled_modules():
+    value = os.getenv('PROFILE_MODULES')
+    return set([module_id.strip() for module_id in value.split(',')]) if value is not None else set()
+
+
+def should_profile(module_id):
+    modules = profiled_modules()
+    return 'all' in modules or module_id in modules
+
+
+# Deterministic profile of everything the module thread runs
+class CProfiler:
+
+    def __init__(self, module_id):
+        self.module_id = module_id
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = '/'.join([PROFILE_DIR, '{}.prof'.format(self.module_id)])
+        self.profile.dump_stats(path)
+
+        summary = io.StringIO()
+        pstats.Stats(self.profile, stream=summary).sort_stats('cumulative').print_stats(PROFILE_SUMMARY_LINES)
+        utils.log('Profile for {} written to {}\n{}'.format(self.module_id, path, summary.getvalue()))
+
+
+# Low overhead alternative: samples the module thread's stack from a background thread
+class SamplingProfiler:
+
+    def __init__(self, module_id, interval=SAMPLING_INTERVAL):
+        self.module_id = module_id
+        self.interval = interval
+        self.thread_id = None
+        self.samples = Counter()
+        self.sample_count = 0
+        self.stopped = threading.Event()
+        self.sampler = None
+
+    def start(self):
+        self.thread_id = threading.get_ident()
+        self.sampler = threading.Thread(target=self.run, daemon=True)
+        self.sampler.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            seen = set()
+            while frame is not None:
+                code = frame.f_code
+                key = '{}:{}:{}'.format(code.co_filename, code.co_firstlineno, code.co_name)
+                # Recursive frames are only counted once per sample
+                if key not in seen:
+                    self.samples[key] += 1
+                    seen.add(key)
+                frame = frame.f_back
+
+            self.sample_count += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.sampler.join()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = '/'.join([PROFILE_DIR, '{}.samples.json'.format(self.module_id)])
+        with open(path, 'w') as samples_file:
+            json.dump({'interval': self.interval, 'samples': self.sample_count, 'functions': dict(self.samples)},
+                      samples_file)
+
+        lines = ['{:6.1%} {}'.format(samples / max(self.sample_count, 1), key)
+                 for key, samples in self.samples.most_common(PROFILE_SUMMARY_LINES)]
+        utils.log('Sampled profile for {} written to {}\n{}'.format(self.module_id, path, '\n'.join(lines)))
+
+
+def get_profiler(module_id):
+    if not should_profile(module_id):
+        return None
+
+    if (os.getenv('PROFILER') or CPROFILE_PROFILER) == SAMPLING_PROFILER:
+        return SamplingProfiler(module_id)
+
+    return CProfiler(module_id)
+
+
+def format_prometheus(metrics_list):
+    lines = [
+        '# TYPE refocus_module_seconds gauge',
+        '# TYPE refocus_module_phase_seconds gauge',
+        '# TYPE refocus_module_counter gauge',
+        '# TYPE refocus_module_rows_per_second gauge'
+    ]
+    for metrics in metrics_list:
+        metrics_dict = metrics.to_dict()
+        labels = 'module="{}",status="{}"'.format(metrics_dict['module'], metrics_dict['status'])
+        lines.append('refocus_module_seconds{{{}}} {}'.format(labels, metrics_dict['seconds']))
+        for phase_name, seconds in sorted(metrics_dict['phases'].items()):
+            lines.append('refocus_module_phase_seconds{{{},phase="{}"}} {}'.format(labels, phase_name, seconds))
+        for name, value in sorted(metrics_dict['counters'].items()):
+            lines.append('refocus_module_counter{{{},name="{}"}} {}'.format(labels, name, value))
+        lines.append('refocus_module_rows_per_second{{{}}} {}'.format(labels, metrics_dict['rows_per_second']))
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_report(path=None, report_format=None):
+    path = path or os.getenv('METRICS_FILE')
+    report_format = report_format or os.getenv('METRICS_FORMAT') or JSONL_FORMAT
+    if path is None:
+        return
+
+    with completed_lock:
+        metrics_list = list(completed_metrics)
+
+    if report_format == PROMETHEUS_FORMAT:
+        with open(path, 'w') as report_file:
+            report_file.write(format_prometheus(metrics_list))
+    else:
+        with open(path, 'a') as report_file:
+            for metrics in metrics_list:
+                report_file.write(json.dumps(metrics.to_dict()) + '\n')
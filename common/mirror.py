@@ -0,0 +1,75 @@
+from common import constants, utils
+
+from git.cmd import Git
+from git.exc import GitCommandError
+
+import threading
+import json
+import os
+
+
+# A shallow local copy of a remote repository, brought up to date at most once per run.
+# Each consumer remembers the commit it last loaded so it can ask which files changed since then.
+class RepositoryMirror:
+
+    def __init__(self, url, name, parent_dir=constants.temp_dir):
+        self.url = url
+        self.parent_dir = parent_dir
+        self.path = '/'.join([parent_dir, name])
+        self.state_path = '/'.join([parent_dir, '{}.mirror.json'.format(name)])
+        self.lock = threading.Lock()
+        self.head = None
+
+    def sync(self):
+        with self.lock:
+            if self.head is not None:
+                return self.head
+
+            os.makedirs(self.parent_dir, exist_ok=True)
+            if os.path.isdir('/'.join([self.path, '.git'])):
+                git = Git(self.path)
+                git.fetch('--depth=1', 'origin')
+                git.reset('--hard', 'FETCH_HEAD')
+            else:
+                Git(self.parent_dir).clone(self.url, self.path, depth=1)
+
+            self.head = Git(self.path).rev_parse('HEAD').strip()
+            utils.log('Mirror of {} is at {}'.format(self.url, self.head))
+            return self.head
+
+    def get_path(self, *relative_path):
+        return '/'.join([self.path] + list(relative_path))
+
+    def load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+
+        with open(self.state_path) as state_file:
+            return json.load(state_file)
+
+    def changed_files(self, consumer):
+        # None means everything should be treated as changed
+        self.sync()
+        with self.lock:
+            previous_head = self.load_state().get(consumer)
+
+        if previous_head is None:
+            return None
+
+        try:
+            changed = Git(self.path).diff('--name-only', '-z', previous_head, self.head)
+        except GitCommandError:
+            # The previous commit is no longer in the shallow history
+            return None
+
+        return set([path for path in changed.split('\0') if len(path) > 0])
+
+    def acknowledge(self, consumer):
+        with self.lock:
+            state = self.load_state()
+            state[consumer] = self.head
+            partial_path = '{}.part'.format(self.state_path)
+            with open(partial_path, 'w') as state_file:
+                json.dump(state, state_file)
+
+            os.replace(partial_path, self.state_path)
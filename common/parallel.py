@@ -0,0 +1,95 @@
+from concurrent import futures
+from queue import Empty
+
+import multiprocessing
+import os
+
+# Modules run on scheduler threads, so worker processes are spawned rather than forked
+PROCESS_CONTEXT = 'spawn'
+
+
+def get_process_workers(variable, task_count):
+    workers = int(os.getenv(variable) or os.cpu_count() or 1)
+    return max(min(workers, task_count), 1)
+
+
+def process_pool(workers):
+    return futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(PROCESS_CONTEXT))
+
+
+def process_map(function, items, workers):
+    # Results are yielded in the order of items as soon as each one is ready.
+    # Work runs in this process when there is nothing to gain from a pool.
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        for item in items:
+            yield function(item)
+        return
+
+    with process_pool(workers) as executor:
+        for result in executor.map(function, items):
+            yield result
+
+
+# Marks the end of one item's batches on the shared queue
+PRODUCER_DONE = None
+DEFAULT_MAX_QUEUED = 16
+QUEUE_POLL_SECONDS = 1
+
+
+def queue_producer(producer, item, queue):
+    try:
+        for batch in producer(item):
+            queue.put(batch)
+    finally:
+        queue.put(PRODUCER_DONE)
+
+
+def get_batch(queue, submitted):
+    while True:
+        try:
+            return queue.get(timeout=QUEUE_POLL_SECONDS)
+        except Empty:
+            # A task that failed before it started never puts its done marker on the queue
+            for future in submitted:
+                if future.done() and future.exception() is not None:
+                    future.result()
+
+
+def process_stream(producer, items, workers, max_queued=DEFAULT_MAX_QUEUED):
+    # Yields every batch that producer(item) yields, for all items, as soon as a worker hands it over.
+    # Batches from different items interleave; the bounded queue keeps workers from running ahead of the consumer.
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        for item in items:
+            for batch in producer(item):
+                yield batch
+        return
+
+    with multiprocessing.get_context(PROCESS_CONTEXT).Manager() as manager:
+        queue = manager.Queue(max_queued)
+        with process_pool(workers) as executor:
+            submitted = [executor.submit(queue_producer, producer, item, queue) for item in items]
+            remaining = len(submitted)
+            try:
+                while remaining > 0:
+                    batch = get_batch(queue, submitted)
+                    if batch is PRODUCER_DONE:
+                        remaining -= 1
+                    else:
+                        yield batch
+            finally:
+                # If the consumer stopped early, drop queued items and drain so running workers can exit
+                for future in submitted:
+                    if future.cancel():
+                        remaining -= 1
+
+                while remaining > 0 and not all([future.done() for future in submitted]):
+                    try:
+                        if queue.get(timeout=QUEUE_POLL_SECONDS) is PRODUCER_DONE:
+                            remaining -= 1
+                    except Empty:
+                        pass
+
+            for future in submitted:
+                future.result()
@@ -0,0 +1,57 @@
+from collections import deque
+
+
+def identity(value):
+    return value
+
+
+def int_or_zero(value):
+    return value if isinstance(value, int) else 0
+
+
+def none_as_zero(value):
+    return value if value is not None else 0
+
+
+def cumulative_sums(values, addend=none_as_zero):
+    sums = []
+    total = 0
+    for value in values:
+        total += addend(value)
+        sums.append(total)
+
+    return sums
+
+
+# Mean over the last `size` values; 0.0 until the window is full, so every value is a float.
+# addend/subtrahend decide what a value contributes when it enters and leaves the running sum.
+def rolling_means(values, size, addend=int_or_zero, subtrahend=int_or_zero):
+    means = []
+    window = deque()
+    total = 0
+    for value in values:
+        if len(window) == size:
+            total -= subtrahend(window.popleft())
+
+        window.append(value)
+        total += addend(value)
+        means.append(total / size if len(window) == size else 0.0)
+
+    return means
+
+
+# Relative change between each value and the value n positions earlier; 0.0 when undefined
+def percent_changes(values, n):
+    changes = []
+    window = deque(maxlen=n + 1)
+    for value in values:
+        window.append(value)
+        change = 0.0
+        if len(window) == n + 1:
+            first_value, last_value = window[0], window[n]
+            if None not in [first_value, last_value] and first_value > 0:
+                change = (last_value - first_value) / first_value
+
+        changes.append(change)
+
+    return changes
@@ -0,0 +1,63 @@
+from common import utils
+
+from concurrent import futures
+import traceback
+
+DEFAULT_WORKERS = 4
+
+
+class Scheduler:
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.workers = max(workers, 1)
+
+    def run(self, modules, run_module):
+        # Dependencies on modules that were not selected for this run are treated as satisfied
+        module_ids = set(utils.array_map_by_key(modules, 'id'))
+        pending = {}
+        for module in modules:
+            pending[module['id']] = set([d for d in module.get('depends_on', []) if d in module_ids])
+
+        modules_by_id = {}
+        for module in modules:
+            modules_by_id[module['id']] = module
+
+        results = []
+        failed = set()
+        running = {}
+
+        with futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while len(pending) > 0 or len(running) > 0:
+                for module_id in [m['id'] for m in modules if m['id'] in pending]:
+                    dependencies = pending[module_id]
+                    if len(dependencies & failed) > 0:
+                        utils.log('Skipping module {} because a dependency failed'.format(module_id))
+                        del pending[module_id]
+                        failed.add(module_id)
+                    elif len(dependencies) == 0:
+                        del pending[module_id]
+                        running[executor.submit(run_module, modules_by_id[module_id])] = module_id
+
+                if len(running) == 0:
+                    # Nothing left can start: the remaining modules depend on each other
+                    for module_id in [m['id'] for m in modules if m['id'] in pending]:
+                        utils.log('Module {} failed: its dependencies {} can never run'.format(
+                            module_id, ', '.join(sorted(pending[module_id]))
+                        ))
+                        failed.add(module_id)
+                    break
+
+                done, _ = futures.wait(running.keys(), return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    module_id = running.pop(future)
+                    try:
+                        results.append({'id': module_id, 'time': future.result()})
+                    except Exception:
+                        utils.log('Module {} failed\n{}'.format(module_id, traceback.format_exc()))
+                        failed.add(module_id)
+                        continue
+
+                    for dependencies in pending.values():
+                        dependencies.discard(module_id)
+
+        return results, failed
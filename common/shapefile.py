@@ -0,0 +1,97 @@
+import zipfile
+import struct
+
+# Only what the Census cartographic boundary files use: polygon shapes (type 5) and a dBASE attribute table
+NULL_SHAPE = 0
+POLYGON_SHAPE = 5
+SHP_HEADER_LENGTH = 100
+DBF_FIELD_DESCRIPTOR_LENGTH = 32
+DBF_HEADER_TERMINATOR = 0x0D
+
+
+def read_polygons(shp_bytes):
+    polygons = []
+    offset = SHP_HEADER_LENGTH
+    while offset + 8 <= len(shp_bytes):
+        # Record headers are big-endian; content length is in 16-bit words
+        content_length = struct.unpack_from('>i', shp_bytes, offset + 4)[0] * 2
+        content_offset = offset + 8
+        shape_type = struct.unpack_from('<i', shp_bytes, content_offset)[0]
+
+        if shape_type == POLYGON_SHAPE:
+            bbox = struct.unpack_from('<4d', shp_bytes, content_offset + 4)
+            part_count, point_count = struct.unpack_from('<2i', shp_bytes, content_offset + 36)
+            parts_offset = content_offset + 44
+            parts = list(struct.unpack_from('<{}i'.format(part_count), shp_bytes, parts_offset))
+            points_offset = parts_offset + part_count * 4
+            coordinates = struct.unpack_from('<{}d'.format(point_count * 2), shp_bytes, points_offset)
+
+            rings = []
+            parts.append(point_count)
+            for part_index in range(part_count):
+                start, end = parts[part_index] * 2, parts[part_index + 1] * 2
+                rings.append(coordinates[start:end])
+
+            polygons.append({'bbox': bbox, 'rings': rings})
+        elif shape_type == NULL_SHAPE:
+            polygons.append(None)
+        else:
+            raise ValueError('Unsupported shape type {}'.format(shape_type))
+
+        offset = content_offset + content_length
+
+    return polygons
+
+
+def read_records(dbf_bytes, encoding='utf-8'):
+    record_count, header_length, record_length = struct.unpack_from('<IHH', dbf_bytes, 4)
+
+    fields = []
+    offset = DBF_FIELD_DESCRIPTOR_LENGTH
+    while dbf_bytes[offset] != DBF_HEADER_TERMINATOR:
+        name = dbf_bytes[offset:offset + 11].split(b'\x00')[0].decode('ascii')
+        field_length = dbf_bytes[offset + 16]
+        fields.append((name, field_length))
+        offset += DBF_FIELD_DESCRIPTOR_LENGTH
+
+    records = []
+    for record_index in range(record_count):
+        record_offset = header_length + record_index * record_length
+        # The first byte of each record is the deletion flag
+        field_offset = record_offset + 1
+        record = {}
+        for name, field_length in fields:
+            raw_value = dbf_bytes[field_offset:field_offset + field_length]
+            record[name] = raw_value.decode(encoding, errors='replace').strip()
+            field_offset += field_length
+
+        records.append(record)
+
+    return records
+
+
+def read_zip(zip_path):
+    with zipfile.ZipFile(zip_path, mode='r') as zipfile_object:
+        names = zipfile_object.namelist()
+        shp_name = next(name for name in names if name.lower().endswith('.shp'))
+        dbf_name = next(name for name in names if name.lower().endswith('.dbf'))
+        polygons = read_polygons(zipfile_object.read(shp_name))
+        records = read_records(zipfile_object.read(dbf_name))
+
+    return list(zip(polygons, records))
+
+
+def point_in_rings(rings, x, y):
+    # Even-odd ray casting across every ring, so holes are excluded
+    inside = False
+    for ring in rings:
+        point_count = len(ring) // 2
+        previous_x, previous_y = ring[-2], ring[-1]
+        for index in range(point_count):
+            current_x, current_y = ring[index * 2], ring[index * 2 + 1]
+            if (current_y > y) != (previous_y > y) and \
+                    x < (previous_x - current_x) * (y - current_y) / (previous_y - current_y) + current_x:
+                inside = not inside
+            previous_x, previous_y = current_x, current_y
+
+    return inside
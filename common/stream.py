@@ -0,0 +1,44 @@
+import zipfile
+import csv
+import io
+
+
+# A re-iterable source of csv records that reads from disk on every pass
+class CsvStream:
+
+    def __init__(self, opener, fieldnames=None):
+        self.opener = opener
+        self.fieldnames = fieldnames
+
+    def __iter__(self):
+        with self.opener() as csv_file:
+            for record in csv.DictReader(csv_file, fieldnames=self.fieldnames):
+                yield record
+
+
+# Closes the archive along with the member that was opened from it
+class ZipMemberReader:
+
+    def __init__(self, zipfile_object, member_file):
+        self.zipfile_object = zipfile_object
+        self.member_file = member_file
+
+    def __enter__(self):
+        return self.member_file
+
+    def __exit__(self, *args):
+        self.member_file.close()
+        self.zipfile_object.close()
+
+
+def file_csv_stream(path, encoding='utf-8', fieldnames=None):
+    return CsvStream(lambda: open(path, newline='', encoding=encoding), fieldnames)
+
+
+def zip_member_csv_stream(zip_path, member, encoding='utf-8', fieldnames=None):
+    def open_member():
+        zipfile_object = zipfile.ZipFile(zip_path, mode='r')
+        member_file = io.TextIOWrapper(zipfile_object.open(member), encoding=encoding, newline='')
+        return ZipMemberReader(zipfile_object, member_file)
+
+    return CsvStream(open_member, fieldnames)
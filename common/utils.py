@@ -1,4 +1,5 @@
-import dateparser
+from common import coerce, dates
+
 import datetime
 import math
 import sys
@@ -6,23 +7,11 @@ import os
 
 
 def ensure_float(value):
-    try:
-        float(value)
-    except ValueError:
-        value = 0.0
-    except TypeError:
-        value = 0.0
-    return value if value != 'Inf' else 0.0
+    return coerce.coerce_value(value, coerce.FLOAT)
 
 
 def ensure_int(value):
-    try:
-        int(value)
-    except ValueError:
-        value = 0
-    except TypeError:
-        value = 0
-    return value
+    return coerce.coerce_value(value, coerce.INT)
 
 
 def bool_to_int(value):
@@ -30,8 +19,7 @@ def bool_to_int(value):
 
 
 def ensure_iso_date(value):
-    parsed_date = dateparser.parse(value, settings={'TIMEZONE': 'EST'})
-    return parsed_date.isoformat() if parsed_date is not None else None
+    return dates.to_iso_date(value)
 
 
 def end_of_year(year):
@@ -54,8 +42,14 @@ def log(message, newline=True, show_timestamp=True):
     sys.stdout.write('\033[1m{}\033[0m {}{}'.format(timestamp, message, '\n' if newline else ''))
 
 
-def progress(value, total):
-    if os.getenv('DEBUG_PROGRESS') is not None:
+def progress(value, total=None):
+    if os.getenv('DEBUG_PROGRESS') is None:
+        return
+
+    # Streamed sources do not know their record count up front
+    if total is None:
+        log("\rProgress: Records processed: {}".format(value), newline=False, show_timestamp=False)
+    else:
         log("\rProgress: {} - Records processed: {} of {}"
             .format(percentage(value, total), value, total), newline=value == total, show_timestamp=False)
 
@@ -71,6 +65,22 @@ def stringify(array):
     return string
 
 
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+
+    if len(batch) > 0:
+        yield batch
+
+
+def count_records(records):
+    return len(records) if hasattr(records, '__len__') else None
+
+
 def get_value(obj, key):
     return obj[key]
 
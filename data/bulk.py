@@ -0,0 +1,144 @@
+from common import constants
+
+import itertools
+import tempfile
+import os
+
+DEFAULT_BATCH_ROWS = 5000
+DEFAULT_BATCH_BYTES = 4 * 1024 * 1024
+
+TSV_NULL = '\\N'
+TSV_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\0': '\\0'})
+
+
+def escape_column(column):
+    return '`' + column + '`'
+
+
+def generate_columns_string(columns):
+    return '(' + ', '.join([escape_column(column) for column in columns]) + ')'
+
+
+def generate_row_placeholders(length):
+    return '(' + ', '.join(['%s'] * length) + ')'
+
+
+def generate_upsert_clause(columns, natural_key):
+    if natural_key is None:
+        return ''
+
+    update_columns = [column for column in columns if column not in natural_key]
+    # With nothing left to update the key column is assigned to itself so the statement is a no-op on conflict
+    if len(update_columns) == 0:
+        update_columns = [natural_key[0]]
+
+    return ' ON DUPLICATE KEY UPDATE ' + ', '.join(
+        ['{0} = VALUES({0})'.format(escape_column(column)) for column in update_columns]
+    )
+
+
+def to_tsv_value(value):
+    if value is None:
+        return TSV_NULL
+    elif isinstance(value, bool):
+        return '1' if value else '0'
+    elif isinstance(value, str):
+        return value.translate(TSV_ESCAPES)
+
+    return str(value)
+
+
+class BatchStrategy:
+
+    def __init__(self, max_rows=DEFAULT_BATCH_ROWS, max_bytes=DEFAULT_BATCH_BYTES):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+
+    def measure(self, values):
+        # Rough estimate of the bytes a row adds to a statement or a data file
+        size = len(values)
+        for value in values:
+            size += len(value) if isinstance(value, str) else 8
+
+        return size
+
+    def is_full(self, row_count, byte_size):
+        return row_count >= self.max_rows or byte_size >= self.max_bytes
+
+
+# Writes a batch as a single INSERT statement with one placeholder group per row
+class MultiRowInsertEngine:
+
+    name = 'insert'
+    connection_options = {}
+
+    def write(self, cursor, table_name, columns, rows, natural_key=None):
+        row_placeholders = generate_row_placeholders(len(columns))
+        statement = 'INSERT INTO {} {} VALUES {}{}'.format(
+            table_name,
+            generate_columns_string(columns),
+            ', '.join([row_placeholders] * len(rows)),
+            generate_upsert_clause(columns, natural_key)
+        )
+        cursor.execute(statement, list(itertools.chain.from_iterable(rows)))
+
+
+# Hands the batch to the driver, which rewrites it into a multi-row INSERT
+class ExecuteManyEngine:
+
+    name = 'executemany'
+    connection_options = {}
+
+    def write(self, cursor, table_name, columns, rows, natural_key=None):
+        statement = 'INSERT INTO {} {} VALUES {}{}'.format(
+            table_name,
+            generate_columns_string(columns),
+            generate_row_placeholders(len(columns)),
+            generate_upsert_clause(columns, natural_key)
+        )
+        cursor.executemany(statement, rows)
+
+
+# Streams the batch through a temporary TSV file and LOAD DATA LOCAL INFILE
+class LoadDataInfileEngine:
+
+    name = 'load_data'
+    connection_options = {'allow_local_infile': True}
+
+    def write(self, cursor, table_name, columns, rows, natural_key=None):
+        if not os.path.isdir(constants.temp_dir):
+            os.makedirs(constants.temp_dir, exist_ok=True)
+
+        tsv_file = tempfile.NamedTemporaryFile(
+            mode='w', encoding='utf-8', newline='', suffix='.tsv', dir=constants.temp_dir, delete=False
+        )
+        try:
+            with tsv_file:
+                for row in rows:
+                    tsv_file.write('\t'.join([to_tsv_value(value) for value in row]))
+                    tsv_file.write('\n')
+
+            # REPLACE gives LOAD DATA the same idempotency as ON DUPLICATE KEY UPDATE for keyed tables
+            statement = "LOAD DATA LOCAL INFILE '{}' {}INTO TABLE {} CHARACTER SET utf8mb4 " \
+                        "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' {}".format(
+                            os.path.abspath(tsv_file.name).replace('\\', '/').replace('\'', '\\\''),
+                            'REPLACE ' if natural_key is not None else '',
+                            table_name,
+                            generate_columns_string(columns)
+                        )
+            cursor.execute(statement)
+        finally:
+            os.remove(tsv_file.name)
+
+
+ENGINES = {
+    MultiRowInsertEngine.name: MultiRowInsertEngine,
+    ExecuteManyEngine.name: ExecuteManyEngine,
+    LoadDataInfileEngine.name: LoadDataInfileEngine
+}
+
+
+def get_engine(name=None):
+    engine_name = name if name is not None else MultiRowInsertEngine.name
+    assert engine_name in ENGINES, 'unknown bulk engine {}, expected one of {}'.format(engine_name, list(ENGINES))
+    return ENGINES[engine_name]()
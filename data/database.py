@@ -1,9 +1,28 @@
-from common import utils
+from common import instrumentation, utils
+from data import bulk
 
-import os
+from mysql.connector import pooling
 import mysql.connector
+import threading
+import time
+import os
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_POOL_TIMEOUT = 60
+# Upserts only match on a unique index; this one is added over a table's natural key when none covers it
+NATURAL_KEY_INDEX = 'natural_key'
+FIND_UNIQUE_INDEXES = 'SELECT `index_name`, `column_name` FROM information_schema.statistics ' \
+                      'WHERE `table_schema` = DATABASE() AND `table_name` = %s AND `non_unique` = 0 ' \
+                      'ORDER BY `index_name`, `seq_in_index`'
+FIND_COLUMN = 'SELECT COUNT(*) FROM information_schema.columns ' \
+              'WHERE `table_schema` = DATABASE() AND `table_name` = %s AND `column_name` = %s'
 
-SQL_MAX_LENGTH = 20000
+# One pool per distinct connection configuration, shared by every Database in the process
+pools = {}
+pools_lock = threading.Lock()
+# (database, table, natural key) already known to be backed by a unique index in this process
+unique_indexes = set()
+unique_indexes_lock = threading.Lock()
 
 
 def missing_env_var(env_var):
@@ -18,32 +37,59 @@ def escape_quotes(value):
     return '`' + value + '`'
 
 
+def get_pool(config):
+    pool_key = tuple(sorted(config.items()))
+    with pools_lock:
+        if pool_key not in pools:
+            pools[pool_key] = pooling.MySQLConnectionPool(
+                pool_name='refocus_{}'.format(len(pools)),
+                pool_size=int(getenv('DB_POOL_SIZE') or DEFAULT_POOL_SIZE),
+                pool_reset_session=True,
+                **config
+            )
+
+        return pools[pool_key]
+
+
+def is_healthy(connection):
+    try:
+        connection.ping(reconnect=True, attempts=2, delay=0)
+    except mysql.connector.Error:
+        return False
+
+    return True
+
+
+def checkout_connection(config):
+    pool = get_pool(config)
+    deadline = time.monotonic() + int(getenv('DB_POOL_TIMEOUT') or DEFAULT_POOL_TIMEOUT)
+    while True:
+        try:
+            connection = pool.get_connection()
+        except mysql.connector.errors.PoolError:
+            # Every connection is checked out; wait for one to be returned
+            if time.monotonic() > deadline:
+                raise
+
+            time.sleep(0.1)
+            continue
+
+        if is_healthy(connection):
+            return connection
+
+        connection.close()
+
+
 def value_or_empty(value, prepended=''):
     return '{} {}'.format(prepended, value) if value is not None else ''
 
 
 def generate_columns_string(columns):
-    columns_string = ''
-    delimiter = ''
-    for column in columns:
-        columns_string += delimiter
-        columns_string += escape_quotes(column)
-        delimiter = ', '
-
-    return '(' + columns_string + ')'
+    return bulk.generate_columns_string(columns)
 
 
 def generate_values_placeholders(length):
-    values_placeholders = ''
-    delimiter = ''
-    iterator = 0
-    while iterator < length:
-        values_placeholders += delimiter
-        values_placeholders += '%s'
-        iterator += 1
-        delimiter = ', '
-
-    return '(' + values_placeholders + ')'
+    return bulk.generate_row_placeholders(length)
 
 
 def generate_values_string(values):
@@ -63,9 +109,16 @@ def generate_values_string(values):
 
 class Database:
 
-    def __init__(self, debug=False, enable_cache=False):
+    def __init__(self, debug=False, enable_cache=False, bulk_engine=None):
         self.enable_cache = enable_cache
         self.cache = {}
+        self.bulk_engine = bulk.get_engine(bulk_engine if bulk_engine is not None else getenv('DB_BULK_ENGINE'))
+        self.upsert = (getenv('DB_WRITE_MODE') or 'upsert') == 'upsert'
+        self.natural_keys = {}
+        self.batch_strategy = bulk.BatchStrategy(
+            int(getenv('DB_BATCH_ROWS') or bulk.DEFAULT_BATCH_ROWS),
+            int(getenv('DB_BATCH_BYTES') or bulk.DEFAULT_BATCH_BYTES)
+        )
 
         self.hostname = getenv('DB_HOST')
         self.username = getenv('DB_USER')
@@ -91,16 +144,18 @@ class Database:
         elif self.is_connected():
             utils.log('There is already an active connection to the database')
         else:
-            self.connection = mysql.connector.connect(
-                user=self.username, password=self.password,
-                host=self.hostname, database=self.name, port=self.port
-            )
+            config = {
+                'user': self.username, 'password': self.password,
+                'host': self.hostname, 'database': self.name, 'port': self.port
+            }
+            config.update(self.bulk_engine.connection_options)
+            self.connection = checkout_connection(config)
 
     def is_connected(self):
         return self.connection is not None
 
     def reset_cache(self):
-        self.cache = {'table': None, 'sql': '', 'columns': [], 'values': []}
+        self.cache = {'table': None, 'columns': [], 'rows': [], 'size': 0}
 
     def transaction_active(self):
         return self.cursor is not None
@@ -119,69 +174,141 @@ class Database:
         elif not self.transaction_active():
             utils.log('There is no active transaction')
         else:
-            if len(self.cache['sql']) > 0:
-                self.cursor.execute(self.cache['sql'], self.cache['values'])
-                self.reset_cache()
-
-            self.connection.commit()
+            self.flush()
+            with instrumentation.phase('commit'):
+                self.connection.commit()
+            instrumentation.count('db_round_trips')
             self.cursor.close()
             self.cursor = None
             self.reset_cache()
 
+    # Writes to a table with a natural key become upserts, so re-running a module does not duplicate rows.
+    # The unique index the upsert matches on is added the first time the key is declared. Returns whether
+    # the key is enforced; if the index cannot be added, writes to the table stay plain inserts.
+    def declare_natural_key(self, table_name, natural_key):
+        enforced = natural_key is not None and self.upsert and self.ensure_unique_index(table_name, natural_key)
+        self.natural_keys[table_name] = tuple(natural_key) if enforced else None
+        return enforced
+
+    def ensure_unique_index(self, table_name, natural_key):
+        if not self.is_connected():
+            utils.log('There is no active connection to a database')
+            return False
+
+        index_key = (self.name, table_name, tuple(natural_key))
+        with unique_indexes_lock:
+            if index_key in unique_indexes:
+                return True
+
+            # ALTER TABLE commits implicitly, so this runs on its own cursor ahead of any transaction
+            cursor = self.connection.cursor()
+            try:
+                cursor.execute(FIND_UNIQUE_INDEXES, (table_name,))
+                index_columns = {}
+                for index_name, column_name in cursor.fetchall():
+                    index_columns.setdefault(index_name, set()).add(column_name)
+
+                instrumentation.count('db_round_trips')
+                if set(natural_key) not in index_columns.values():
+                    utils.log('Adding a unique index over {} to {}'.format(', '.join(natural_key), table_name))
+                    cursor.execute('ALTER TABLE {} ADD UNIQUE INDEX {} {}'.format(
+                        table_name, bulk.escape_column(NATURAL_KEY_INDEX), generate_columns_string(natural_key)
+                    ))
+                    instrumentation.count('db_round_trips')
+            except mysql.connector.Error as error:
+                utils.log('Cannot add a unique index over {} to {}, writing plain inserts: {}'.format(
+                    ', '.join(natural_key), table_name, error
+                ))
+                return False
+            finally:
+                cursor.close()
+
+            unique_indexes.add(index_key)
+
+        return True
+
+    # Adds a column that a newer version of a module writes to tables created before it
+    def ensure_column(self, table_name, column, definition):
+        if not self.is_connected():
+            utils.log('There is no active connection to a database')
+            return False
+
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(FIND_COLUMN, (table_name, column))
+            if cursor.fetchall()[0][0] == 0:
+                utils.log('Adding column {} to {}'.format(column, table_name))
+                cursor.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    table_name, bulk.escape_column(column), definition
+                ))
+        except mysql.connector.Error as error:
+            utils.log('Cannot add column {} to {}: {}'.format(column, table_name, error))
+            return False
+        finally:
+            cursor.close()
+
+        return True
+
     def insert(self, table_name, columns, values, debug=False):
-        auto_transact = False
         assert len(columns) == len(values), 'columns length must match values length'
+        self.insert_many(table_name, columns, [values], debug)
+
+    def insert_many(self, table_name, columns, rows, debug=False):
+        auto_transact = False
         if self.cursor is None:
             auto_transact = True
             self.start_transaction()
 
-        if not auto_transact:
-            if self.cache['table'] == table_name:
-                if utils.array_equals(columns, self.cache['columns']) and len(self.cache['sql']) < SQL_MAX_LENGTH:
-                    self.cache['values'] = self.cache['values'] + values
-                    self.cache['sql'] += ', {}'.format(generate_values_placeholders(len(values)))
-                else:
-                    self.cursor.execute(self.cache['sql'], self.cache['values'])
-                    self.reset_cache()
-                    self.insert(table_name, columns, values, debug)
-            else:
-                self.cache = {
-                    'table': table_name,
-                    'columns': columns,
-                    'values': values,
-                    'sql': 'INSERT INTO {} {} VALUES {}'.format(
+        if self.cache['table'] != table_name or not utils.array_equals(columns, self.cache['columns']):
+            self.flush()
+            self.cache['table'] = table_name
+            self.cache['columns'] = list(columns)
+
+        cached_rows = self.cache['rows']
+        for values in rows:
+            cached_rows.append(values)
+            self.cache['size'] += self.batch_strategy.measure(values)
+            if self.batch_strategy.is_full(len(cached_rows), self.cache['size']):
+                self.flush()
+                cached_rows = self.cache['rows']
+
+            if debug:
+                utils.log(
+                    'INSERT INTO {} {} VALUES {}'.format(
                         table_name,
                         generate_columns_string(columns),
-                        generate_values_placeholders(len(values))
+                        generate_values_string(values)
                     )
-                }
+                )
 
-        elif self.cache['table'] is not None:
-            self.cursor.execute(self.cache['sql'], self.cache['values'])
-            self.reset_cache()
-            self.insert(table_name, columns, values, debug)
+        if auto_transact:
+            self.commit()
 
-        else:
-            insertion_statement = 'INSERT INTO {} {} VALUES {}'.format(
-                table_name,
-                generate_columns_string(columns),
-                generate_values_placeholders(len(values))
-            )
-            self.cursor.execute(insertion_statement, values)
-
-        if debug:
-            utils.log(
-                'INSERT INTO {} {} VALUES {}'.format(
-                    table_name,
-                    generate_columns_string(columns),
-                    generate_values_string(values)
+    def flush(self):
+        if len(self.cache['rows']) > 0:
+            natural_key = self.natural_keys.get(self.cache['table']) if self.upsert else None
+            with instrumentation.phase('write'):
+                self.bulk_engine.write(
+                    self.cursor, self.cache['table'], self.cache['columns'], self.cache['rows'], natural_key
                 )
-            )
+            instrumentation.count('db_round_trips')
+            instrumentation.count('rows_written', len(self.cache['rows']))
+            instrumentation.count('bytes_written', self.cache['size'])
 
-        # self.cursor.execute(insertion_statement, values)
+        self.cache['rows'] = []
+        self.cache['size'] = 0
 
-        if auto_transact:
-            self.commit()
+    # Runs a single statement on its own cursor and commits it straight away
+    def execute(self, statement, values=None):
+        if not self.is_connected():
+            utils.log('There is no active connection to a database')
+            return
+
+        cursor = self.connection.cursor()
+        cursor.execute(statement, values)
+        cursor.close()
+        self.connection.commit()
+        instrumentation.count('db_round_trips', 2)
 
     def select(self, table_name, fields=None, where=None, limit=None):
         query = 'SELECT {} FROM {} {} {}'.format(
@@ -203,14 +330,28 @@ class Database:
             return None
 
         results = self.cursor.fetchall()
+        self.cursor.close()
         self.cursor = None
+        instrumentation.count('db_round_trips')
 
         return results
 
+    # Closing a pooled connection returns it to the pool
     def close(self):
         if self.is_connected():
+            if self.transaction_active():
+                self.cursor.close()
+                self.cursor = None
+
             self.connection.close()
             self.connection = None
 
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
     def __del__(self):
         self.close()
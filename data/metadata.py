@@ -0,0 +1,73 @@
+from common import utils
+from data import database
+
+import os
+
+WATERMARK_TABLE = 'module_watermark'
+CREATE_WATERMARK_TABLE = 'CREATE TABLE IF NOT EXISTS {} (' \
+                         '`name` VARCHAR(128) NOT NULL PRIMARY KEY, ' \
+                         '`watermark` VARCHAR(255) NOT NULL, ' \
+                         '`updated_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP)' \
+                         .format(WATERMARK_TABLE)
+STORE_WATERMARK = 'INSERT INTO {} (`name`, `watermark`) VALUES (%s, %s) ' \
+                  'ON DUPLICATE KEY UPDATE `watermark` = VALUES(`watermark`)'.format(WATERMARK_TABLE)
+
+
+def incremental_enabled():
+    return os.getenv('INCREMENTAL') is not None
+
+
+# Tracks the newest value (usually an ISO date) a module has loaded so later runs only load newer rows.
+# Outside of incremental mode every record counts as new and nothing is stored.
+class Watermark:
+
+    def __init__(self, name):
+        self.name = name
+        self.value = None
+        self.latest = None
+        self.enabled = incremental_enabled()
+
+    def load(self):
+        if not self.enabled:
+            return self.value
+
+        mysql_database = database.Database()
+        mysql_database.connect()
+        if mysql_database.is_connected():
+            mysql_database.execute(CREATE_WATERMARK_TABLE)
+            results = mysql_database.select(
+                WATERMARK_TABLE, ['watermark'], where='name = {}'.format(utils.escape_quotes(self.name))
+            )
+            self.value = results[0][0] if results is not None and len(results) > 0 else None
+            mysql_database.close()
+
+        if self.value is not None:
+            utils.log('Loading {} records newer than {}'.format(self.name, self.value))
+
+        return self.value
+
+    def is_new(self, value):
+        if value is None:
+            return self.value is None
+
+        if self.latest is None or value > self.latest:
+            self.latest = value
+
+        return self.value is None or value > self.value
+
+    def filter(self, records, get_value):
+        for record in records:
+            if self.is_new(get_value(record)):
+                yield record
+
+    def store(self):
+        if not self.enabled or self.latest is None or (self.value is not None and self.latest <= self.value):
+            return
+
+        mysql_database = database.Database()
+        mysql_database.connect()
+        if mysql_database.is_connected():
+            mysql_database.execute(CREATE_WATERMARK_TABLE)
+            mysql_database.execute(STORE_WATERMARK, (self.name, self.latest))
+            mysql_database.close()
+            self.value = self.latest
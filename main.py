@@ -1,9 +1,10 @@
-from common import utils
+from common import instrumentation, utils, scheduler
 from resource import apha, cdc, kff, wapo, elab, census, google
 
 import math
 import time
 import sys
+import os
 import re
 
 
@@ -19,10 +20,37 @@ def validate_module_list(module_list, module_set):
             sys.exit(1)
 
 
+def run_module(module):
+    utils.log('Starting module {}...'.format(module['id']))
+    module_start_time = time.perf_counter()
+    instrumentation.start_module(module['id'])
+    profiler = instrumentation.get_profiler(module['id'])
+    if profiler is not None:
+        profiler.start()
+
+    status = 'failed'
+    try:
+        instantiated_module = module['module']()
+        with instrumentation.phase('fetch'):
+            instantiated_module.fetch()
+        if instantiated_module.has_data():
+            with instrumentation.phase('save'):
+                instantiated_module.save()
+        status = 'ok'
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        instrumentation.finish_module(status)
+
+    module_end_time = time.perf_counter()
+    return math.ceil(module_end_time - module_start_time)
+
+
 if __name__ == '__main__':
 
     include_modules_arg_pattern = re.compile('^--include-modules.*')
     exclude_modules_arg_pattern = re.compile('^--exclude-modules.*')
+    workers_arg_pattern = re.compile('^--workers=(\\d+)$')
     joined_arg_pattern = re.compile('.*-modules=(.*)')
 
     list_modules_flag = False
@@ -32,7 +60,9 @@ if __name__ == '__main__':
     included_modules_set = set()
     excluded_modules_set = set()
     all_modules_set = set()
+    workers = int(os.getenv('MODULE_WORKERS') or scheduler.DEFAULT_WORKERS)
 
+    # depends_on lists the modules whose tables must be populated before a module can run
     modules = [
         {'id': 'census_county_geo_codes', 'module': census.CountyGeoCodes},
         {'id': 'census_population', 'module': census.Population},
@@ -43,16 +73,33 @@ if __name__ == '__main__':
         {'id': 'kff_cases_by_race', 'module': kff.CasesByRace},
         {'id': 'kff_deaths_by_race', 'module': kff.DeathsByRace},
         {'id': 'kff_vaccinations_by_race', 'module': kff.VaccinationsByRace},
-        {'id': 'wapo_police_shootings', 'module': wapo.PoliceShootings},
-        {'id': 'apha_map_racism_declarations', 'module': apha.RacismDeclarations},
-        {'id': 'elab_weekly_evictions', 'module': elab.WeeklyEvictions},
+        {
+            'id': 'wapo_police_shootings',
+            'module': wapo.PoliceShootings,
+            'depends_on': ['census_county_geo_codes']
+        },
+        {
+            'id': 'apha_map_racism_declarations',
+            'module': apha.RacismDeclarations,
+            'depends_on': ['census_county_geo_codes']
+        },
+        {
+            'id': 'elab_weekly_evictions',
+            'module': elab.WeeklyEvictions,
+            'depends_on': ['census_county_geo_codes']
+        },
         {'id': 'google_mobility_report', 'module': google.MobilityReport}
     ]
 
     populate_module_set(utils.array_map_by_key(modules, 'id'), all_modules_set)
 
     for arg in sys.argv:
-        if include_modules_arg_pattern.match(arg) is not None:
+        if arg == '--incremental':
+            # Read by data.metadata.Watermark in every module
+            os.environ['INCREMENTAL'] = '1'
+        elif workers_arg_pattern.match(arg) is not None:
+            workers = int(workers_arg_pattern.match(arg).groups()[0])
+        elif include_modules_arg_pattern.match(arg) is not None:
             match_result = joined_arg_pattern.match(arg)
             if match_result is not None:
                 module_argument_list = match_result.groups()[0].split(',')
@@ -80,23 +127,23 @@ if __name__ == '__main__':
             exclude_modules_flag = False
 
     start_time = time.perf_counter()
-    time_perf_counters = []
 
+    selected_modules = []
     for module in modules:
         if (len(included_modules_set) == 0 or module['id'] in included_modules_set) and \
                 (len(excluded_modules_set) == 0 or module['id'] not in excluded_modules_set):
-            utils.log('Starting module {}...'.format(module['id']))
-            module_start_time = time.perf_counter()
-            instantiated_module = module['module']()
-            instantiated_module.fetch()
-            if instantiated_module.has_data():
-                instantiated_module.save()
-            module_end_time = time.perf_counter()
-            time_perf_counters.append({'id': module['id'], 'time': math.ceil(module_end_time - module_start_time)})
+            selected_modules.append(module)
+
+    time_perf_counters, failed_modules = scheduler.Scheduler(workers).run(selected_modules, run_module)
 
     for counter in time_perf_counters:
         utils.log('{} finished in {} seconds'.format(counter['id'], counter['time']))
 
     end_time = time.perf_counter()
+    instrumentation.write_report()
 
     utils.log('Application finished in {} seconds'.format(math.ceil(end_time - start_time)))
+
+    if len(failed_modules) > 0:
+        utils.log('Failed modules: {}'.format(', '.join(sorted(failed_modules))))
+        sys.exit(1)
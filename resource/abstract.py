@@ -1,16 +1,20 @@
 from common import utils
 from data import database
-
-import types
+from resource import fields
 
 
 class Resource:
 
     def __init__(self):
         self.table_name = ''
+        self.natural_key = None
         self.raw_data = None
         self.skipping = False
         self.fields = []
+        # Optional metadata.Watermark; when set only records newer than it are written
+        self.watermark = None
+        # http.Download payloads the records came from, acknowledged once they are saved
+        self.downloads = []
 
     def skip_record(self, record):
         return self.skipping and record is not None
@@ -18,54 +22,45 @@ class Resource:
     def has_data(self):
         return self.raw_data is not None
 
+    def get_watermark_value(self, record):
+        return None
+
     def save(self, record_cache=None):
         mysql_database = database.Database()
         mysql_database.connect()
 
         if mysql_database.is_connected():
+            mysql_database.declare_natural_key(self.table_name, self.natural_key)
             mysql_database.start_transaction()
 
-            records = list(self.raw_data)
-            record_count = len(records)
+            records = self.raw_data
+            record_count = utils.count_records(records)
             records_processed = 0
 
             # Used to cache values for additional calculations
             if record_cache is None:
                 record_cache = {}
 
-            for record in records:
-                columns = []
-                values = []
-
-                if self.skip_record(record):
-                    records_processed += 1
-                    utils.progress(records_processed, record_count)
-                    continue
-
-                for field in self.fields:
-                    if 'column' in field:
-                        columns.append(field['column'])
-                    elif 'field' in field:
-                        columns.append(field['field'])
-
-                    # Populating the values array
-                    if 'data' in field:
-                        if isinstance(field['data'], types.FunctionType):
-                            values.append(field['data'].__call__(record, field['field'], record_cache))
-                        elif isinstance(field['data'], types.MethodType):
-                            values.append(field['data'].__call__(record, field['field'], record_cache))
-                        elif isinstance(field['data'], str):
-                            values.append(field['data'])
-
-                    elif 'field' in field:
-                        if isinstance(field['field'], str):
-                            values.append(record[field['field']])
-                        elif isinstance(field['field'], types.FunctionType):
-                            values.append(field['field'].__call__(record))
-
-                mysql_database.insert(self.table_name, columns, values)
-
-                records_processed += 1
+            compiled_fields = fields.compile_fields(self.fields, fields.RESOURCE_CONVENTION)
+            if self.watermark is not None:
+                self.watermark.load()
+
+            for batch in utils.batched(records, fields.DEFAULT_BATCH_SIZE):
+                batch_records = [record for record in batch if not self.skip_record(record)]
+                rows = compiled_fields.rows(batch_records, record_cache)
+
+                # Rows are still built for old records so fields that carry state across records stay correct
+                if self.watermark is not None:
+                    rows = [row for record, row in zip(batch_records, rows)
+                            if self.watermark.is_new(self.get_watermark_value(record))]
+
+                mysql_database.insert_many(self.table_name, compiled_fields.columns, rows)
+
+                records_processed += len(batch)
                 utils.progress(records_processed, record_count)
 
             mysql_database.commit()
+            for download in self.downloads:
+                download.acknowledge()
+            if self.watermark is not None:
+                self.watermark.store()
@@ -1,15 +1,17 @@
-from common import constants, utils
+from common import constants, geocoding, utils
 from resource import census, abstract
 from data import database
 
 import requests
-import time
-import math
-import json
 import csv
 import io
+import os
 
-nominatim_api_url = 'https://nominatim.openstreetmap.org/reverse?format=json&lat={}&lon={}'
+# NOMINATIM_URL can point at a local geocoder; the public API allows one request per second
+nominatim_api_url = os.getenv('NOMINATIM_URL') or \
+    'https://nominatim.openstreetmap.org/reverse?format=json&lat={}&lon={}'
+NULL_ADDRESS = {'city': 'N/A', 'county': 'N/A', 'state': 'N/A'}
+COUNTY_COORDINATES_COLUMNS = ['longitude', 'latitude', 'city', 'county_location_data_id']
 
 URL = 'https://docs.google.com/spreadsheets/d/e/' + \
       '2PACX-1vRkLVhZFb2K0K9LWxxrZujKaGP1qcpsbZ9gCtAfM6eHGZuNa_qxBHwKpSPYfAiPSoMChphBJsMd4o7Z/pub' + \
@@ -35,8 +37,15 @@ def create_cache_key(record):
     return '{},{}'.format(latitude, longitude)
 
 
-def diff(value1, value2):
-    return math.ceil(value1) - math.ceil(value2)
+def get_nominatim_address(response):
+    return response['address'] if 'address' in response else NULL_ADDRESS
+
+
+def create_geocoder():
+    return geocoding.ReverseGeocoder(
+        'nominatim', nominatim_api_url, get_nominatim_address,
+        rate=float(os.getenv('NOMINATIM_RATE') or geocoding.DEFAULT_GEOCODER_RATE)
+    )
 
 
 def should_start_processing(record):
@@ -47,10 +56,6 @@ def should_start_processing(record):
     return start_processing
 
 
-def escape_quotes(value):
-    return value.replace('\'', '\\\'')
-
-
 def should_start_processing(record):
     start_processing = True
     for field_name in FIELDNAMES:
@@ -63,11 +68,16 @@ class RacismDeclarations(abstract.Resource):
 
     def __init__(self):
         super(RacismDeclarations, self).__init__()
-        self.last_api_call_time = None
         self.start_processing = False
         self.geo_locations = None
+        self.location_index = None
+        self.geocoder = create_geocoder()
+        self.addresses = {}
+        self.county_index = None
+        self.county_coordinates = []
         self.raw_data = None
         self.table_name = 'apha_map'
+        self.natural_key = ('entity_name', 'state', 'date')
         self.fields = [
             {'field': 'Date of Declaration', 'data': ensure_iso_date, 'column': 'date'},
             {'field': 'Longitude', 'column': 'longitude'},
@@ -85,7 +95,7 @@ class RacismDeclarations(abstract.Resource):
     def fetch(self):
         request = requests.request('GET', URL)
         request_content = request.content.decode('utf-8')
-        self.raw_data = csv.DictReader(io.StringIO(request_content), fieldnames=FIELDNAMES)
+        self.raw_data = list(csv.DictReader(io.StringIO(request_content), fieldnames=FIELDNAMES))
 
         census_geo_locations = census.GeoLocations()
         census_geo_locations.fetch()
@@ -97,123 +107,128 @@ class RacismDeclarations(abstract.Resource):
         self.start_processing = self.start_processing if self.start_processing else should_start_processing(record)
         return should_skip_record
 
-    def get_address_by_coordinates(self, latitude, longitude, retry=False):
-
-        if retry:
-            time.sleep(1)
-
-        if self.last_api_call_time is None or diff(time.perf_counter(), self.last_api_call_time) > 1:
-            request = requests.request('GET', nominatim_api_url.format(latitude, longitude))
-            if request.status_code == 200:
-                null_response = {'city': 'N/A', 'county': 'N/A', 'state': 'N/A'}
-                response = json.loads(request.content.decode('utf-8'))
-                self.last_api_call_time = time.perf_counter()
-                return response['address'] if response.__contains__('address') else null_response
-            else:
-                return self.get_address_by_coordinates(latitude, longitude, retry=True)
-        else:
-            return self.get_address_by_coordinates(latitude, longitude, retry=True)
-
-    def get_county(self, record, record_key, record_cache):
+    def get_address_by_coordinates(self, latitude, longitude):
+        # None when the coordinates could not be geocoded
+        if not geocoding.valid_coordinates(latitude, longitude):
+            return None
+
+        key = geocoding.round_coordinates(latitude, longitude)
+        if key not in self.addresses:
+            self.addresses.update(self.geocoder.resolve_all([(latitude, longitude)]))
+
+        return self.addresses[key]
+
+    def get_declaration_records(self):
+        start_processing = False
+        for record in self.raw_data:
+            if start_processing:
+                yield record
+
+            start_processing = start_processing or should_start_processing(record)
+
+    def resolve_addresses(self, record_cache):
+        # Everything the saved locations or the nearest known location cannot answer is geocoded up front,
+        # so the field pipeline never waits on the rate limit
+        coordinates = set()
+        for record in self.get_declaration_records():
+            latitude, longitude = record['Latitude'], record['Longitude']
+            if create_cache_key(record) in record_cache or not geocoding.valid_coordinates(latitude, longitude):
+                continue
+            if self.location_index is not None and self.location_index.nearest(latitude, longitude) is not None:
+                continue
+
+            coordinates.add(geocoding.round_coordinates(latitude, longitude))
+
+        self.addresses = self.geocoder.resolve_all(sorted(coordinates))
+        utils.log('Resolved {} coordinates for {} with {} errors'.format(
+            len(self.addresses), self.table_name, self.geocoder.errors
+        ))
+
+    def resolve_nearby(self, record, cache_key, record_cache):
+        if cache_key in record_cache or self.location_index is None:
+            return
+
+        nearby_location = self.location_index.nearest(record['Latitude'], record['Longitude'])
+        if nearby_location is not None:
+            # The nearby city stands in for a geocoded one, but the county comes from the boundaries when they know it
+            boundary_county = census.get_county_boundaries().resolve(record['Latitude'], record['Longitude'])
+            record_cache[cache_key] = {
+                'longitude': record['Longitude'],
+                'latitude': record['Latitude'],
+                'city': nearby_location['city'],
+                'county': boundary_county['county'] if boundary_county is not None else nearby_location['county']
+            }
+
+    def resolve_address(self, record, record_cache):
         longitude = record['Longitude']
         latitude = record['Latitude']
         cache_key = create_cache_key(record)
-        county = 'N/A'
-        city = 'N/A'
-        state = 'N/A'
-
         if cache_key in record_cache:
-            county = record_cache[cache_key][record_key]
+            return record_cache[cache_key]
+
+        # Boundaries only know the county, so the city still comes from the geocoder
+        boundary_county = census.get_county_boundaries().resolve(latitude, longitude)
+        address = self.get_address_by_coordinates(latitude, longitude)
+        if address is None:
+            # Failed lookups stay out of the record cache and the geocode cache, so the next run tries them again
+            return {'city': 'N/A', 'county': boundary_county['county'] if boundary_county is not None else 'N/A'}
+
+        county = address['county'] if 'county' in address else 'N/A'
+        county = county.replace('City and County of ', '')
+        city = address['city'] if 'city' in address else 'N/A'
+        state = address['state'] if 'state' in address else 'N/A'
+        # There is an edge case to how Washington, DC is represented in the api
+        if state == 'District of Columbia':
+            state = 'Washington, DC'
+            county = 'District of Columbia'
+            city = 'Washington'
+        elif county == 'Saint Joseph County':
+            county = 'St. Joseph County'
+            state = 'Indiana'
+        elif county == 'Saint Clair County':
+            county = 'St. Clair County'
+
+        if boundary_county is not None:
+            county = boundary_county['county']
+            state = boundary_county['state'] or state
+
+        county_location = self.county_index.find(county, state)
+        if county_location is not None:
+            self.county_coordinates.append((longitude, latitude, city, county_location['id']))
         else:
-            address = self.get_address_by_coordinates(latitude, longitude)
-
-            db = database.Database()
-            db.connect()
-            county_location_data_fields = ['id', 'county', 'state']
-            county = address[record_key] if record_key in address else county
-            county = county.replace('City and County of ', '')
-            city = address['city'] if 'city' in address else city
-            state = address['state'] if 'state' in address else state
-            # There is an edge case to how Washington, DC is represented in the api
-            if state == 'District of Columbia':
-                state = 'Washington, DC'
-                county = 'District of Columbia'
-                city = 'Washington'
-            elif county == 'Saint Joseph County':
-                county = 'St. Joseph County'
-                state = 'Indiana'
-            elif county == 'Saint Clair County':
-                county = 'St. Clair County'
-            where_clause = "county like '{}%' and state = '{}'".format(escape_quotes(county), state)
-            county_locations = db.select('county_location_data', fields=county_location_data_fields, where=where_clause)
-            if len(county_locations) == 1:
-                county_coordinates_data_columns = ['longitude', 'latitude', 'city', 'county_location_data_id']
-                county_coordinates_data_values = [longitude, latitude, city, county_locations[0][0]]
-                db.insert('county_coordinates_data', county_coordinates_data_columns, county_coordinates_data_values)
-                db.close()
-                record_cache[cache_key] = {
-                    'longitude': longitude,
-                    'latitude': latitude,
-                    'city': city,
-                    'county': county
-                }
-            else:
-                utils.log(
-                    'No location data found for record with Latitude={}, Longitude={}, county={}, state={}'
-                    .format(latitude, longitude, county, address['state'])
-                )
-
-        return county
+            utils.log(
+                'No location data found for record with Latitude={}, Longitude={}, county={}, state={}'
+                .format(latitude, longitude, county, address['state'] if 'state' in address else state)
+            )
+
+        # Both the city and the county field read this, so each coordinate is looked up and recorded once
+        record_cache[cache_key] = {
+            'longitude': longitude,
+            'latitude': latitude,
+            'city': city,
+            'county': county
+        }
+        return record_cache[cache_key]
+
+    def get_county(self, record, record_key, record_cache):
+        self.resolve_nearby(record, create_cache_key(record), record_cache)
+        return self.resolve_address(record, record_cache)[record_key]
 
     def get_city(self, record, record_key, record_cache):
-        longitude = record['Longitude']
-        latitude = record['Latitude']
-        cache_key = create_cache_key(record)
-        county = 'N/A'
-        city = 'N/A'
-        state = 'N/A'
-        if cache_key in record_cache:
-            city = record_cache[cache_key][record_key]
-        elif self.last_api_call_time is None or diff(time.perf_counter(), self.last_api_call_time) > 1:
-            address = self.get_address_by_coordinates(latitude, longitude)
-
-            db = database.Database()
-            db.connect()
-            county_location_data_fields = ['id', 'county', 'state']
-            county = address['county'] if 'county' in address else county
-            county = county.replace('City and County of ', '')
-            city = address[record_key] if record_key in address else city
-            state = address['state'] if 'state' in address else state
-            # There is an edge case to how Washington, DC is represented in the api
-            if state == 'District of Columbia':
-                state = 'Washington, DC'
-                county = 'District of Columbia'
-                city = 'Washington'
-            elif county == 'Saint Joseph County':
-                county = 'St. Joseph County'
-                state = 'Indiana'
-            elif county == 'Saint Clair County':
-                county = 'St. Clair County'
-            where_clause = "county like '{}%' and state = '{}'".format(escape_quotes(county), state)
-            county_locations = db.select('county_location_data', fields=county_location_data_fields, where=where_clause)
-            if len(county_locations) == 1:
-                county_coordinates_data_columns = ['longitude', 'latitude', 'city', 'county_location_data_id']
-                county_coordinates_data_values = [longitude, latitude, city, county_locations[0][0]]
-                db.insert('county_coordinates_data', county_coordinates_data_columns, county_coordinates_data_values)
-                db.close()
-                record_cache[cache_key] = {
-                    'longitude': longitude,
-                    'latitude': latitude,
-                    'city': city,
-                    'county': county
-                }
-            else:
-                utils.log(
-                    'No location data found for record with Latitude={}, Longitude={}, county={}, state={}'
-                    .format(latitude, longitude, county, address['state'])
-                )
-
-        return city
+        self.resolve_nearby(record, create_cache_key(record), record_cache)
+        return self.resolve_address(record, record_cache)[record_key]
+
+    def save_county_coordinates(self):
+        # Coordinates matched to a county during the save are linked in one transaction afterwards
+        if len(self.county_coordinates) == 0:
+            return
+
+        with database.Database() as mysql_database:
+            if mysql_database.is_connected():
+                mysql_database.start_transaction()
+                mysql_database.insert_many('county_coordinates_data', COUNTY_COORDINATES_COLUMNS,
+                                           self.county_coordinates)
+                mysql_database.commit()
 
     def save(self, record_cache=None):
         record_cache = {}
@@ -221,4 +236,9 @@ class RacismDeclarations(abstract.Resource):
             cache_key = create_cache_key(location)
             record_cache[cache_key] = location
 
+        self.location_index = geocoding.build_location_index(self.geo_locations)
+        self.county_index = census.load_county_index()
+        self.resolve_addresses(record_cache)
+        self.county_coordinates = []
         abstract.Resource.save(self, record_cache)
+        self.save_county_coordinates()
@@ -1,11 +1,12 @@
-from common import constants, utils
+from common import coerce, columnar, constants, http, rolling, stream, utils
 from resource import census, abstract
+from data import metadata
 
+import functools
 import datetime
 import requests
 import json
-import csv
-import io
+import os
 
 SAT_WEEKDAY_INDEX = 5
 STATE_TREND_URL = 'https://covid.cdc.gov/covid-data-tracker/COVIDData/getAjaxData?id=us_trend_by_{}'
@@ -40,6 +41,9 @@ class Hospitalizations(abstract.Resource):
     def __init__(self):
         super(Hospitalizations, self).__init__()
         self.table_name = 'cdc_hospitalizations'
+        self.natural_key = (
+            'catchment', 'network', 'mmwr_year', 'mmwr_week', 'age_category', 'sex_category', 'race_category'
+        )
         self.raw_data = None
         self.fields = [
             {'field': 'catchment'},
@@ -63,147 +67,56 @@ class Hospitalizations(abstract.Resource):
         return self.raw_data is not None
 
 
-def accumulate_tests(record, record_key, cache):
-    cumulative_tests_key = 'cumulative_tests'
-    cache_key = record['state']
-    if cache_key not in cache:
-        cache[cache_key] = {}
+TREND_METRICS = [
+    ('tests', 'new_test_results_reported', lambda values: rolling.cumulative_sums(values)),
+    # Cases have always been added to the running sum as-is but only subtracted when they are ints
+    (
+        'cases_7_day_mean',
+        'New_case',
+        lambda values: rolling.rolling_means(values, 7, addend=rolling.identity, subtrahend=rolling.int_or_zero)
+    ),
+    ('deaths_7_day_mean', 'new_death', lambda values: rolling.rolling_means(values, 7)),
+    ('tests_7_day_mean', 'new_test_results_reported', lambda values: rolling.rolling_means(values, 7)),
+    ('pct_change_weekly_cases_7', 'New_case', lambda values: rolling.percent_changes(values, 7)),
+    ('pct_change_weekly_cases_14', 'New_case', lambda values: rolling.percent_changes(values, 14)),
+    ('pct_change_weekly_deaths_7', 'new_death', lambda values: rolling.percent_changes(values, 7)),
+    ('pct_change_weekly_deaths_14', 'new_death', lambda values: rolling.percent_changes(values, 14)),
+    ('pct_change_weekly_tests_7', 'new_test_results_reported', lambda values: rolling.percent_changes(values, 7)),
+    ('pct_change_weekly_tests_14', 'new_test_results_reported', lambda values: rolling.percent_changes(values, 14))
+]
 
-    if cumulative_tests_key not in cache[cache_key]:
-        cache[cache_key][cumulative_tests_key] = 0
 
-    new_test_results_reported = record[record_key] if record[record_key] is not None else 0
-    cache[cache_key][cumulative_tests_key] += new_test_results_reported
-    return cache[cache_key][cumulative_tests_key]
+TREND_ROW = 'trend_metrics_row'
 
 
-def get_new_cases_seven_day_avg(record, record_key, cache):
-    namespace_key = 'cases_seven_day_avg'
-    cache_key = record['state']
-    if cache_key not in cache:
-        cache[cache_key] = {}
+def get_trend_date(record):
+    iso_date = utils.ensure_iso_date(record['date'])
+    return iso_date if iso_date is not None else ''
 
-    if namespace_key not in cache[cache_key]:
-        cache[cache_key][namespace_key] = {}
-        cache[cache_key][namespace_key]['last_seven_records'] = []
-        cache[cache_key][namespace_key]['last_seven_records_sum_of_cases'] = 0
 
-    cases_seven_day_avg = cache[cache_key][namespace_key]
-    last_seven_records = cases_seven_day_avg['last_seven_records']
-    if len(last_seven_records) == 7:
-        removed_record = last_seven_records.pop(0)
-        cases_seven_day_avg['last_seven_records_sum_of_cases'] -= removed_record \
-            if isinstance(removed_record, int) else 0
+# Computes every rolling metric for every record in one pass per state. The results are packed by column with
+# one row per record; each record keeps the position of its row under TREND_ROW
+def compute_trend_metrics(records):
+    records_by_state = {}
+    for record in records:
+        if skip_record(record):
+            continue
 
-    last_seven_records.append(record[record_key])
-    cases_seven_day_avg['last_seven_records_sum_of_cases'] += record[record_key]
+        if record['state'] not in records_by_state:
+            records_by_state[record['state']] = []
 
-    return cases_seven_day_avg['last_seven_records_sum_of_cases'] / 7 if len(last_seven_records) == 7 else 0
-
-
-def records_percent_change_last_n_days(record, record_key, cache, record_type, n):
-    namespace_key = '{}_percent_change_{}_day'.format(record_type, n)
-    # Need to keep track of n + 1 the number of records to
-    # calculate the percentage change of the first day of
-    # the new iterative range and the last day of the
-    # previous iterative range
-    record_collection_key = 'last_n_plus_one_records'
-    cache_key = record['state']
-    if cache_key not in cache:
-        cache[cache_key] = {}
-
-    if namespace_key not in cache[cache_key]:
-        cache[cache_key][namespace_key] = {}
-        cache[cache_key][namespace_key][record_collection_key] = []
-
-    last_n_plus_one_records = cache[cache_key][namespace_key][record_collection_key]
-    if len(last_n_plus_one_records) == n + 1:
-        last_n_plus_one_records.pop(0)
-
-    last_n_plus_one_records.append(record[record_key])
-
-    record_percent_change_last_n_days = 0
-    if len(last_n_plus_one_records) == n + 1:
-        first_record_value = last_n_plus_one_records[0]
-        last_record_value = last_n_plus_one_records[n]
-        if None not in [first_record_value, last_record_value] and first_record_value > 0:
-            record_percent_change_last_n_days = (last_record_value - first_record_value) / first_record_value
-
-    return record_percent_change_last_n_days
-
-
-def cases_percent_change_last_seven_days(record, record_key, cache):
-    return records_percent_change_last_n_days(record, record_key, cache, 'cases', 7)
-
-
-def cases_percent_change_last_fourteen_days(record, record_key, cache):
-    return records_percent_change_last_n_days(record, record_key, cache, 'cases', 14)
-
-
-def get_new_deaths_seven_day_avg(record, record_key, cache):
-    namespace_key = 'deaths_seven_day_avg'
-    cache_key = record['state']
-    if cache_key not in cache:
-        cache[cache_key] = {}
-
-    if namespace_key not in cache[cache_key]:
-        cache[cache_key][namespace_key] = {}
-        cache[cache_key][namespace_key]['last_seven_records'] = []
-        cache[cache_key][namespace_key]['last_seven_records_sum_of_deaths'] = 0
-
-    deaths_seven_day_avg = cache[cache_key][namespace_key]
-    last_seven_records = deaths_seven_day_avg['last_seven_records']
-    if len(last_seven_records) == 7:
-        removed_record = last_seven_records.pop(0)
-        deaths_seven_day_avg['last_seven_records_sum_of_deaths'] -= removed_record \
-            if isinstance(removed_record, int) else 0
-
-    last_seven_records.append(record[record_key])
-    deaths_seven_day_avg['last_seven_records_sum_of_deaths'] += record[record_key] \
-        if isinstance(record[record_key], int) else 0
-
-    return deaths_seven_day_avg['last_seven_records_sum_of_deaths'] / 7 if len(last_seven_records) == 7 else 0
-
-
-def deaths_percent_change_last_seven_days(record, record_key, cache):
-    return records_percent_change_last_n_days(record, record_key, cache, 'deaths', 7)
-
-
-def deaths_percent_change_last_fourteen_days(record, record_key, cache):
-    return records_percent_change_last_n_days(record, record_key, cache, 'deaths', 14)
-
-
-def get_new_tests_seven_day_avg(record, record_key, cache):
-    namespace_key = 'tests_seven_day_avg'
-    cache_key = record['state']
-    if cache_key not in cache:
-        cache[cache_key] = {}
-
-    if namespace_key not in cache[cache_key]:
-        cache[cache_key][namespace_key] = {}
-        cache[cache_key][namespace_key]['last_seven_records'] = []
-        cache[cache_key][namespace_key]['last_seven_records_sum_of_tests'] = 0
-
-    tests_seven_day_avg = cache[cache_key][namespace_key]
-    last_seven_records = tests_seven_day_avg['last_seven_records']
-    if len(last_seven_records) == 7:
-        removed_record = last_seven_records.pop(0)
-        tests_seven_day_avg['last_seven_records_sum_of_tests'] -= removed_record \
-            if isinstance(removed_record, int) else 0
-
-    last_seven_records.append(record[record_key])
-    tests_seven_day_avg['last_seven_records_sum_of_tests'] += record[record_key] \
-        if isinstance(record[record_key], int) else 0
-
-    return tests_seven_day_avg['last_seven_records_sum_of_tests'] / 7 if len(last_seven_records) == 7 else 0
-
-
-def tests_percent_change_last_seven_days(record, record_cache, cache):
-    return records_percent_change_last_n_days(record, record_cache, cache, 'tests', 7)
+        records_by_state[record['state']].append(record)
 
+    trend_metrics = columnar.RecordStore([metric_name for metric_name, _, _ in TREND_METRICS])
+    for state_records in records_by_state.values():
+        state_records.sort(key=get_trend_date)
+        metric_columns = [
+            compute([record[record_key] for record in state_records]) for _, record_key, compute in TREND_METRICS
+        ]
+        for record, metric_row in zip(state_records, zip(*metric_columns)):
+            record[TREND_ROW] = trend_metrics.append(metric_row)
 
-def tests_percent_change_last_fourteen_days(record, record_cache, cache):
-    return records_percent_change_last_n_days(record, record_cache, cache, 'tests', 14)
+    return trend_metrics
 
 
 def get_positivity_rate(*value):
@@ -211,10 +124,6 @@ def get_positivity_rate(*value):
     return record['New_case'] / record[record_key] if record[record_key] is not None and record[record_key] > 0 else 0
 
 
-def ensure_int(*values):
-    return utils.ensure_int(values[0][values[1]])
-
-
 def ensure_iso_date(*values):
     return utils.ensure_iso_date(values[0][values[1]])
 
@@ -232,51 +141,62 @@ class StateTrends(abstract.Resource):
     def __init__(self):
         super(StateTrends, self).__init__()
         self.table_name = 'state_trend_data'
-        self.population_estimates = None
+        self.natural_key = ('geography', 'date')
+        self.watermark = metadata.Watermark(self.table_name)
+        self.population_model = None
         self.vaccines_state_trend = None
+        self.trend_metrics = None
         self.raw_data = None
         self.fields = [
             {'field': 'geography'},
             {'field': 'date', 'data': ensure_iso_date},
             {'field': 'tot_cases', 'column': 'cases'},
             {'field': 'tot_deaths', 'column': 'deaths'},
-            {'field': 'new_test_results_reported', 'column': 'tests', 'data': accumulate_tests},
+            {'field': 'new_test_results_reported', 'column': 'tests', 'data': self.trend_metric('tests')},
             {'field': 'New_case', 'column': 'cases_change'},
             {'field': 'new_death', 'column': 'deaths_change'},
-            {'field': 'new_test_results_reported', 'column': 'tests_change', 'data': ensure_int},
-            {'field': 'New_case', 'column': 'cases_7_day_mean', 'data': get_new_cases_seven_day_avg},
-            {'field': 'new_death', 'column': 'deaths_7_day_mean', 'data': get_new_deaths_seven_day_avg},
-            {'field': 'new_test_results_reported', 'column': 'tests_7_day_mean', 'data': get_new_tests_seven_day_avg},
+            {'field': 'new_test_results_reported', 'column': 'tests_change', 'type': coerce.INT},
+            {'field': 'New_case', 'column': 'cases_7_day_mean', 'data': self.trend_metric('cases_7_day_mean')},
+            {'field': 'new_death', 'column': 'deaths_7_day_mean', 'data': self.trend_metric('deaths_7_day_mean')},
+            {
+                'field': 'new_test_results_reported',
+                'column': 'tests_7_day_mean',
+                'data': self.trend_metric('tests_7_day_mean')
+            },
             {'field': 'new_test_results_reported', 'column': 'positivity_rate', 'data': get_positivity_rate},
             {'field': 'New_case', 'column': 'cases_per_million', 'data': self.get_cases_per_million},
             {'field': 'new_death', 'column': 'deaths_per_million', 'data': self.get_deaths_per_million},
             {'field': 'new_test_results_reported', 'column': 'tests_per_million', 'data': self.get_tests_per_million},
 
-            {'field': 'New_case', 'column': 'pct_change_weekly_cases_7', 'data': cases_percent_change_last_seven_days},
+            {
+                'field': 'New_case',
+                'column': 'pct_change_weekly_cases_7',
+                'data': self.trend_metric('pct_change_weekly_cases_7')
+            },
             {
                 'field': 'New_case',
                 'column': 'pct_change_weekly_cases_14',
-                'data': cases_percent_change_last_fourteen_days
+                'data': self.trend_metric('pct_change_weekly_cases_14')
             },
             {
                 'field': 'new_death',
                 'column': 'pct_change_weekly_deaths_7',
-                'data': deaths_percent_change_last_seven_days
+                'data': self.trend_metric('pct_change_weekly_deaths_7')
             },
             {
                 'field': 'new_death',
                 'column': 'pct_change_weekly_deaths_14',
-                'data': deaths_percent_change_last_fourteen_days
+                'data': self.trend_metric('pct_change_weekly_deaths_14')
             },
             {
                 'field': 'new_test_results_reported',
                 'column': 'pct_change_weekly_tests_7',
-                'data': tests_percent_change_last_seven_days
+                'data': self.trend_metric('pct_change_weekly_tests_7')
             },
             {
                 'field': 'new_test_results_reported',
                 'column': 'pct_change_weekly_tests_14',
-                'data': tests_percent_change_last_fourteen_days
+                'data': self.trend_metric('pct_change_weekly_tests_14')
             },
             {'field': 'percent_positive_7_day', 'column': 'positivity_rate_7_day_mean', 'data': nil},
             {'field': 'percent_positive_7_day', 'column': 'positivity_rate_14_day_mean', 'data': nil},
@@ -294,6 +214,15 @@ class StateTrends(abstract.Resource):
     def skip_record(self, record):
         return skip_record(record)
 
+    def get_watermark_value(self, record):
+        return utils.ensure_iso_date(record['date'])
+
+    def trend_metric(self, metric_name):
+        return functools.partial(self.get_trend_metric, metric_name)
+
+    def get_trend_metric(self, metric_name, record, record_key, cache):
+        return self.trend_metrics.get(record[TREND_ROW], metric_name)
+
     def get_vaccine_data_by_key(self, record, state, vaccine_key):
         iso_date = utils.ensure_iso_date(record['date'])
         state_abbrev = constants.state_abbrev_map[state]
@@ -312,17 +241,18 @@ class StateTrends(abstract.Resource):
     def get_vaccines_administered_two_dose(self, record, record_key, cache):
         return self.get_vaccine_data_by_key(record, record[record_key], 'Administered_Dose2')
 
-    def get_population(self, *values):
-        record = values[0]
+    def get_state_population(self, record):
         iso_date = utils.ensure_iso_date(record['date'])
-        return self.population_estimates[iso_date][record['state']]
+        return self.population_model.estimate(record['state'], datetime.date.fromisoformat(iso_date[:10]))
+
+    def get_population(self, *values):
+        return self.get_state_population(values[0])
 
     def get_value_per_million(self, record, record_key):
         one_million = 1000000
-        iso_date = utils.ensure_iso_date(record['date'])
-        state_population = self.population_estimates[iso_date][record['state']]
+        state_population = self.get_state_population(record)
         new_value_per_million = 0
-        if record[record_key] is not None and record[record_key] > 0:
+        if state_population is not None and record[record_key] is not None and record[record_key] > 0:
             new_values_per_state_population = state_population / record[record_key]
             new_value_per_million = one_million / new_values_per_state_population
 
@@ -338,20 +268,28 @@ class StateTrends(abstract.Resource):
         return self.get_value_per_million(record, record_key)
 
     def fetch(self):
+        state_trend_urls = [STATE_TREND_URL.format(state) for state in constants.state_abbrev_list]
+        fetcher = http.ConcurrentFetcher(int(os.getenv('CDC_FETCH_WORKERS') or http.DEFAULT_WORKERS))
+        state_trend_downloads = fetcher.download_all(state_trend_urls, headers=HEADERS)
+        vaccines_download = http.cached_download(VACCINE_TREND_URL)
+        self.downloads = state_trend_downloads + [vaccines_download]
+        if not any([download.changed for download in self.downloads]):
+            utils.log('No changes to the state trends or {} since they were last loaded, skipping'.format(
+                VACCINE_TREND_URL
+            ))
+            return
+
         self.raw_data = []
-        for state in constants.state_abbrev_list:
-            request = requests.request('GET', STATE_TREND_URL.format(state), headers=HEADERS)
-            response_content = json.loads(request.content.decode('utf-8'))
+        for download in state_trend_downloads:
+            with open(download.path, encoding='utf-8') as response_file:
+                response_content = json.load(response_file)
             self.raw_data.extend(response_content['us_trend_by_Geography'])
 
-        census_population_estimates = census.PopulationEstimates()
-        census_population_estimates.fetch()
-        if census_population_estimates.has_data():
-            self.population_estimates = census_population_estimates.get_data()
+        self.trend_metrics = compute_trend_metrics(self.raw_data)
+
+        self.population_model = census.get_population_model()
 
-        request = requests.request('GET', VACCINE_TREND_URL)
-        request_content = request.content.decode('utf-8')
-        vaccines_raw_data = csv.DictReader(io.StringIO(request_content))
+        vaccines_raw_data = stream.file_csv_stream(vaccines_download.path)
         self.vaccines_state_trend = {}
         for vaccine_data in vaccines_raw_data:
             iso_date = utils.ensure_iso_date(vaccine_data['Date'])
@@ -1,76 +1,99 @@
-from common import constants, utils
-from data import database
+from common import constants, http, shapefile, stream, utils
+from data import database, metadata
+from resource import fields
 
-import requests
+import threading
 import datetime
-import types
+import shutil
+import bisect
 import math
-import csv
 import re
-import io
+import os
 
 URL = 'https://www2.census.gov/geo/docs/reference/county_adjacency.txt'
 
 state_county_pattern = re.compile('\\w.*, \\w{2}')
 
 
-def get_county_data(record):
-    parsed_data = record.strip("\t").split("\t")
-    matched_data = False
-    county_index = 0
-    while county_index < len(parsed_data) and not matched_data:
-        if state_county_pattern.match(parsed_data[county_index].strip("\"")) is not None:
-            matched_data = True
-        else:
-            county_index += 1
-    county_data = parsed_data[county_index].split(",")[0].strip("\"") if matched_data else None
-    return county_data if matched_data else None
+def parse_county_name(value):
+    # "Autauga County, AL" -> ('Autauga County', 'Alabama')
+    if state_county_pattern.match(value) is None:
+        return None
 
+    name_parts = value.split(',')
+    return name_parts[0], constants.state_abbrev_map[name_parts[1].strip()]
 
-def get_state_data(record):
-    parsed_data = record.strip("\t").split("\t")
-    matched_data = False
-    state_index = 0
-    while state_index < len(parsed_data) and not matched_data:
-        if state_county_pattern.match(parsed_data[state_index].strip("\"")) is not None:
-            matched_data = True
-        else:
-            state_index += 1
 
-    state_data = parsed_data[state_index].split(",")[1].strip("\"") if matched_data else None
-    return constants.state_abbrev_map[state_data.strip()] if matched_data else None
+# Reads the adjacency file in one pass. Each line is split once into county, geo id, neighbour and neighbour geo id;
+# continuation lines leave the first two empty and belong to the last county seen.
+class AdjacencyParser:
 
-
-def create_county_state_key(county, state):
-    return '{}_{}'.format(county, state)
-
-
-def get_geo_id_data(record):
-    parsed_data = record.strip("\t").split("\t")
-    matched_data = False
-    geo_index = 0
-    while geo_index < len(parsed_data) and matched_data is False:
-        if parsed_data[geo_index].strip("\"").isdigit():
-            matched_data = True
-        else:
-            geo_index += 1
-
-    return parsed_data[geo_index].strip("\"") if matched_data else None
+    def __init__(self):
+        self.counties = {}
+        self.neighbours = {}
+        self.county_state_keys = set()
+
+    def add_county(self, name, geo_id):
+        county_state = parse_county_name(name)
+        if county_state is None or county_state in self.county_state_keys:
+            return None
+
+        self.county_state_keys.add(county_state)
+        if len(geo_id) == 0:
+            return county_state[0], county_state[1], None
+
+        self.counties[geo_id] = county_state
+        return county_state[0], county_state[1], geo_id
+
+    def parse(self, lines):
+        # Yields (county, state, geo_id) the first time each county appears
+        current_geo_id = None
+        for line in lines:
+            tokens = [token.strip('"') for token in line.rstrip('\r\n').split('\t')]
+            if len(tokens) < 4:
+                continue
+
+            county_name, geo_id, neighbour_name, neighbour_geo_id = tokens[:4]
+            if len(geo_id) > 0:
+                current_geo_id = geo_id
+                self.neighbours[current_geo_id] = set()
+                row = self.add_county(county_name, geo_id)
+                if row is not None:
+                    yield row
+
+            row = self.add_county(neighbour_name, neighbour_geo_id)
+            if row is not None:
+                yield row
+
+            # Every county is listed as its own neighbour
+            if current_geo_id is not None and len(neighbour_geo_id) > 0 and neighbour_geo_id != current_geo_id:
+                self.neighbours[current_geo_id].add(neighbour_geo_id)
+
+    def get_neighbours(self, geo_id):
+        return sorted(self.neighbours.get(geo_id, []))
 
 
 class CountyGeoCodes:
 
     def __init__(self):
         self.table_name = 'county_location_data'
+        self.natural_key = ('county', 'state')
+        self.download = None
         self.raw_data = None
         self.fields = [
-            {'column': 'county', 'data': get_county_data},
-            {'column': 'geo_id', 'data': get_geo_id_data},
-            {'column': 'state', 'data': get_state_data}
+            {'column': 'county'},
+            {'column': 'state'},
+            {'column': 'geo_id'}
         ]
 
     def fetch(self):
-        self.raw_data = requests.request('GET', URL).content.decode('cp437')
+        self.download = http.cached_download(URL)
+        if not self.download.changed:
+            utils.log('No changes to {} since it was last loaded, skipping'.format(URL))
+            return
+
+        with open(self.download.path, encoding='cp437', newline='') as adjacency_file:
+            self.raw_data = adjacency_file.read()
 
     def has_data(self):
         return self.raw_data is not None
@@ -80,53 +103,41 @@ class CountyGeoCodes:
         mysql_database.connect()
 
         if mysql_database.is_connected():
-            records = self.raw_data.split("\n")
-            record_count = len(records)
+            # Counties repeat throughout the adjacency file; rows already in the table are handled by the upsert
+            counties = AdjacencyParser().parse(self.raw_data.split("\n"))
+            columns = utils.array_map_by_key(self.fields, 'column')
             records_processed = 0
-            record_cache = set()
 
-            county_data = mysql_database.select(self.table_name, utils.array_map_by_key(self.fields, 'column'))
-            for county in county_data:
-                # 0 = county; 2 = state;
-                county_state_key = create_county_state_key(county[0], county[2])
-                record_cache.add(county_state_key)
+            # Without a unique index to upsert on, counties already saved are skipped the way they always were
+            if not mysql_database.declare_natural_key(self.table_name, self.natural_key):
+                saved_counties = set([(county['county'], county['state']) for county in self.get_saved_data()])
+                counties = (county for county in counties if (county[0], county[1]) not in saved_counties)
 
             mysql_database.start_transaction()
 
-            for record in records:
-                columns = []
-                values = []
+            for batch in utils.batched(counties, fields.DEFAULT_BATCH_SIZE):
+                mysql_database.insert_many(self.table_name, columns, batch)
 
-                for field in self.fields:
-
-                    if field.__contains__('column'):
-                        columns.append(field['column'])
-
-                    # Populating the values array
-                    if field.__contains__('data'):
-                        if isinstance(field['data'], types.FunctionType):
-                            values.append(field['data'].__call__(record))
-
-                county_state_key = create_county_state_key(get_county_data(record), get_state_data(record))
-                if len(record) > 0 and not record_cache.__contains__(county_state_key):
-                    mysql_database.insert(self.table_name, columns, values)
-                    record_cache.add(county_state_key)
-
-                records_processed += 1
-                utils.progress(records_processed, record_count)
+                records_processed += len(batch)
+                utils.progress(records_processed)
 
             mysql_database.commit()
+            self.download.acknowledge()
 
-    def get_saved_data(self):
+    def get_saved_data(self, include_id=False):
         saved_data = []
-        mysql_database = database.Database()
-        mysql_database.connect()
-        if mysql_database.is_connected():
-            county_location_data = mysql_database.select(self.table_name, utils.array_map_by_key(self.fields, 'column'))
+        saved_fields = self.fields + [{'column': 'id'}] if include_id else self.fields
+        with database.Database() as mysql_database:
+            county_location_data = []
+            if mysql_database.is_connected():
+                county_location_data = mysql_database.select(
+                    self.table_name, utils.array_map_by_key(saved_fields, 'column')
+                )
+
             for data in county_location_data:
                 index = 0
                 row_data = {}
-                for field in self.fields:
+                for field in saved_fields:
                     row_data[field['column']] = data[index]
                     index += 1
 
@@ -135,6 +146,70 @@ class CountyGeoCodes:
         return saved_data
 
 
+def normalize_county_name(value):
+    # Geocoders and the census spell some counties differently: "City and County of Denver", "Saint Clair County"
+    value = ' '.join(value.replace('City and County of ', '').split())
+    value = re.sub('^Saint ', 'St. ', value)
+    return value.casefold()
+
+
+# Saved county_location_data rows looked up by (county, state) without a query per record. Names are tried as
+# given, then normalized, then as a prefix of a single county, which is what "county like 'name%'" matched.
+class CountyIndex:
+
+    def __init__(self, locations):
+        self.exact = {}
+        self.normalized = {}
+        # Per state, normalized names in sorted order alongside their locations for prefix searches
+        self.state_names = {}
+        self.state_locations = {}
+        entries = {}
+        for location in locations:
+            if location['county'] is None or location['state'] is None:
+                continue
+
+            normalized_key = (normalize_county_name(location['county']), location['state'])
+            self.exact[(location['county'], location['state'])] = location
+            self.normalized[normalized_key] = location
+            entries.setdefault(location['state'], []).append((normalized_key[0], location))
+
+        for state, state_entries in entries.items():
+            state_entries.sort(key=lambda entry: entry[0])
+            self.state_names[state] = [name for name, _ in state_entries]
+            self.state_locations[state] = [location for _, location in state_entries]
+
+    def __len__(self):
+        return len(self.exact)
+
+    def get(self, county, state):
+        location = self.exact.get((county, state))
+        if location is None:
+            location = self.normalized.get((normalize_county_name(county), state))
+
+        return location
+
+    def find_prefix(self, county, state):
+        # Only an unambiguous prefix resolves to a county
+        names = self.state_names.get(state, [])
+        prefix = normalize_county_name(county)
+        position = bisect.bisect_left(names, prefix)
+        if position < len(names) and names[position].startswith(prefix) and \
+                (position + 1 == len(names) or not names[position + 1].startswith(prefix)):
+            return self.state_locations[state][position]
+
+        return None
+
+    def find(self, county, state):
+        location = self.get(county, state)
+        return location if location is not None else self.find_prefix(county, state)
+
+
+def load_county_index():
+    county_index = CountyIndex(CountyGeoCodes().get_saved_data(include_id=True))
+    utils.log('Indexed {} saved counties'.format(len(county_index)))
+    return county_index
+
+
 class GeoLocations:
 
     def __init__(self):
@@ -151,14 +226,13 @@ class GeoLocations:
         ]
 
     def fetch(self):
-        mysql_database = database.Database()
-        mysql_database.connect()
-        if mysql_database.is_connected():
-            self.raw_data = mysql_database.select(
-                self.table_name,
-                utils.array_map_by_key(self.fields, 'column'),
-                where='ccd.county_location_data_id = cld.id'
-            )
+        with database.Database() as mysql_database:
+            if mysql_database.is_connected():
+                self.raw_data = mysql_database.select(
+                    self.table_name,
+                    utils.array_map_by_key(self.fields, 'column'),
+                    where='ccd.county_location_data_id = cld.id'
+                )
 
     def has_data(self):
         return self.raw_data is not None
@@ -177,148 +251,253 @@ class GeoLocations:
         return constructed_data
 
 
+COUNTY_BOUNDARY_URL = 'https://www2.census.gov/geo/tiger/GENZ2021/shp/cb_2021_us_county_500k.zip'
+BOUNDARY_GRID_CELL_SIZE = 0.5
+
+
+def get_boundary_cell(latitude, longitude):
+    return math.floor(latitude / BOUNDARY_GRID_CELL_SIZE), math.floor(longitude / BOUNDARY_GRID_CELL_SIZE)
+
+
+def get_boundary_state(record):
+    state_abbrev = record['STUSPS'] if 'STUSPS' in record else constants.state_fips_map.get(record['STATEFP'])
+    return constants.state_abbrev_map[state_abbrev] if state_abbrev in constants.state_abbrev_map else None
+
+
+# Resolves coordinates to a county offline from a Census cartographic boundary shapefile (zip).
+# Counties are registered in every grid cell their bounding box overlaps; a lookup only runs the
+# point-in-polygon test for the counties of one cell whose bounding box contains the point.
+class CountyBoundaries:
+
+    def __init__(self, path=None):
+        self.path = path if path is not None else \
+            os.getenv('COUNTY_BOUNDARY_FILE') or '/'.join([constants.temp_dir, 'cb_2021_us_county_500k.zip'])
+        self.raw_data = None
+        self.cells = {}
+        self.counties_by_geo_id = {}
+
+    def fetch(self):
+        if not os.path.isfile(self.path):
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # The download cache may be on another filesystem, where os.replace fails
+            shutil.move(http.download(COUNTY_BOUNDARY_URL), self.path)
+
+        self.raw_data = shapefile.read_zip(self.path)
+        for polygon, record in self.raw_data:
+            county = {'county': record['NAMELSAD'], 'state': get_boundary_state(record), 'geo_id': record['GEOID']}
+            self.counties_by_geo_id[county['geo_id']] = county
+            if polygon is None:
+                continue
+
+            min_longitude, min_latitude, max_longitude, max_latitude = polygon['bbox']
+            min_cell = get_boundary_cell(min_latitude, min_longitude)
+            max_cell = get_boundary_cell(max_latitude, max_longitude)
+            for cell_latitude in range(min_cell[0], max_cell[0] + 1):
+                for cell_longitude in range(min_cell[1], max_cell[1] + 1):
+                    cell = (cell_latitude, cell_longitude)
+                    if cell not in self.cells:
+                        self.cells[cell] = []
+
+                    self.cells[cell].append((polygon, county))
+
+    def has_data(self):
+        return self.raw_data is not None
+
+    def resolve(self, latitude, longitude):
+        try:
+            latitude, longitude = float(latitude), float(longitude)
+        except (ValueError, TypeError):
+            return None
+
+        for polygon, county in self.cells.get(get_boundary_cell(latitude, longitude), []):
+            min_longitude, min_latitude, max_longitude, max_latitude = polygon['bbox']
+            if min_longitude <= longitude <= max_longitude and min_latitude <= latitude <= max_latitude and \
+                    shapefile.point_in_rings(polygon['rings'], longitude, latitude):
+                return county
+
+        return None
+
+    def get_by_geo_id(self, geo_id):
+        return self.counties_by_geo_id.get(geo_id)
+
+
+county_boundaries = None
+county_boundaries_lock = threading.Lock()
+
+
+# Loaded once per process and shared by every module; resolves nothing if the boundary file is unavailable
+def get_county_boundaries():
+    global county_boundaries
+    with county_boundaries_lock:
+        if county_boundaries is None:
+            boundaries = CountyBoundaries()
+            try:
+                boundaries.fetch()
+            except Exception as error:
+                utils.log('County boundaries are unavailable, falling back to remote geocoding: {}'.format(error))
+
+            county_boundaries = boundaries
+
+    return county_boundaries
+
+
 EST2019 = 'https://www2.census.gov/programs-surveys/popest/datasets/2010-2019/state/detail/SCPRC-EST2019-18+POP-RES.csv'
 EST2020_2021 = 'https://www2.census.gov/programs-surveys/popest/datasets/2020-2021/state/totals/NST-EST2021-alldata.csv'
+POPULATION_URLS = [EST2019, EST2020_2021]
 
 
-class Population:
+POPULATION_START_DATE = datetime.date(2020, 1, 1)
+
+
+# Linear interpolation between yearly census estimates, evaluated in closed form instead of day by day.
+# Years past the latest published estimate carry that estimate forward.
+class PopulationModel:
 
     def __init__(self):
-        self.table_name = 'population'
-        self.raw_data = None
-        self.fields = [
-            {'field': 'date'},
-            {'field': 'state'},
-            {'field': 'estimate'}
-        ]
+        self.estimates = None
+        self.last_year = None
 
-    def fetch(self):
-        population_estimates_map = {'2019': {}, '2020': {}, '2021': {}, '2022': {}}
+    def fetch(self, downloads=None):
+        # downloads are the POPULATION_URLS payloads when the caller has already revalidated them
+        if downloads is None:
+            downloads = [http.cached_download(url) for url in POPULATION_URLS]
 
-        request = requests.request('GET', EST2019)
-        population_estimates_2019_raw_data = list(csv.DictReader(io.StringIO(request.content.decode('utf-8'))))
+        est2019_download, est2020_2021_download = downloads
+        self.estimates = {}
 
-        for estimate in population_estimates_2019_raw_data:
+        for estimate in stream.file_csv_stream(est2019_download.path):
             if estimate['NAME'] in constants.state_abbrev_map:
-                population_estimates_map['2019'][estimate['NAME']] = int(estimate['POPESTIMATE2019'])
+                self.set_estimate(2019, estimate['NAME'], estimate['POPESTIMATE2019'])
             elif estimate['NAME'] == 'Puerto Rico Commonwealth':
-                population_estimates_map['2019']['Puerto Rico'] = int(estimate['POPESTIMATE2019'])
-
-        request = requests.request('GET', EST2020_2021)
-        population_estimates_2020_2021_raw_data = list(csv.DictReader(io.StringIO(request.content.decode('utf-8'))))
+                self.set_estimate(2019, 'Puerto Rico', estimate['POPESTIMATE2019'])
 
-        for estimate in population_estimates_2020_2021_raw_data:
+        for estimate in stream.file_csv_stream(est2020_2021_download.path):
             if estimate['NAME'] in constants.state_abbrev_map:
-                population_estimates_map['2020'][estimate['NAME']] = int(estimate['POPESTIMATE2020'])
-                population_estimates_map['2021'][estimate['NAME']] = int(estimate['POPESTIMATE2021'])
-                # No estimates currently for 2022 so using the population data from 2021
-                population_estimates_map['2022'][estimate['NAME']] = int(estimate['POPESTIMATE2021'])
-
-        self.raw_data = []
-        today = datetime.datetime.today()
-        end_of_this_year = datetime.datetime(today.year, 12, 31)
-        for state in constants.state_list:
-            date = datetime.datetime(2020, 1, 1)
-            population_increment = 0.0
-            population_estimate = 0
-            current_year = None
-
-            while date < end_of_this_year:
-                if state not in population_estimates_map[str(date.year)]:
-                    break
-
-                if current_year is None or current_year < date.year:
-                    current_year_timedelta = datetime.datetime(date.year, 1, 1) - datetime.datetime(date.year - 1, 1, 1)
-                    days_in_current_year = current_year_timedelta.days
-                    estimates_for_previous_year = population_estimates_map[str(date.year - 1)][state]
-                    estimates_for_current_year = population_estimates_map[str(date.year)][state]
-                    population_difference = estimates_for_current_year - estimates_for_previous_year
-                    population_increment = population_difference / days_in_current_year
-                    population_estimate = estimates_for_previous_year
-                    current_year = date.year
-
-                self.raw_data.append({
-                    'date': date.isoformat(),
-                    'state': state,
-                    'estimate': math.floor(population_estimate)
-                })
-
-                population_estimate += population_increment
-                date += datetime.timedelta(days=1)
+                self.set_estimate(2020, estimate['NAME'], estimate['POPESTIMATE2020'])
+                self.set_estimate(2021, estimate['NAME'], estimate['POPESTIMATE2021'])
+
+        self.last_year = max(self.estimates.keys())
+
+    def set_estimate(self, year, state, estimate):
+        if year not in self.estimates:
+            self.estimates[year] = {}
+
+        self.estimates[year][state] = int(estimate)
 
     def has_data(self):
-        return self.raw_data is not None
+        return self.estimates is not None
 
-    def save(self):
-        mysql_database = database.Database()
-        mysql_database.connect()
+    def get_year_estimate(self, year, state):
+        # Years before the first estimate have no line and resolve to None
+        return self.estimates.get(min(year, self.last_year), {}).get(state)
 
-        if mysql_database.is_connected():
-            mysql_database.start_transaction()
+    def get_year_line(self, year, state):
+        # Population on January 1st of `year` and the per-day increment through that year
+        previous_estimate = self.get_year_estimate(year - 1, state)
+        current_estimate = self.get_year_estimate(year, state)
+        if previous_estimate is None or current_estimate is None:
+            return None
 
-            records = self.raw_data
-            record_count = len(records)
-            records_processed = 0
+        days_in_previous_year = (datetime.date(year, 1, 1) - datetime.date(year - 1, 1, 1)).days
+        return previous_estimate, (current_estimate - previous_estimate) / days_in_previous_year
 
-            for record in records:
-                columns = []
-                values = []
-                for field in self.fields:
-                    if 'column' in field:
-                        columns.append(field['column'])
-                    elif 'field' in field:
-                        columns.append(field['field'])
+    def estimate(self, state, date):
+        line = self.get_year_line(date.year, state)
+        if line is None:
+            return None
 
-                    # Populating the values array
-                    if 'field' in field:
-                        values.append(record[field['field']])
+        base, increment = line
+        return math.floor(base + increment * (date - datetime.date(date.year, 1, 1)).days)
 
-                mysql_database.insert(self.table_name, columns, values)
+    def rows(self, states, start_date, end_date):
+        # (date, state, estimate) for every day in [start_date, end_date), one state at a time
+        for state in states:
+            for year in range(start_date.year, end_date.year + 1):
+                line = self.get_year_line(year, state)
+                if line is None:
+                    continue
 
-                records_processed += 1
-                utils.progress(records_processed, record_count)
+                base, increment = line
+                first_day = datetime.date(year, 1, 1)
+                first_offset = (max(start_date, first_day) - first_day).days
+                last_offset = (min(end_date, datetime.date(year + 1, 1, 1)) - first_day).days
+                first_ordinal = first_day.toordinal()
+                for offset in range(first_offset, last_offset):
+                    iso_date = datetime.date.fromordinal(first_ordinal + offset).isoformat() + 'T00:00:00'
+                    yield iso_date, state, math.floor(base + increment * offset)
 
-            mysql_database.commit()
 
+population_model = None
+population_model_lock = threading.Lock()
+
+
+def get_population_model(downloads=None):
+    global population_model
+    with population_model_lock:
+        if population_model is None:
+            model = PopulationModel()
+            model.fetch(downloads)
+            population_model = model
+
+    return population_model
 
-class PopulationEstimates:
+
+class Population:
 
     def __init__(self):
-        self.raw_data = None
         self.table_name = 'population'
+        self.natural_key = ('date', 'state')
+        self.watermark = metadata.Watermark(self.table_name)
+        self.downloads = []
+        self.raw_data = None
         self.fields = [
-            {'column': 'date', 'columnIndex': 0},
-            {'column': 'state', 'columnIndex': 1},
-            {'field': 'population', 'column': 'estimate', 'columnIndex': 2}
+            {'field': 'date'},
+            {'field': 'state'},
+            {'field': 'estimate'}
         ]
 
     def fetch(self):
-        mysql_database = database.Database()
-        mysql_database.connect()
-        if mysql_database.is_connected():
-            self.raw_data = mysql_database.select(
-                self.table_name,
-                utils.array_map_by_key(self.fields, 'column')
-            )
+        self.downloads = [http.cached_download(url) for url in POPULATION_URLS]
+        if not any([download.changed for download in self.downloads]):
+            utils.log('No changes to {} since they were last loaded, skipping'.format(' or '.join(POPULATION_URLS)))
+            return
+
+        self.raw_data = get_population_model(self.downloads)
+        self.watermark.load()
 
     def has_data(self):
         return self.raw_data is not None
 
-    def get_data(self):
-        constructed_data = []
-        for data in self.raw_data:
-            data_object = {}
-            for field in self.fields:
-                data_object[field['field'] if 'field' in field else field['column']] = data[field['columnIndex']]
+    def get_start_date(self):
+        if self.watermark.value is None:
+            return POPULATION_START_DATE
 
-            constructed_data.append(data_object)
+        watermark_date = datetime.date.fromisoformat(str(self.watermark.value)[:10])
+        return max(POPULATION_START_DATE, watermark_date + datetime.timedelta(days=1))
 
-        data_map = {}
-        for data in constructed_data:
-            iso_date = data['date'].isoformat() + 'T00:00:00'
-            if iso_date not in data_map:
-                data_map[iso_date] = {}
+    def save(self):
+        mysql_database = database.Database()
+        mysql_database.connect()
 
-            data_map[iso_date][data['state']] = data['population']
+        if mysql_database.is_connected():
+            mysql_database.declare_natural_key(self.table_name, self.natural_key)
+            mysql_database.start_transaction()
+
+            start_date = self.get_start_date()
+            end_date = datetime.date(datetime.date.today().year, 12, 31)
+            columns = utils.array_map_by_key(self.fields, 'field')
+            records_processed = 0
 
-        return data_map
+            rows = self.raw_data.rows(constants.state_list, start_date, end_date)
+            for batch in utils.batched(rows, fields.DEFAULT_BATCH_SIZE):
+                mysql_database.insert_many(self.table_name, columns, batch)
+
+                records_processed += len(batch)
+                utils.progress(records_processed)
+
+            mysql_database.commit()
+            for download in self.downloads:
+                download.acknowledge()
+            if records_processed > 0:
+                self.watermark.is_new((end_date - datetime.timedelta(days=1)).isoformat() + 'T00:00:00')
+            self.watermark.store()
@@ -1,11 +1,6 @@
-from common import constants, utils
-from data import database
-from resource import census
-
-import requests
-import types
-import csv
-import io
+from common import coerce, constants, http, stream, utils
+from data import database, metadata
+from resource import census, fields
 
 URL = 'https://eviction-lab-data-downloads.s3.amazonaws.com/ets/all_sites_weekly_2020_2021.csv'
 
@@ -19,11 +14,18 @@ def get_state(city_state):
     return constants.state_abbrev_map[state_abbrev] if state_abbrev is not None else state_abbrev
 
 
+def get_week_date(record):
+    return utils.ensure_iso_date(record['week_date'])
+
+
 class WeeklyEvictions:
 
     def __init__(self):
         self.table_name = 'weekly_evictions'
+        self.natural_key = ('geo_id', 'date')
+        self.watermark = metadata.Watermark(self.table_name)
         self.geo_locations = {}
+        self.download = None
         self.raw_data = None
         self.fields = [
             {'field': 'week_date', 'column': 'date', 'data': utils.ensure_iso_date},
@@ -32,16 +34,19 @@ class WeeklyEvictions:
             {'field': 'GEOID', 'column': 'county', 'data': self.get_county},
             {'field': 'city', 'column': 'state', 'data': get_state},
             {'field': 'racial_majority'},
-            {'field': 'filings_2020', 'column': 'filings', 'data': utils.ensure_int},
-            {'field': 'filings_avg', 'data': utils.ensure_float},
+            {'field': 'filings_2020', 'column': 'filings', 'type': coerce.INT},
+            {'field': 'filings_avg', 'type': coerce.FLOAT},
             {'field': 'last_updated', 'data': utils.ensure_iso_date},
             {'field': 'GEOID', 'column': 'geo_id'}
         ]
 
     def fetch(self):
-        request = requests.request('GET', URL)
-        request_content = request.content.decode('utf-8')
-        self.raw_data = csv.DictReader(io.StringIO(request_content))
+        self.download = http.cached_download(URL)
+        if not self.download.changed:
+            utils.log('No changes to {} since it was last loaded, skipping'.format(URL))
+            return
+
+        self.raw_data = stream.file_csv_stream(self.download.path)
 
         county_geo_codes = census.CountyGeoCodes()
         geo_code_locations = county_geo_codes.get_saved_data()
@@ -62,51 +67,39 @@ class WeeklyEvictions:
     def get_county(self, record):
         city_state_key = '{}_{}'.format(get_city(record['city']), get_state(record['city']))
         geo_code = record['GEOID'][0:5]
-        county = 'N/A'
         if geo_code.isdigit() and self.geo_locations.__contains__(geo_code):
-            county = self.geo_locations[geo_code]['county']
+            return self.geo_locations[geo_code]['county']
+
+        # Boundaries are only loaded once a geo id is missing from the saved locations
+        boundary_county = census.get_county_boundaries().get_by_geo_id(geo_code)
+        if boundary_county is not None:
+            return boundary_county['county']
         elif self.geo_locations.__contains__(city_state_key):
-            county = self.geo_locations[city_state_key]['county']
+            return self.geo_locations[city_state_key]['county']
 
-        return county
+        return 'N/A'
 
     def save(self):
         mysql_database = database.Database()
         mysql_database.connect()
 
         if mysql_database.is_connected():
+            mysql_database.declare_natural_key(self.table_name, self.natural_key)
             mysql_database.start_transaction()
 
-            records = list(self.raw_data)
-            record_count = len(records)
-            progress_threshold = record_count // 100
+            self.watermark.load()
+            records = self.watermark.filter(self.raw_data, get_week_date)
+            record_count = None
             records_processed = 0
 
-            for record in records:
-                columns = []
-                values = []
-
-                for field in self.fields:
-                    if field.__contains__('column'):
-                        columns.append(field['column'])
-                    elif field.__contains__('field'):
-                        columns.append(field['field'])
-
-                    # Populating the values array
-                    if field.__contains__('data'):
-                        if isinstance(field['data'], types.FunctionType):
-                            values.append(field['data'].__call__(record[field['field']]))
-                        elif isinstance(field['data'], types.MethodType):
-                            values.append(field['data'].__call__(record))
-                        elif isinstance(field['data'], str):
-                            values.append(field['data'])
-
-                    elif field.__contains__('field'):
-                        values.append(record[field['field']])
+            compiled_fields = fields.compile_fields(self.fields, fields.VALUE_CONVENTION)
 
-                mysql_database.insert(self.table_name, columns, values)
+            for batch in utils.batched(records, fields.DEFAULT_BATCH_SIZE):
+                mysql_database.insert_many(self.table_name, compiled_fields.columns, compiled_fields.rows(batch))
 
-                records_processed += 1
+                records_processed += len(batch)
                 utils.progress(records_processed, record_count)
 
             mysql_database.commit()
+            self.watermark.store()
+            self.download.acknowledge()
@@ -0,0 +1,99 @@
+from common import coerce, instrumentation
+
+import types
+
+DEFAULT_BATCH_SIZE = 1000
+
+# How a field's 'data' callable is invoked:
+#   resource - data(record, field, record_cache), used by abstract.Resource
+#   value    - functions get record[field], bound methods get the whole record
+#   record   - data(record)
+RESOURCE_CONVENTION = 'resource'
+VALUE_CONVENTION = 'value'
+RECORD_CONVENTION = 'record'
+# A field's optional 'type' (see common.coerce) converts whatever the field extracts, a whole batch column at a time
+
+
+def get_column(field):
+    return field['column'] if 'column' in field else field['field']
+
+
+def constant_extractor(value):
+    return lambda record, record_cache: value
+
+
+def field_extractor(field):
+    key = field['field']
+    if callable(key):
+        return lambda record, record_cache: key(record)
+
+    return lambda record, record_cache: record[key]
+
+
+def data_extractor(field, convention):
+    data = field['data']
+    key = field.get('field')
+    if isinstance(data, str):
+        return constant_extractor(data)
+
+    assert callable(data), 'data for column {} must be a string or a callable'.format(get_column(field))
+    if convention == RESOURCE_CONVENTION:
+        return lambda record, record_cache: data(record, key, record_cache)
+    elif convention == VALUE_CONVENTION and not isinstance(data, types.MethodType):
+        return lambda record, record_cache: data(record[key])
+
+    return lambda record, record_cache: data(record)
+
+
+class CompiledFields:
+
+    def __init__(self, columns, extractors, column_types=None):
+        self.columns = columns
+        self.extractors = extractors
+        # (position, type) of every typed column
+        self.column_types = column_types or []
+
+    def row(self, record, record_cache=None):
+        row = [extract(record, record_cache) for extract in self.extractors]
+        for position, column_type in self.column_types:
+            row[position] = coerce.coerce_value(row[position], column_type)
+
+        return tuple(row)
+
+    def rows(self, records, record_cache=None):
+        extractors = self.extractors
+        with instrumentation.phase('transform'):
+            rows = [tuple([extract(record, record_cache) for extract in extractors]) for record in records]
+            if len(self.column_types) == 0 or len(rows) == 0:
+                return rows
+
+            columns = list(zip(*rows))
+            for position, column_type in self.column_types:
+                columns[position] = coerce.coerce_column(columns[position], column_type)
+
+            return list(zip(*columns))
+
+
+def compile_fields(fields, convention=RESOURCE_CONVENTION, available_fields=None):
+    columns = []
+    extractors = []
+    column_types = []
+    for field in fields:
+        key = field.get('field')
+        if available_fields is not None and isinstance(key, str) and key not in available_fields:
+            if 'default' not in field:
+                continue
+
+            extractors.append(constant_extractor(field['default']))
+        elif 'data' in field:
+            extractors.append(data_extractor(field, convention))
+        else:
+            extractors.append(field_extractor(field))
+
+        if 'type' in field:
+            coerce.get_column_type(field['type'])
+            column_types.append((len(columns), field['type']))
+
+        columns.append(get_column(field))
+
+    return CompiledFields(tuple(columns), extractors, column_types)
@@ -1,11 +1,9 @@
-from common import utils
-from data import database
+from common import coerce, http, parallel, stream, utils
+from data import database, metadata
+from resource import fields
 
-import requests
+import functools
 import zipfile
-import types
-import csv
-import io
 
 URL = 'https://www.gstatic.com/covid19/mobility/Region_Mobility_Report_CSVs.zip'
 FILENAME_SET = {
@@ -16,61 +14,80 @@ FILENAME_SET = {
 }
 
 
-def ensure_int_or_none(value):
-    try:
-        int(value)
-    except ValueError:
-        value = None
-    except TypeError:
-        value = None
-    return value
+def get_date(record):
+    return utils.ensure_iso_date(record['date'])
+
+
+def has_sub_regions(record):
+    return len(record['sub_region_1']) > 0 and len(record['sub_region_2']) > 0
+
+
+FIELDS = [
+    {'field': 'sub_region_1', 'column': 'state'},
+    {'field': 'sub_region_2', 'column': 'county'},
+    {'field': 'date', 'data': utils.ensure_iso_date},
+    {
+        'field': 'retail_and_recreation_percent_change_from_baseline',
+        'column': 'retail_and_recreation_change',
+        'type': coerce.NULLABLE_INT
+    },
+    {
+        'field': 'grocery_and_pharmacy_percent_change_from_baseline',
+        'column': 'grocery_and_pharmacy_change',
+        'type': coerce.NULLABLE_INT
+    },
+    {'field': 'parks_percent_change_from_baseline', 'column': 'parks_change', 'type': coerce.NULLABLE_INT},
+    {
+        'field': 'transit_stations_percent_change_from_baseline',
+        'column': 'transit_stations_change',
+        'type': coerce.NULLABLE_INT
+    },
+    {
+        'field': 'workplaces_percent_change_from_baseline',
+        'column': 'workplaces_change',
+        'type': coerce.NULLABLE_INT
+    },
+    {
+        'field': 'residential_percent_change_from_baseline',
+        'column': 'residential_change',
+        'type': coerce.NULLABLE_INT
+    }
+]
+
+
+def parse_member_batches(member, zip_path, watermark_value=None):
+    # Runs in a worker process: only county rows newer than the watermark leave it, as row tuples
+    compiled_fields = fields.compile_fields(FIELDS, fields.VALUE_CONVENTION)
+    records = stream.zip_member_csv_stream(zip_path, member)
+    for batch in utils.batched(records, fields.DEFAULT_BATCH_SIZE):
+        rows = [
+            compiled_fields.row(record) for record in batch
+            if has_sub_regions(record) and (watermark_value is None or get_date(record) > watermark_value)
+        ]
+        if len(rows) > 0:
+            yield rows
 
 
 class MobilityReport:
 
     def __init__(self):
         self.table_name = 'google_mobility'
+        self.natural_key = ('state', 'county', 'date')
+        self.watermark = metadata.Watermark(self.table_name)
+        self.download = None
+        self.zip_path = None
         self.raw_data = None
-        self.fields = [
-            {'field': 'sub_region_1', 'column': 'state'},
-            {'field': 'sub_region_2', 'column': 'county'},
-            {'field': 'date', 'data': utils.ensure_iso_date},
-            {
-                'field': 'retail_and_recreation_percent_change_from_baseline',
-                'column': 'retail_and_recreation_change',
-                'data': ensure_int_or_none
-            },
-            {
-                'field': 'grocery_and_pharmacy_percent_change_from_baseline',
-                'column': 'grocery_and_pharmacy_change',
-                'data': ensure_int_or_none
-            },
-            {'field': 'parks_percent_change_from_baseline', 'column': 'parks_change', 'data': ensure_int_or_none},
-            {
-                'field': 'transit_stations_percent_change_from_baseline',
-                'column': 'transit_stations_change',
-                'data': ensure_int_or_none
-            },
-            {
-                'field': 'workplaces_percent_change_from_baseline',
-                'column': 'workplaces_change',
-                'data': ensure_int_or_none
-            },
-            {
-                'field': 'residential_percent_change_from_baseline',
-                'column': 'residential_change',
-                'data': ensure_int_or_none
-            }
-        ]
+        self.fields = FIELDS
 
     def fetch(self):
-        self.raw_data = {}
-        request = requests.request('GET', URL)
-        zipfile_object = zipfile.ZipFile(io.BytesIO(request.content), mode='r')
-        for file in zipfile_object.filelist:
-            if file.filename in FILENAME_SET:
-                csv_file_content = zipfile_object.open(file.filename)
-                self.raw_data[file.filename] = csv.DictReader(io.StringIO(csv_file_content.read().decode('utf-8')))
+        self.download = http.cached_download(URL)
+        if not self.download.changed:
+            utils.log('No changes to {} since it was last loaded, skipping'.format(URL))
+            return
+
+        self.zip_path = self.download.path
+        with zipfile.ZipFile(self.zip_path, mode='r') as zipfile_object:
+            self.raw_data = sorted([file.filename for file in zipfile_object.filelist if file.filename in FILENAME_SET])
 
     def has_data(self):
         return self.raw_data is not None
@@ -80,38 +97,25 @@ class MobilityReport:
         mysql_database.connect()
 
         if mysql_database.is_connected():
+            mysql_database.declare_natural_key(self.table_name, self.natural_key)
             mysql_database.start_transaction()
 
-            records = []
-            for filename in FILENAME_SET:
-                records += list(self.raw_data[filename]) if filename in self.raw_data else []
-
-            record_count = len(records)
+            self.watermark.load()
+            parse = functools.partial(
+                parse_member_batches, zip_path=self.zip_path, watermark_value=self.watermark.value
+            )
+            workers = parallel.get_process_workers('GOOGLE_PARSE_WORKERS', len(self.raw_data))
+            columns = fields.compile_fields(self.fields, fields.VALUE_CONVENTION).columns
+            date_index = columns.index('date')
             records_processed = 0
 
-            for record in records:
-                records_processed += 1
-                columns = []
-                values = []
-
-                if len(record['sub_region_1']) > 0 and len(record['sub_region_2']) > 0:
-
-                    for field in self.fields:
-                        if field.__contains__('column'):
-                            columns.append(field['column'])
-                        elif field.__contains__('field'):
-                            columns.append(field['field'])
-
-                        # Populating the values array
-                        if field.__contains__('data'):
-                            if isinstance(field['data'], types.FunctionType):
-                                values.append(field['data'].__call__(record[field['field']]))
-
-                        elif field.__contains__('field'):
-                            values.append(record[field['field']])
-
-                    mysql_database.insert(self.table_name, columns, values)
+            for rows in parallel.process_stream(parse, self.raw_data, workers):
+                mysql_database.insert_many(self.table_name, columns, rows)
+                self.watermark.is_new(max([row[date_index] for row in rows]))
 
-                utils.progress(records_processed, record_count)
+                records_processed += len(rows)
+                utils.progress(records_processed)
 
             mysql_database.commit()
+            self.watermark.store()
+            self.download.acknowledge()
@@ -1,20 +1,43 @@
-from common import utils, constants
-from data import database
-from git.cmd import Git
+from common import coerce, columnar, constants, mirror, parallel, stream, utils
+from data import database, metadata
+from resource import fields
 
-import types
+import functools
 import csv
-import io
 import os
 import re
 
 CASES_BY_RE_REGEX = re.compile('^\\d{8}.*Cases by RE\\.csv$')
 DEATHS_BY_RE_REGEX = re.compile('^\\d{8}.*Deaths by RE\\.csv$')
 VACCINATIONS_BY_RE_REGEX = re.compile('^\\d{8}.*Vaccinations by RE\\.csv$')
-FLOAT_REGEX = re.compile('^\\d{1,3}\\.\\d{1,3}$')
 TIMESTAMP_REGEX = re.compile('^\\d{8}')
 
 GIT_REPO_URL = 'https://github.com/KFFData/COVID-19-Data'
+RACE_NATURAL_KEY = ('date', 'state')
+CASES_AND_DEATHS_FOLDER = 'Race Ethnicity COVID-19 Data/Cases and Deaths'
+VACCINES_FOLDER = 'Race Ethnicity COVID-19 Data/Vaccines'
+
+# Every KFF module reads from the same mirror, which is synced once per run
+repository_mirror = mirror.RepositoryMirror(GIT_REPO_URL, 'COVID-19-Data')
+
+
+def get_changed_files(consumer):
+    # Outside of incremental mode every file is loaded again
+    return repository_mirror.changed_files(consumer) if metadata.incremental_enabled() else None
+
+
+def list_race_files(folder, matches, watermark, changed_files):
+    # The mirror is cloned or updated whether or not the run is incremental
+    repository_mirror.sync()
+    filenames = []
+    for filename in sorted(os.listdir(repository_mirror.get_path(folder))):
+        if not matches(filename) or not watermark.is_new(get_filename_date(filename)):
+            continue
+
+        if changed_files is None or '/'.join([folder, filename]) in changed_files:
+            filenames.append(filename)
+
+    return filenames
 
 
 def skip_record(record):
@@ -25,52 +48,51 @@ class StateTrends:
 
     def __init__(self):
         self.table_name = 'state_trend_data'
+        self.natural_key = ('state', 'date')
         self.raw_data = None
         self.fields = [
             {'field': 'state'},
             {'field': 'date'},
-            {'field': 'cases', 'data': utils.ensure_int},
-            {'field': 'deaths', 'data': utils.ensure_int},
-            {'field': 'tests', 'data': utils.ensure_int},
-            {'field': 'casechange', 'column': 'cases_change', 'data': utils.ensure_int},
-            {'field': 'deathchange', 'column': 'deaths_change', 'data': utils.ensure_int},
-            {'field': 'test_change', 'column': 'tests_change', 'data': utils.ensure_int},
-            {'field': 'case_means', 'column': 'cases_7_day_mean', 'data': utils.ensure_float},
-            {'field': 'death_mean', 'column': 'deaths_7_day_mean', 'data': utils.ensure_float},
-            {'field': 'test_means', 'column': 'tests_7_day_mean', 'data': utils.ensure_float},
-            {'field': 'case_permill', 'column': 'cases_per_million', 'data': utils.ensure_float},
-            {'field': 'death_permill', 'column': 'deaths_per_million', 'data': utils.ensure_float},
-            {'field': 'test_permill', 'column': 'tests_per_million', 'data': utils.ensure_float},
-            {'field': 'pos_rate', 'column': 'positivity_rate_7_day_mean', 'data': utils.ensure_float},
-            {'field': 'rp2', 'column': 'positivity_rate_7_day_plus_mean', 'data': utils.ensure_float},
-            {'field': 'pct_change_weekly_cases_7', 'data': utils.ensure_float},
-            {'field': 'pct_change_weekly_cases_14', 'data': utils.ensure_float},
-            {'field': 'pct_change_weekly_deaths_7', 'data': utils.ensure_float},
-            {'field': 'pct_change_weekly_deaths_14', 'data': utils.ensure_float},
-            {'field': 'pct_change_weekly_tests_7', 'data': utils.ensure_float},
-            {'field': 'pct_change_weekly_tests_14', 'data': utils.ensure_float},
-            {'field': 'pct_change_positivity_rate_7', 'data': utils.ensure_float},
-            {'field': 'pct_change_positivity_rate_14', 'data': utils.ensure_float},
-
-            {'field': 'pop', 'column': 'population', 'data': utils.ensure_int},
-            {'field': 'distributed', 'column': 'vaccines_distributed', 'data': utils.ensure_int},
-            {'field': 'administered', 'column': 'vaccines_administered', 'data': utils.ensure_int},
-            {'field': 'one_dose', 'column': 'vaccines_one_dose', 'data': utils.ensure_int},
-            {'field': 'two_dose', 'column': 'vaccines_two_dose', 'data': utils.ensure_int},
-            {'field': 'hotspot', 'data': utils.ensure_int},
+            {'field': 'cases', 'type': coerce.INT},
+            {'field': 'deaths', 'type': coerce.INT},
+            {'field': 'tests', 'type': coerce.INT},
+            {'field': 'casechange', 'column': 'cases_change', 'type': coerce.INT},
+            {'field': 'deathchange', 'column': 'deaths_change', 'type': coerce.INT},
+            {'field': 'test_change', 'column': 'tests_change', 'type': coerce.INT},
+            {'field': 'case_means', 'column': 'cases_7_day_mean', 'type': coerce.FLOAT},
+            {'field': 'death_mean', 'column': 'deaths_7_day_mean', 'type': coerce.FLOAT},
+            {'field': 'test_means', 'column': 'tests_7_day_mean', 'type': coerce.FLOAT},
+            {'field': 'case_permill', 'column': 'cases_per_million', 'type': coerce.FLOAT},
+            {'field': 'death_permill', 'column': 'deaths_per_million', 'type': coerce.FLOAT},
+            {'field': 'test_permill', 'column': 'tests_per_million', 'type': coerce.FLOAT},
+            {'field': 'pos_rate', 'column': 'positivity_rate_7_day_mean', 'type': coerce.FLOAT},
+            {'field': 'rp2', 'column': 'positivity_rate_7_day_plus_mean', 'type': coerce.FLOAT},
+            {'field': 'pct_change_weekly_cases_7', 'type': coerce.FLOAT},
+            {'field': 'pct_change_weekly_cases_14', 'type': coerce.FLOAT},
+            {'field': 'pct_change_weekly_deaths_7', 'type': coerce.FLOAT},
+            {'field': 'pct_change_weekly_deaths_14', 'type': coerce.FLOAT},
+            {'field': 'pct_change_weekly_tests_7', 'type': coerce.FLOAT},
+            {'field': 'pct_change_weekly_tests_14', 'type': coerce.FLOAT},
+            {'field': 'pct_change_positivity_rate_7', 'type': coerce.FLOAT},
+            {'field': 'pct_change_positivity_rate_14', 'type': coerce.FLOAT},
+
+            {'field': 'pop', 'column': 'population', 'type': coerce.INT},
+            {'field': 'distributed', 'column': 'vaccines_distributed', 'type': coerce.INT},
+            {'field': 'administered', 'column': 'vaccines_administered', 'type': coerce.INT},
+            {'field': 'one_dose', 'column': 'vaccines_one_dose', 'type': coerce.INT},
+            {'field': 'two_dose', 'column': 'vaccines_two_dose', 'type': coerce.INT},
+            {'field': 'hotspot', 'type': coerce.INT},
         ]
-        self.filepath = '/'.join([constants.temp_dir, 'COVID-19-Data/State Trend Data/State_Trend_Data.csv'])
-        self.git = Git(constants.temp_dir)
+        self.filepath = repository_mirror.get_path('State Trend Data', 'State_Trend_Data.csv')
 
     def fetch(self):
-        if not os.path.isdir(constants.temp_dir):
-            os.mkdir(constants.temp_dir)
+        repository_mirror.sync()
 
-        if not os.path.isfile(self.filepath):
-            self.git.clone(GIT_REPO_URL, depth=1)
-
-        with open(self.filepath, newline='') as csvfile:
-            self.raw_data = csv.DictReader(io.StringIO(csvfile.read()))
+        # Rows are transformed as they are read and kept packed by column until save
+        compiled_fields = fields.compile_fields(self.fields, fields.VALUE_CONVENTION)
+        self.raw_data = columnar.RecordStore(compiled_fields.columns)
+        for batch in utils.batched(stream.file_csv_stream(self.filepath), fields.DEFAULT_BATCH_SIZE):
+            self.raw_data.extend(compiled_fields.rows([record for record in batch if not skip_record(record)]))
 
     def has_data(self):
         return self.raw_data is not None
@@ -80,44 +102,17 @@ class StateTrends:
         mysql_database.connect()
 
         if mysql_database.is_connected():
+            mysql_database.declare_natural_key(self.table_name, self.natural_key)
             mysql_database.start_transaction()
 
-            records = list(self.raw_data)
-            record_count = len(records)
-            progress_threshold = record_count // 100
+            record_count = len(self.raw_data)
+            progress_threshold = max(record_count // 100, 1)
             records_processed = 0
 
-            for record in records:
-                columns = []
-                values = []
-
-                records_processed += 1
-
-                if skip_record(record):
-                    continue
-
-                for field in self.fields:
-                    if field.__contains__('column'):
-                        columns.append(field['column'])
-                    elif field.__contains__('field'):
-                        if isinstance(field['field'], str):
-                            columns.append(field['field'])
-
-                    # Populating the values array
-                    if field.__contains__('data'):
-                        if isinstance(field['data'], types.FunctionType):
-                            values.append(field['data'].__call__(record[field['field']]))
-                        elif isinstance(field['data'], str):
-                            values.append(field['data'])
-
-                    elif field.__contains__('field'):
-                        if isinstance(field['field'], str):
-                            values.append(record[field['field']])
-                        elif isinstance(field['field'], types.FunctionType):
-                            values.append(field['field'].__call__(record))
-
-                mysql_database.insert(self.table_name, columns, values)
+            for batch in self.raw_data.batches(fields.DEFAULT_BATCH_SIZE):
+                mysql_database.insert_many(self.table_name, self.raw_data.columns, batch)
 
+                records_processed += len(batch)
                 utils.log("\rProgress: {}% - Records processed: {} of {}"
                           .format(records_processed // progress_threshold, records_processed, record_count),
                           newline=records_processed == record_count)
@@ -134,18 +129,83 @@ def convert_filename_to_date(filename):
     return '-'.join([timestamp[0:4], timestamp[4:6], timestamp[6:8]])
 
 
-def convert_to_float(value, retried=False):
-    valid_float = FLOAT_REGEX.match(value) is not None
-    if not valid_float:
-        value = convert_to_float(value.replace('<', '0'), True) if not retried else 0.0
+def get_filename_date(filename):
+    return utils.ensure_iso_date(convert_filename_to_date(filename))
+
+
+def normalize_race_record(record_data, date, find_location_key=False):
+    record_data['date'] = date
+    if '' in record_data:
+
+        if record_data[''] in constants.state_abbrev_map:
+            record_data['Location'] = record_data['']
+
+    elif find_location_key and 'Location' not in record_data:
+        location_key = None
+        for key in record_data.keys():
+            if key.endswith('Location'):
+                location_key = key
+
+        record_data['Location'] = record_data[location_key] if location_key is not None else location_key
+
+    return record_data
+
+
+def has_state_location(record):
+    return 'Location' in record and record['Location'] in constants.state_abbrev_map
+
+
+def parse_race_file(path, race_fields, find_location_key=False, encoding=None):
+    # Runs in a worker process, so only the packed rows travel back to the writer
+    date = convert_filename_to_date(os.path.basename(path))
+    with open(path, newline='', encoding=encoding) as csvfile:
+        records = [
+            normalize_race_record(record_data, date, find_location_key) for record_data in csv.DictReader(csvfile)
+        ]
+
+    # Files differ in which columns they carry, so the field spec is compiled once per file
+    available_fields = set()
+    for record in records:
+        available_fields.update(record.keys())
+
+    compiled_fields = fields.compile_fields(race_fields, fields.VALUE_CONVENTION, available_fields)
+    return columnar.RecordStore(
+        compiled_fields.columns, compiled_fields.rows([record for record in records if has_state_location(record)])
+    )
+
+
+def save_race_ethnicity_data(table_name, race_fields, paths, watermark, find_location_key=False, encoding=None):
+    mysql_database = database.Database()
+    mysql_database.connect()
+
+    if mysql_database.is_connected():
+        mysql_database.declare_natural_key(table_name, RACE_NATURAL_KEY)
+        mysql_database.start_transaction()
+
+    # Paths are sorted by their date prefix and results come back in that order
+    parse = functools.partial(
+        parse_race_file, race_fields=race_fields, find_location_key=find_location_key, encoding=encoding
+    )
+    workers = parallel.get_process_workers('KFF_PARSE_WORKERS', len(paths))
+    records_processed = 0
+
+    for rows in parallel.process_map(parse, paths, workers):
+        for batch in rows.batches(fields.DEFAULT_BATCH_SIZE):
+            mysql_database.insert_many(table_name, rows.columns, batch)
+
+            records_processed += len(batch)
+            utils.progress(records_processed)
 
-    return float(value)
+    mysql_database.commit()
+    watermark.store()
 
 
 class CasesByRace:
 
     def __init__(self):
         self.table_name = 'cases_by_race_ethnicity'
+        self.natural_key = RACE_NATURAL_KEY
+        self.watermark = metadata.Watermark(self.table_name)
         self.raw_data = None
         self.fields = [
             {'field': 'date', 'column': 'date', 'data': utils.ensure_iso_date},
@@ -156,183 +216,114 @@ class CasesByRace:
                 'data': utils.bool_to_int,
                 'default': 0
             },
-            {'field': 'White % of Cases', 'column': 'white_percentage_of_cases', 'data': convert_to_float},
+            {'field': 'White % of Cases', 'column': 'white_percentage_of_cases', 'type': coerce.BOUNDED_FLOAT},
             {
                 'field': 'White % of Total Population',
                 'column': 'white_percentage_of_population',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
-            {'field': 'Black % of Cases', 'column': 'black_percentage_of_cases', 'data': convert_to_float},
+            {'field': 'Black % of Cases', 'column': 'black_percentage_of_cases', 'type': coerce.BOUNDED_FLOAT},
             {
                 'field': 'Black % of Total Population',
                 'column': 'black_percentage_of_population',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
-            {'field': 'Hispanic % of Cases', 'column': 'hispanic_percentage_of_cases', 'data': convert_to_float},
+            {'field': 'Hispanic % of Cases', 'column': 'hispanic_percentage_of_cases', 'type': coerce.BOUNDED_FLOAT},
             {
                 'field': 'Hispanic % of Total Population',
                 'column': 'hispanic_percentage_of_population',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
-            {'field': 'Asian % of Cases', 'column': 'asian_percentage_of_cases', 'data': convert_to_float},
+            {'field': 'Asian % of Cases', 'column': 'asian_percentage_of_cases', 'type': coerce.BOUNDED_FLOAT},
             {
                 'field': 'Asian % of Total Population',
                 'column': 'asian_percentage_of_population',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'American Indian or Alaska Native % of Cases',
                 'column': 'american_indian_percentage_of_cases',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'American Indian or Alaska Native % of Total Population',
                 'column': 'american_indian_percentage_of_population',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'American Indian or Alaska Native % of Cases',
                 'column': 'alaska_native_percentage_of_cases',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'American Indian or Alaska Native % of Total Population',
                 'column': 'alaska_native_percentage_of_population',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'Native Hawaiian or Other Pacific Islander % of Cases',
                 'column': 'native_hawaiian_percentage_of_cases',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'Native Hawaiian or Other Pacific Islander % of Total Population',
                 'column': 'native_hawaiian_percentage_of_population',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'Native Hawaiian or Other Pacific Islander % of Cases',
                 'column': 'pacific_islander_percentage_of_cases',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'Native Hawaiian or Other Pacific Islander % of Total Population',
                 'column': 'pacific_islander_percentage_of_population',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
-            {'field': 'Other % of Cases', 'column': 'other_percentage_of_cases', 'data': convert_to_float},
+            {'field': 'Other % of Cases', 'column': 'other_percentage_of_cases', 'type': coerce.BOUNDED_FLOAT},
             {
                 'field': 'Other % of Total Population',
                 'column': 'other_percentage_of_population',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': '% of Cases with Known Race',
                 'column': 'known_race_percentage_of_cases',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': '% of Cases with Unknown Race',
                 'column': 'unknown_race_percentage_of_cases',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': '% of Cases with Known Ethnicity',
                 'column': 'known_ethnicity_percentage_of_cases',
-                'data': convert_to_float,
+                'type': coerce.BOUNDED_FLOAT,
                 'default': 0
             },
             {
                 'field': '% of Cases with Missing Ethnicity',
                 'column': 'unknown_ethnicity_percentage_of_cases',
-                'data': convert_to_float,
+                'type': coerce.BOUNDED_FLOAT,
                 'default': 0
             }
         ]
-        self.folder_path = '/'.join([constants.temp_dir, 'COVID-19-Data/Race Ethnicity COVID-19 Data/Cases and Deaths'])
-        self.git = Git(constants.temp_dir)
+        self.folder_path = repository_mirror.get_path(CASES_AND_DEATHS_FOLDER)
 
     def fetch(self):
-        if not os.path.isdir(constants.temp_dir):
-            os.mkdir(constants.temp_dir)
+        changed_files = get_changed_files(self.table_name)
 
-        if not os.path.isdir(self.folder_path):
-            self.git.clone(GIT_REPO_URL, depth=1)
-
-        all_files = os.listdir(self.folder_path)
-        all_files_length = len(all_files)
-        index = 0
-
-        self.raw_data = []
-        while index < all_files_length:
-            filename = all_files[index]
-            if matches_case_by_race(filename):
-                with open('/'.join([self.folder_path, filename]), newline='') as csvfile:
-                    self.raw_data.append({'filename': filename, 'data': csv.DictReader(io.StringIO(csvfile.read()))})
-
-            index += 1
+        self.watermark.load()
+        filenames = list_race_files(CASES_AND_DEATHS_FOLDER, matches_case_by_race, self.watermark, changed_files)
+        self.raw_data = ['/'.join([self.folder_path, filename]) for filename in filenames]
 
     def has_data(self):
         return self.raw_data is not None and len(self.raw_data) > 0
 
     def save(self):
-        mysql_database = database.Database()
-        mysql_database.connect()
-
-        if mysql_database.is_connected():
-            mysql_database.start_transaction()
-
-        records = []
-        for raw_record_data in self.raw_data:
-            for record_data in raw_record_data['data']:
-                record_data['date'] = convert_filename_to_date(raw_record_data['filename'])
-                if '' in record_data:
-
-                    if record_data[''] in constants.state_abbrev_map:
-                        record_data['Location'] = record_data['']
-
-                records.append(record_data)
-
-        record_count = len(records)
-        records_processed = 0
-
-        for record in records:
-            records_processed += 1
-            columns = []
-            values = []
-
-            if 'Location' in record and record['Location'] in constants.state_abbrev_map:
-
-                for field in self.fields:
-                    if field['field'] in record:
-
-                        if 'column' in field:
-                            columns.append(field['column'])
-                        elif 'field' in field:
-                            columns.append(field['field'])
-
-                        # Populating the values array
-                        if field.__contains__('data'):
-                            if isinstance(field['data'], types.FunctionType):
-                                values.append(field['data'].__call__(record[field['field']]))
-
-                        elif 'field' in field:
-                            values.append(record[field['field']])
-
-                    elif 'default' in field:
-                        if 'column' in field:
-                            columns.append(field['column'])
-                        elif 'field' in field:
-                            columns.append(field['field'])
-
-                        # Populating the values array
-                        values.append(field['default'])
-
-                mysql_database.insert(self.table_name, columns, values)
-
-            utils.progress(records_processed, record_count)
-
-        mysql_database.commit()
+        save_race_ethnicity_data(self.table_name, self.fields, self.raw_data, self.watermark)
+        repository_mirror.acknowledge(self.table_name)
 
 
 def matches_death_by_race(filename):
@@ -343,185 +334,118 @@ class DeathsByRace:
 
     def __init__(self):
         self.table_name = 'deaths_by_race_ethnicity'
+        self.natural_key = RACE_NATURAL_KEY
+        self.watermark = metadata.Watermark(self.table_name)
         self.raw_data = None
         self.fields = [
             {'field': 'date', 'column': 'date', 'data': utils.ensure_iso_date},
             {'field': 'Location', 'column': 'state'},
-            {'field': 'White % of Deaths', 'column': 'white_percentage_of_deaths', 'data': convert_to_float},
+            {'field': 'White % of Deaths', 'column': 'white_percentage_of_deaths', 'type': coerce.BOUNDED_FLOAT},
             {
                 'field': 'White % of Total Population',
                 'column': 'white_percentage_of_population',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
-            {'field': 'Black % of Deaths', 'column': 'black_percentage_of_deaths', 'data': convert_to_float},
+            {'field': 'Black % of Deaths', 'column': 'black_percentage_of_deaths', 'type': coerce.BOUNDED_FLOAT},
             {
                 'field': 'Black % of Total Population',
                 'column': 'black_percentage_of_population',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
-            {'field': 'Hispanic % of Deaths', 'column': 'hispanic_percentage_of_deaths', 'data': convert_to_float},
+            {'field': 'Hispanic % of Deaths', 'column': 'hispanic_percentage_of_deaths', 'type': coerce.BOUNDED_FLOAT},
             {
                 'field': 'Hispanic % of Total Population',
                 'column': 'hispanic_percentage_of_population',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
-            {'field': 'Asian % of Deaths', 'column': 'asian_percentage_of_deaths', 'data': convert_to_float},
+            {'field': 'Asian % of Deaths', 'column': 'asian_percentage_of_deaths', 'type': coerce.BOUNDED_FLOAT},
             {
                 'field': 'Asian % of Total Population',
                 'column': 'asian_percentage_of_population',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'American Indian or Alaska Native % of Deaths',
                 'column': 'american_indian_percentage_of_deaths',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'American Indian or Alaska Native % of Total Population',
                 'column': 'american_indian_percentage_of_population',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'American Indian or Alaska Native % of Deaths',
                 'column': 'alaska_native_percentage_of_deaths',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'American Indian or Alaska Native % of Total Population',
                 'column': 'alaska_native_percentage_of_population',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'Native Hawaiian of Other Pacific Islander % of Deaths',
                 'column': 'native_hawaiian_percentage_of_deaths',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'Native Hawaiian or Other Pacific Islander % of Total Population',
                 'column': 'native_hawaiian_percentage_of_population',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'Native Hawaiian of Other Pacific Islander % of Deaths',
                 'column': 'pacific_islander_percentage_of_deaths',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'Native Hawaiian or Other Pacific Islander % of Total Population',
                 'column': 'pacific_islander_percentage_of_population',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
-            {'field': 'Other % of Deaths', 'column': 'other_percentage_of_deaths', 'data': convert_to_float},
+            {'field': 'Other % of Deaths', 'column': 'other_percentage_of_deaths', 'type': coerce.BOUNDED_FLOAT},
             {
                 'field': 'Other % of Total Population',
                 'column': 'other_percentage_of_population',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': '% of Deaths with Known Race',
                 'column': 'known_race_percentage_of_deaths',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': '% of Deaths with Unknown Race',
                 'column': 'unknown_race_percentage_of_deaths',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': '% of Deaths with Known Ethnicity',
                 'column': 'known_ethnicity_percentage_of_deaths',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': '% of Deaths with Unknown Ethnicity',
                 'column': 'unknown_ethnicity_percentage_of_deaths',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             }
         ]
-        self.folder_path = '/'.join([constants.temp_dir, 'COVID-19-Data/Race Ethnicity COVID-19 Data/Cases and Deaths'])
-        self.git = Git(constants.temp_dir)
+        self.folder_path = repository_mirror.get_path(CASES_AND_DEATHS_FOLDER)
 
     def fetch(self):
-        if not os.path.isdir(constants.temp_dir):
-            os.mkdir(constants.temp_dir)
-
-        if not os.path.isdir(self.folder_path):
-            self.git.clone(GIT_REPO_URL, depth=1)
-
-        all_files = os.listdir(self.folder_path)
-        all_files_length = len(all_files)
-        index = 0
-
-        self.raw_data = []
-        while index < all_files_length:
-            filename = all_files[index]
-            if matches_death_by_race(filename):
-                with open('/'.join([self.folder_path, filename]), newline='', encoding='utf-8') as csvfile:
-                    self.raw_data.append({'filename': filename, 'data': csv.DictReader(io.StringIO(csvfile.read()))})
+        changed_files = get_changed_files(self.table_name)
 
-            index += 1
+        self.watermark.load()
+        filenames = list_race_files(CASES_AND_DEATHS_FOLDER, matches_death_by_race, self.watermark, changed_files)
+        self.raw_data = ['/'.join([self.folder_path, filename]) for filename in filenames]
 
     def has_data(self):
         return self.raw_data is not None and len(self.raw_data) > 0
 
     def save(self):
-        mysql_database = database.Database()
-        mysql_database.connect()
-
-        if mysql_database.is_connected():
-            mysql_database.start_transaction()
-
-        records = []
-        for raw_record_data in self.raw_data:
-            for record_data in raw_record_data['data']:
-                record_data['date'] = convert_filename_to_date(raw_record_data['filename'])
-                if '' in record_data:
-
-                    if record_data[''] in constants.state_abbrev_map:
-                        record_data['Location'] = record_data['']
-
-                records.append(record_data)
-
-        record_count = len(records)
-        records_processed = 0
-
-        for record in records:
-            records_processed += 1
-            columns = []
-            values = []
-
-            if 'Location' in record and record['Location'] in constants.state_abbrev_map:
-
-                for field in self.fields:
-                    if field['field'] in record:
-
-                        if 'column' in field:
-                            columns.append(field['column'])
-                        elif 'field' in field:
-                            columns.append(field['field'])
-
-                        # Populating the values array
-                        if 'data' in field:
-                            if isinstance(field['data'], types.FunctionType):
-                                values.append(field['data'].__call__(record[field['field']]))
-
-                        elif 'field' in field:
-                            values.append(record[field['field']])
-
-                    elif 'default' in field:
-                        if 'column' in field:
-                            columns.append(field['column'])
-                        elif 'field' in field:
-                            columns.append(field['field'])
-
-                        # Populating the values array
-                        values.append(field['default'])
-
-                mysql_database.insert(self.table_name, columns, values)
-
-            utils.progress(records_processed, record_count)
-
-        mysql_database.commit()
+        save_race_ethnicity_data(self.table_name, self.fields, self.raw_data, self.watermark, encoding='utf-8')
+        repository_mirror.acknowledge(self.table_name)
 
 
 def matches_vaccinations_by_race(filename):
@@ -532,6 +456,8 @@ class VaccinationsByRace:
 
     def __init__(self):
         self.table_name = 'vaccinations_by_race_ethnicity'
+        self.natural_key = RACE_NATURAL_KEY
+        self.watermark = metadata.Watermark(self.table_name)
         self.raw_data = None
         self.fields = [
             {'field': 'date', 'column': 'date', 'data': utils.ensure_iso_date},
@@ -545,158 +471,81 @@ class VaccinationsByRace:
             {
                 'field': 'White % of Vaccinations',
                 'column': 'white_percentage_of_vaccinations',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'Black % of Vaccinations',
                 'column': 'black_percentage_of_vaccinations',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'Hispanic % of Vaccinations',
                 'column': 'hispanic_percentage_of_vaccinations',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'Asian % of Vaccinations',
                 'column': 'asian_percentage_of_vaccinations',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'American Indian or Alaska Native % of Vaccinations',
                 'column': 'american_indian_percentage_of_vaccinations',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'American Indian or Alaska Native % of Vaccinations',
                 'column': 'alaska_native_percentage_of_vaccinations',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'Native Hawaiian or Other Pacific Islander % of Vaccinations',
                 'column': 'native_hawaiian_percentage_of_vaccinations',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'Native Hawaiian or Other Pacific Islander % of Vaccinations',
                 'column': 'pacific_islander_percentage_of_vaccinations',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': 'Other % of Vaccinations',
                 'column': 'other_percentage_of_vaccinations',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': '% of Vaccinations with Known Race',
                 'column': 'known_race_percentage_of_vaccinations',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': '% of Vaccinations with Unknown Race',
                 'column': 'unknown_race_percentage_of_vaccinations',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': '% of Vaccinations with Known Ethnicity',
                 'column': 'known_ethnicity_percentage_of_vaccinations',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             },
             {
                 'field': '% of Vaccinations with Unknown Ethnicity',
                 'column': 'unknown_ethnicity_percentage_of_vaccinations',
-                'data': convert_to_float
+                'type': coerce.BOUNDED_FLOAT
             }
         ]
-        self.folder_path = '/'.join([constants.temp_dir, 'COVID-19-Data/Race Ethnicity COVID-19 Data/Vaccines'])
-        self.git = Git(constants.temp_dir)
+        self.folder_path = repository_mirror.get_path(VACCINES_FOLDER)
 
     def fetch(self):
-        if not os.path.isdir(constants.temp_dir):
-            os.mkdir(constants.temp_dir)
-
-        if not os.path.isdir(self.folder_path):
-            self.git.clone(GIT_REPO_URL, depth=1)
-
-        all_files = os.listdir(self.folder_path)
-        all_files_length = len(all_files)
-        index = 0
-
-        self.raw_data = []
-        while index < all_files_length:
-            filename = all_files[index]
-            if matches_vaccinations_by_race(filename):
-                with open('/'.join([self.folder_path, filename]), newline='') as csvfile:
-                    self.raw_data.append({'filename': filename, 'data': csv.DictReader(io.StringIO(csvfile.read()))})
+        changed_files = get_changed_files(self.table_name)
 
-            index += 1
+        self.watermark.load()
+        filenames = list_race_files(VACCINES_FOLDER, matches_vaccinations_by_race, self.watermark, changed_files)
+        self.raw_data = ['/'.join([self.folder_path, filename]) for filename in filenames]
 
     def has_data(self):
         return self.raw_data is not None and len(self.raw_data) > 0
 
     def save(self):
-        mysql_database = database.Database()
-        mysql_database.connect()
-
-        if mysql_database.is_connected():
-            mysql_database.start_transaction()
-
-        records = []
-        for raw_record_data in self.raw_data:
-            for record_data in raw_record_data['data']:
-                record_data['date'] = convert_filename_to_date(raw_record_data['filename'])
-                if '' in record_data:
-
-                    if record_data[''] in constants.state_abbrev_map:
-                        record_data['Location'] = record_data['']
-
-                elif 'Location' not in record_data:
-                    location_key = None
-                    for key in record_data.keys():
-                        if key.endswith('Location'):
-                            location_key = key
-
-                    record_data['Location'] = record_data[location_key] if location_key is not None else location_key
-
-                records.append(record_data)
-
-        record_count = len(records)
-        records_processed = 0
-
-        for record in records:
-            records_processed += 1
-            columns = []
-            values = []
-
-            if 'Location' in record and record['Location'] in constants.state_abbrev_map:
-
-                for field in self.fields:
-                    if field['field'] in record:
-
-                        if 'column' in field:
-                            columns.append(field['column'])
-                        elif 'field' in field:
-                            columns.append(field['field'])
-
-                        # Populating the values array
-                        if 'data' in field:
-                            if isinstance(field['data'], types.FunctionType):
-                                values.append(field['data'].__call__(record[field['field']]))
-
-                        elif 'field' in field:
-                            values.append(record[field['field']])
-
-                    elif 'default' in field:
-                        if 'column' in field:
-                            columns.append(field['column'])
-                        elif 'field' in field:
-                            columns.append(field['field'])
-
-                        # Populating the values array
-                        values.append(field['default'])
-
-                mysql_database.insert(self.table_name, columns, values)
-
-            utils.progress(records_processed, record_count)
-
-        mysql_database.commit()
+        save_race_ethnicity_data(self.table_name, self.fields, self.raw_data, self.watermark, find_location_key=True)
+        repository_mirror.acknowledge(self.table_name)
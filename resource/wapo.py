@@ -1,56 +1,48 @@
-from common import utils, constants
-from data import database
-from resource import census
+from common import coerce, geocoding, http, instrumentation, utils, constants, stream
+from data import database, metadata
+from resource import census, fields
+
+from concurrent import futures
 
-import requests
-import types
 import json
-import csv
-import io
+import os
 
 URL = 'https://raw.githubusercontent.com/washingtonpost/data-police-shootings/master/fatal-police-shootings-data.csv'
+FCC_AREA_URL = 'https://geo.fcc.gov/api/census/area?lat={}&lon={}&format=json'
+COUNTY_COORDINATES_COLUMNS = ['longitude', 'latitude', 'city', 'county_location_data_id']
+# The Post's own id for each shooting; names, dates and cities repeat, so it is the only stable key
+SOURCE_ID_COLUMN = 'source_id'
+SOURCE_ID_DEFINITION = 'INT NULL'
 errors = 0
 
+geocode_cache = geocoding.GeocodeCache('fcc')
+
+
+def get_fcc_area(latitude, longitude):
+    # None when the lookup failed
+    cached_area = geocode_cache.get(latitude, longitude)
+    if cached_area is not None:
+        return cached_area
+
+    # Transient failures such as 502s are retried a bounded number of times by http.request
+    geo_county_request = http.request('GET', FCC_AREA_URL.format(latitude, longitude))
+    if geo_county_request.status_code != 200:
+        return None
+
+    geo_county_content = json.loads(geo_county_request.content.decode('utf-8'))
+    results = geo_county_content['results'] if 'results' in geo_county_content else []
+    area = {'county_name': results[0]['county_name'], 'state_name': results[0]['state_name']} \
+        if len(results) > 0 else {}
+    geocode_cache.put(latitude, longitude, area)
+    return area
 
-def get_county(record):
-    global errors
-    county_name = 'N/A'
-    geo_county_request_url = 'https://geo.fcc.gov/api/census/area?lat={}&lon={}&format=json'\
-        .format(record['latitude'], record['longitude'])
-    geo_county_request = requests.request('GET', geo_county_request_url)
-    if geo_county_request.status_code == 502:
-        errors += 1
-        return get_county(record)
-
-    elif geo_county_request.status_code == 200:
-        geo_county_content = json.loads(geo_county_request.content.decode('utf-8'))
-        if len(geo_county_content['results']) != 0:
-            state_name = geo_county_content['results'][0]['state_name']
-            county_name = geo_county_content['results'][0]['county_name'] \
-                if geo_county_content.__contains__('results') and len(geo_county_content['results']) > 0 \
-                else 'N/A'
-            db = database.Database()
-            db.connect()
-
-            results = db.select(
-                'county_location_data',
-                ['id'],
-                where="county={} and state={}".format(
-                    utils.escape_quotes(county_name + ' County'),
-                    utils.escape_quotes(state_name)
-                )
-            )
-            if len(results) != 0:
-                db.start_transaction()
-                columns = ['longitude', 'latitude', 'city', 'county_location_data_id']
-                for result in results:
-                    values = [record['longitude'], record['latitude'], record['city'], result[0]]
-                    db.insert('county_coordinates_data', columns, values)
-
-                db.commit()
-                db.close()
-
-    return county_name
+
+def resolve_fcc_areas(coordinates, workers):
+    # Maps each (latitude, longitude) to its FCC area, or None when the lookup failed
+    coordinates = list(coordinates)
+    with futures.ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        fetch = instrumentation.bind(lambda coordinate: get_fcc_area(coordinate[0], coordinate[1]))
+        return dict(zip(coordinates, executor.map(fetch, coordinates)))
 
 
 def get_signs_of_mental_illness(data):
@@ -70,26 +62,8 @@ def get_state(record):
         if constants.state_abbrev_map.__contains__(record['state']) else 'N/A'
 
 
-def int_or_null(value):
-    try:
-        int(value)
-    except ValueError:
-        value = None
-    except TypeError:
-        value = None
-    return value
-
-
-def get_age(value):
-    return int_or_null(value['age'])
-
-
-def ensure_latitude_float(record):
-    return utils.ensure_float(record['latitude'])
-
-
-def ensure_longitude_float(record):
-    return utils.ensure_float(record['longitude'])
+def get_date(record):
+    return utils.ensure_iso_date(record['date'])
 
 
 def create_cache_key(record):
@@ -100,14 +74,20 @@ class PoliceShootings:
 
     def __init__(self):
         self.table_name = 'police_shooting_data'
+        self.natural_key = (SOURCE_ID_COLUMN,)
+        self.watermark = metadata.Watermark(self.table_name)
         self.geo_locations = None
+        self.record_cache = {}
+        self.location_index = None
+        self.download = None
         self.raw_data = None
         self.fields = [
+            {'field': 'id', 'column': SOURCE_ID_COLUMN, 'type': coerce.NULLABLE_INT},
             {'field': 'date'},
             {'field': 'name'},
             {'field': 'manner_of_death'},
             {'field': 'armed'},
-            {'field': 'age', 'data': get_age},
+            {'field': 'age', 'type': coerce.NULLABLE_INT},
             {'field': 'gender'},
             {'field': 'race'},
             {'field': 'city'},
@@ -116,15 +96,19 @@ class PoliceShootings:
             {'field': 'threat_level'},
             {'field': 'flee'},
             {'field': 'body_camera', 'data': get_body_camera},
-            {'field': 'longitude', 'data': ensure_longitude_float},
-            {'field': 'latitude', 'data': ensure_latitude_float},
+            {'field': 'longitude', 'type': coerce.FLOAT},
+            {'field': 'latitude', 'type': coerce.FLOAT},
             {'field': 'is_geocoding_exact', 'data': get_is_geocoding_exact},
-            {'field': 'id', 'column': 'county', 'data': get_county}
+            {'field': 'id', 'column': 'county', 'data': self.get_county}
         ]
 
     def fetch(self):
-        request = requests.request('GET', URL + '')
-        self.raw_data = csv.DictReader(io.StringIO(request.content.decode('utf-8')))
+        self.download = http.cached_download(URL)
+        if not self.download.changed:
+            utils.log('No changes to {} since it was last loaded, skipping'.format(URL))
+            return
+
+        self.raw_data = stream.file_csv_stream(self.download.path)
 
         census_geo_locations = census.GeoLocations()
         census_geo_locations.fetch()
@@ -134,49 +118,92 @@ class PoliceShootings:
     def has_data(self):
         return self.raw_data is not None
 
+    def get_county(self, record):
+        cache_key = create_cache_key(record)
+        return self.record_cache[cache_key]['county'] if cache_key in self.record_cache else 'N/A'
+
+    def prefetch_counties(self, mysql_database, records):
+        global errors
+        # Resolves every coordinate up front so the save loop only does in-memory lookups. Known locations,
+        # county boundaries and nearby locations answer most of them; the rest go to the FCC API concurrently.
+        unresolved = {}
+        for record in records:
+            cache_key = create_cache_key(record)
+            if cache_key in self.record_cache or cache_key in unresolved:
+                continue
+
+            # The boundaries are exact, so the approximate nearest match is only used where they have no answer
+            boundary_county = census.get_county_boundaries().resolve(record['latitude'], record['longitude'])
+            if boundary_county is not None:
+                self.record_cache[cache_key] = {'county': boundary_county['county']}
+                continue
+
+            nearby_location = self.location_index.nearest(record['latitude'], record['longitude'])
+            if nearby_location is not None:
+                self.record_cache[cache_key] = nearby_location
+            else:
+                unresolved[cache_key] = record
+
+        if len(unresolved) == 0:
+            return
+
+        workers = int(os.getenv('WAPO_GEOCODE_WORKERS') or http.DEFAULT_WORKERS)
+        areas = resolve_fcc_areas([(record['latitude'], record['longitude']) for record in unresolved.values()],
+                                  workers)
+
+        # Failures are counted here rather than in the worker threads
+        errors += len([area for area in areas.values() if area is None])
+        county_index = census.load_county_index()
+        rows = []
+        for cache_key, record in unresolved.items():
+            area = areas[(record['latitude'], record['longitude'])]
+            if area is None or 'county_name' not in area:
+                continue
+
+            self.record_cache[cache_key] = {'county': area['county_name']}
+            county_location = county_index.get(area['county_name'] + ' County', area['state_name'])
+            if county_location is not None:
+                rows.append((record['longitude'], record['latitude'], record['city'], county_location['id']))
+
+        # The coordinates are committed on their own, ahead of the main transaction
+        mysql_database.start_transaction()
+        mysql_database.insert_many('county_coordinates_data', COUNTY_COORDINATES_COLUMNS, rows)
+        mysql_database.commit()
+        utils.log('Geocoded {} coordinates for {}, {} linked to counties'.format(
+            len(unresolved), self.table_name, len(rows)
+        ))
+
     def save(self):
         mysql_database = database.Database()
         mysql_database.connect()
 
         if mysql_database.is_connected():
 
-            records = list(self.raw_data)
-            record_count = len(records)
+            self.watermark.load()
+            records = self.watermark.filter(self.raw_data, get_date)
+            record_count = None
             records_processed = 0
-            record_cache = {}
 
             for location in self.geo_locations:
                 cache_key = create_cache_key(location)
-                record_cache[cache_key] = location
+                self.record_cache[cache_key] = location
 
-            mysql_database.start_transaction()
-
-            for record in records:
-                columns = []
-                values = []
+            self.location_index = geocoding.build_location_index(self.geo_locations)
+            self.prefetch_counties(mysql_database, self.watermark.filter(self.raw_data, get_date))
 
-                for field in self.fields:
-                    if field.__contains__('column'):
-                        columns.append(field['column'])
-                    elif field.__contains__('field'):
-                        if isinstance(field['field'], str):
-                            columns.append(field['field'])
-
-                    # Populating the values array
-                    if field.__contains__('data'):
-                        if field['field'] == 'id' and record_cache.__contains__(create_cache_key(record)):
-                            values.append(record_cache[create_cache_key(record)]['county'])
-                        elif isinstance(field['data'], types.FunctionType):
-                            values.append(field['data'].__call__(record))
+            mysql_database.ensure_column(self.table_name, SOURCE_ID_COLUMN, SOURCE_ID_DEFINITION)
+            mysql_database.declare_natural_key(self.table_name, self.natural_key)
+            mysql_database.start_transaction()
 
-                    elif field.__contains__('field'):
-                        if isinstance(field['field'], str):
-                            values.append(record[field['field']])
+            compiled_fields = fields.compile_fields(self.fields, fields.RECORD_CONVENTION)
 
-                mysql_database.insert(self.table_name, columns, values)
+            for batch in utils.batched(records, fields.DEFAULT_BATCH_SIZE):
+                mysql_database.insert_many(self.table_name, compiled_fields.columns, compiled_fields.rows(batch))
 
-                records_processed += 1
+                records_processed += len(batch)
                 utils.progress(records_processed, record_count)
 
             mysql_database.commit()
+            self.watermark.store()
+            self.download.acknowledge()
             utils.log('\nFinished uploading police_shooting_data with {} errors'.format(errors))